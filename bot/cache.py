@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+from bot.type import SimulateSwapOperation
+import threading
+import math
+import json
+import time
+
+
+class SimulationCache:
+    """ LRU cache with time to live of the simulate_swap_operations results.
+
+        Many users DCA the same pair with similar amounts at similar times. The cache serves the
+        repeated simulations from memory. The key of an entry is the route (the swap operations)
+        and the bucket of the offer amount. A cached quote is reused for an offer amount which differs at most
+        by `tolerance` (relative) from the cached offer amount. In this case the quote is scaled proportionally.
+    """
+
+    def __init__(self, max_size: int, ttl: float, tolerance: float):
+        """
+            Parameters:
+                - max_size (int): the maximum number of entries in the cache.
+                - ttl (float): the time to live of an entry in seconds.
+                - tolerance (float): the maximum relative difference between the offer amount
+                    and the cached offer amount, example: 0.001 (=0.1%). If 0, only the exact amount is reused.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        # key = (route, bucket), value = (created_at, offer_amount, amount)
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_route(swo: SimulateSwapOperation) -> str:
+        return json.dumps(swo.operations_to_dict(), sort_keys=True)
+
+    def _bucket(self, offer_amount: int) -> int:
+        if self.tolerance <= 0 or offer_amount <= 0:
+            return offer_amount
+        return int(math.log(offer_amount) / math.log1p(self.tolerance))
+
+    def _keys(self, swo: SimulateSwapOperation) -> Tuple[str, int]:
+        return (self.build_route(swo), self._bucket(int(swo.offer_amount)))
+
+    def get(self, swo: SimulateSwapOperation) -> Optional[int]:
+        """
+            Returns:
+                Optional[int]: the cached simulated amount of the target asset or None if there is no valid entry.
+        """
+        route, bucket = self._keys(swo)
+        offer_amount = int(swo.offer_amount)
+        now = time.time()
+        with self._lock:
+            # an amount close to a bucket boundary may be in the neighbouring bucket
+            for b in (bucket, bucket - 1, bucket + 1):
+                entry = self._cache.get((route, b))
+                if entry is None:
+                    continue
+                created_at, cached_offer_amount, amount = entry
+                if now - created_at > self.ttl:
+                    del self._cache[(route, b)]
+                    continue
+                if cached_offer_amount == 0 or \
+                        abs(offer_amount - cached_offer_amount) > self.tolerance * cached_offer_amount:
+                    continue
+                self._cache.move_to_end((route, b))
+                self.hits += 1
+                return amount * offer_amount // cached_offer_amount
+            self.misses += 1
+            return None
+
+    def set(self, swo: SimulateSwapOperation, amount: int):
+        route, bucket = self._keys(swo)
+        with self._lock:
+            self._cache[(route, bucket)] = (
+                time.time(), int(swo.offer_amount), amount)
+            self._cache.move_to_end((route, bucket))
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __repr__(self) -> str:
+        return "SimulationCache(size={}, hits={}, misses={})".format(
+            len(self._cache), self.hits, self.misses)
@@ -0,0 +1,74 @@
+from typing import Dict, List
+from datetime import datetime
+from bot.db.table.whitelisted_token import WhitelistedToken
+from bot.db.table.whitelisted_hop import WhitelistedHop
+from bot.db.table.whitelisted_fee_asset import WhitelistedFeeAsset
+from bot.type import AssetInfo, AstroSwap
+from bot.util import build_asset_info_map
+from bot.route import CompiledRoute
+
+
+class ConfigSnapshot:
+    """ In-process snapshot of the whitelisted tokens, hops and fee assets of the dca contract.
+
+        The snapshot is rebuilt by Sync.sync_dca_cfg and it is read by every purchase, so the
+        whitelisted tables are not queried again for each candidate route. A snapshot is never modified
+        after its creation: a new version replaces the old one.
+    """
+
+    def __init__(self, version: int, whitelisted_tokens: List[WhitelistedToken],
+                 whitelisted_hops: List[WhitelistedHop], whitelisted_fee_assets: List[WhitelistedFeeAsset]):
+        """
+            Parameters:
+                - version (int): the version of the snapshot. It is increased on every rebuild.
+                - whitelisted_tokens (List[WhitelistedToken]): the rows of the whitelisted_token table.
+                - whitelisted_hops (List[WhitelistedHop]): the rows of the whitelisted_hop table.
+                - whitelisted_fee_assets (List[WhitelistedFeeAsset]): the rows of the whitelisted_fee_asset table.
+        """
+        self.version = version
+        self.created_at = datetime.utcnow()
+        self.whitelisted_tokens = whitelisted_tokens
+        self.whitelisted_hops = whitelisted_hops
+        self.whitelisted_fee_assets = whitelisted_fee_assets
+        # key = asset's denomination, value = AssetInfo
+        self.asset_info_map: Dict[str, AssetInfo] = build_asset_info_map(
+            whitelisted_tokens)
+        # key = whitelisted hop id, value = WhitelistedHop
+        self.hop_map: Dict[int, WhitelistedHop] = {
+            h.id: h for h in whitelisted_hops}  # type: ignore
+        # key = fee asset's denomination, value = fee amount per hop
+        self.hop_fee_map: Dict[str, int] = {
+            str(a.denom): a.amount.real for a in whitelisted_fee_assets}
+        # key = hops string, value = CompiledRoute
+        self._compiled_routes: Dict[str, CompiledRoute] = {}
+
+    def compile_route(self, hops: str) -> CompiledRoute:
+        """ The routes are compiled once per config version.
+
+            Parameters:
+                - hops (str): the hops string, example: '<1><inverse-2>'
+        """
+        route = self._compiled_routes.get(hops)
+        if route is None:
+            route = CompiledRoute.compile(
+                hops, self.asset_info_map, self.hop_map)
+            self._compiled_routes[hops] = route
+        return route
+
+    def parse_hops(self, hops: str) -> List[AstroSwap]:
+        """
+            Parameters:
+                - hops (str): the hops string, example: '<1><inverse-2>'
+
+            Returns:
+                List[AstroSwap]: the hops (swap operations) of the hops string.
+        """
+        return list(self.compile_route(hops).operations)
+
+    def get_hops(self, hop_ids) -> List[WhitelistedHop]:
+        return [self.hop_map[i] for i in hop_ids if i in self.hop_map]
+
+    def __repr__(self) -> str:
+        return "ConfigSnapshot(version={}, tokens={}, hops={}, fee_assets={})".format(
+            self.version, len(self.whitelisted_tokens), len(self.whitelisted_hops),
+            len(self.whitelisted_fee_assets))
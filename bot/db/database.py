@@ -1,6 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from bot.db.table.user import User
-from bot.db.table.dca_order import DcaOrder
+from bot.db.table.dca_order import DcaOrder, reset_schedule, reset_schedule_pg
 from bot.db.table.whitelisted_token import WhitelistedToken
 from bot.db.table.whitelisted_hop import WhitelistedHop
 from bot.db.table.whitelisted_fee_asset import WhitelistedFeeAsset
@@ -9,12 +9,19 @@ from bot.db.table.purchase_history import PurchaseHistory
 from bot.db.table.token_price import TokenPrice
 from bot.db.view.whitelisted_hops_all import create_or_alter_view, drop_view
 from bot.db.table.log_error import LogError
+from bot.db.table.route import Route
+from bot.db.table.pool_reserve import PoolReserve
+from bot.db.table.pending_tx import PendingTx
+from bot.db.table.sync_checkpoint import SyncCheckpoint
+from bot.db.table.shard_worker import ShardWorker
+from bot.db.table.lease import Lease
 from bot.db.base import session_factory, engine, Base
 from bot.settings import DB_URL
-from sqlalchemy import exc, inspect, text, delete
+from sqlalchemy import exc, inspect, text, delete, update, select, or_, Integer, BigInteger
 from sqlalchemy.orm import scoped_session
+from sqlalchemy.dialects import sqlite, postgresql
 from bot.db.pd_df import DF
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 from functools import lru_cache
 import json
 import logging
@@ -27,9 +34,90 @@ def create_database_objects():
     logger.info(
         "*** create_database_objects: {} ***".format(DB_URL))
     Base.metadata.create_all(bind=engine)
+    upgrade_database_objects()
     create_or_alter_view()
 
 
+def create_shard_objects():
+    """ Create the tables of the shard coordinator (see bot/shard.py). The workers of the sharded mode need them
+        to elect the leader, which then creates the other objects of the db.
+    """
+    tables = [ShardWorker.__table__, Lease.__table__]
+    try:
+        Base.metadata.create_all(bind=engine, tables=tables)
+    except exc.SQLAlchemyError:
+        # another worker may have created the tables meanwhile
+        if not is_database_created(tables):
+            raise
+
+
+def is_database_created(tables: Optional[List[Any]] = None) -> bool:
+    """
+        Parameters:
+            - tables (list): the tables to check. All the tables of the bot if None.
+
+        Returns:
+            bool: True if the tables and all their columns exist in the db.
+    """
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    for table in (Base.metadata.sorted_tables if tables is None else tables):
+        if table.name not in existing_tables:
+            return False
+        existing_columns = [c["name"]
+                            for c in inspector.get_columns(table.name)]
+        if any(c.name not in existing_columns for c in table.columns):
+            return False
+    return True
+
+
+def upgrade_database_objects():
+    """ Upgrade a db created by a previous version of the bot. create_all only creates the missing tables,
+        so the columns and the indexes added to an existing table are created here, and the triggers whose
+        definition has changed are replaced. It runs on every start. The columns added to an existing table
+        must be nullable. The integer columns widened to BigInteger (e.g. the amounts) are altered on postgresql,
+        a sqlite integer is always stored on 64 bits.
+    """
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        # postgresql can't alter the columns used by a trigger: the trigger is re-created below
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("DROP TRIGGER IF EXISTS reset_schedule"))
+        elif engine.dialect.name == "postgresql":
+            conn.execute(
+                text("DROP TRIGGER IF EXISTS reset_schedule ON dca_order"))
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {c["name"]: c
+                                for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    existing_type = existing_columns[column.name]["type"]
+                    if engine.dialect.name == "postgresql" and isinstance(column.type, BigInteger) \
+                            and isinstance(existing_type, Integer) and not isinstance(existing_type, BigInteger):
+                        logger.info("upgrade_database_objects: alter column {}.{} to {}".format(
+                            table.name, column.name, column.type))
+                        conn.execute(text("ALTER TABLE {} ALTER COLUMN {} TYPE {}".format(
+                            preparer.format_table(table), preparer.format_column(column),
+                            column.type.compile(dialect=engine.dialect))))
+                    continue
+                assert column.nullable, "Unable to add the column {}.{} to an existing table: it is not nullable".format(
+                    table.name, column.name)
+                logger.info("upgrade_database_objects: add column {}.{}".format(
+                    table.name, column.name))
+                conn.execute(text("ALTER TABLE {} ADD COLUMN {} {}".format(
+                    preparer.format_table(table), preparer.format_column(column),
+                    column.type.compile(dialect=engine.dialect))))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+        # the triggers are only created with their table: replace the ones whose definition has changed
+        if engine.dialect.name == "sqlite":
+            conn.execute(reset_schedule)
+        elif engine.dialect.name == "postgresql":
+            conn.execute(reset_schedule_pg)
+
+
 def drop_database_objects():
     logger.info(
         "*** drop_database_objects: {} ***".format(DB_URL))
@@ -46,9 +134,10 @@ def db_persist(func):
     def persist(*args, **kwargs):
         session = Session()
         try:
-            func(*args, **kwargs)
+            result = func(*args, **kwargs)
             session.commit()
             logger.debug("success calling db func: " + func.__name__)
+            return result
         except exc.SQLAlchemyError as e:
             logger.error(e.args)
             session.rollback()
@@ -57,6 +146,18 @@ def db_persist(func):
     return persist
 
 
+def db_query(func):
+    """ Close the session of a read, so that its transaction does not hold locks on the tables
+        (e.g. postgresql can't drop or alter a table read by an open transaction).
+    """
+    def query(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            Session().close()
+    return query
+
+
 class Database:
 
     def get_tables_names(self):
@@ -80,15 +181,25 @@ class Database:
     def log_purchase_history(self, order_id: str, initial_amount: int,
                              initial_denom: str, target_denom: str,
                              dca_amount: int, hops: str, fee_redeem: str,
-                             success: bool, err_msg: str):
+                             success: bool, err_msg: str, txhash: Optional[str] = None):
         logger.info("log_purchase_history")
 
         session = Session()
         ph = PurchaseHistory(order_id, initial_amount, initial_denom,
                              target_denom, dca_amount, hops,
-                             fee_redeem, success, err_msg)
+                             fee_redeem, success, err_msg, txhash)
         session.add(ph)
 
+    @db_persist
+    def confirm_pending_tx(self, txhash: str, success: bool, err_msg: str):
+        """ Update the success of the purchases of a tx broadcast in sync mode and remove
+            the tx from the pending_tx table within the same transaction.
+        """
+        session = Session()
+        session.execute(update(PurchaseHistory).where(PurchaseHistory.txhash == txhash).values(
+            success=success, err_msg=err_msg))
+        session.execute(delete(PendingTx).where(PendingTx.txhash == txhash))
+
     @db_persist
     def log_error(self, err_msg: str, calling_method: str, order_id: Optional[str] = None, user_address: Optional[str] = None):
         logger.error("calling_method={}, order_id={}, user_address={}, err_msg={}".format(
@@ -103,11 +214,173 @@ class Database:
         logger.info(f'Deleting {table.__tablename__} table')
         table.__table__.drop(engine)
 
-    def query(self, table_object, filters: List[Any] = []):
+    @db_persist
+    def bulk_upsert(self, table_object: Any, rows: List[Any], orphan_filter: Optional[Any] = None,
+                    only_changed: bool = False) -> int:
+        """ Insert or update rows with INSERT ... ON CONFLICT DO UPDATE statements and delete the orphans
+            within the same transaction.
+
+            Parameters:
+                - table_object: the class which model the table in the database.
+                - rows (list): instances of table_object. Only the columns set on the rows are updated,
+                    e.g. the columns schedule and next_run_time of an existing dca order are preserved.
+                - orphan_filter: if given, the rows matching it which are not in rows are deleted,
+                    e.g. DcaOrder.user_address == user_address. Use sqlalchemy.true() for the whole table.
+                - only_changed (bool): if True, the rows identical to the stored ones are not written,
+                    so the update triggers do not fire for them.
+
+            Returns:
+                int: the number of rows written.
+        """
+        return Database._bulk_upsert(Session(), table_object, rows, orphan_filter, only_changed)
+
+    @staticmethod
+    def _bulk_upsert(session: Any, table_object: Any, rows: List[Any], orphan_filter: Optional[Any] = None,
+                     only_changed: bool = False, chunk_size: int = 500) -> int:
+        table = table_object.__table__
+        primary_keys = [c.name for c in table.primary_key.columns]
+        insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+
+        values = [{c.name: getattr(row, c.name) for c in table.columns if c.name in row.__dict__}
+                  for row in rows]
+        # a multi-row insert has a single column list, so the rows must set the same columns
+        columns = set(values[0].keys()) if len(values) > 0 else set()
+        assert all(set(v.keys()) == columns for v in values), \
+            "Expected the rows of {} to set the same columns. Got {}".format(
+                table.name, sorted(set(tuple(sorted(v.keys())) for v in values)))
+        # a row can't be updated twice by the same statement: the last duplicate wins
+        values = list({tuple(v[k] for k in primary_keys): v for v in values}.values())
+        changed_values = Database._filter_changed(session, table, primary_keys, values) \
+            if only_changed else values
+        for i in range(0, len(changed_values), chunk_size):
+            chunk = changed_values[i:i + chunk_size]
+            stmt = insert(table).values(chunk)
+            update_columns = {c: stmt.excluded[c]
+                              for c in sorted(columns) if c not in primary_keys}
+            if len(update_columns) == 0:
+                stmt = stmt.on_conflict_do_nothing(index_elements=primary_keys)
+            else:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=primary_keys, set_=update_columns)
+            session.execute(stmt)
+
+        if orphan_filter is not None:
+            assert len(primary_keys) == 1, "Expected a single primary key column. Got {}".format(
+                primary_keys)
+            pk = table.c[primary_keys[0]]
+            session.execute(delete(table).where(orphan_filter).where(
+                pk.not_in([v[primary_keys[0]] for v in values])))
+        return len(changed_values)
+
+    @staticmethod
+    def _filter_changed(session: Any, table: Any, primary_keys: List[str], values: List[dict]) -> List[dict]:
+        """
+            Returns:
+                List[dict]: the values which are new or differ from the stored rows.
+        """
+        if len(values) == 0:
+            return values
+        assert len(primary_keys) == 1, "Expected a single primary key column. Got {}".format(
+            primary_keys)
+        pk = primary_keys[0]
+        stored = {row[pk]: row for row in session.execute(select(table).where(
+            table.c[pk].in_([v[pk] for v in values]))).mappings()}
+
+        def _is_same(a: Any, b: Any) -> bool:
+            # e.g. an amount given as string is stored as integer
+            return a == b or (a is not None and b is not None and str(a) == str(b))
+        return [v for v in values if v[pk] not in stored or
+                not all(_is_same(stored[v[pk]][c], v[c]) for c in v.keys())]
+
+    @db_persist
+    def save_users_data(self, users_data: List[Tuple[str, str, List[UserTipBalance], List[DcaOrder]]]) -> int:
+        """ Replace the tip balances and the dca orders of several users and flag them as synced
+            within the same transaction. The users whose sync_hash has not changed are only flagged as synced.
+            For the other users only the new or modified rows are written.
+
+            Parameters:
+                - users_data (list): (user address, sync hash, tip balances, dca orders) of every user.
+
+            Returns:
+                int: the number of tip balances and dca orders written.
+        """
+        session = Session()
+        stored_hashes = dict(session.query(User.id, User.sync_hash).filter(
+            User.id.in_([u[0] for u in users_data])).all())  # type: ignore
+
+        written = 0
+        for user_address, sync_hash, tips, orders in users_data:
+            if stored_hashes.get(user_address) == sync_hash:
+                continue
+            written += Database._bulk_upsert(session, UserTipBalance, tips,
+                                             UserTipBalance.user_address == user_address, True)
+            written += Database._bulk_upsert(session, DcaOrder, orders,
+                                             DcaOrder.user_address == user_address, True)
+        Database._bulk_upsert(session, User, [User(u[0], True, u[1]) for u in users_data],
+                              only_changed=True)
+        logger.info("save_users_data: {} users, {} rows written".format(
+            len(users_data), written))
+        return written
+
+    @db_persist
+    def reset_expired_schedules(self, user_address: Optional[str] = None, order_ids: Optional[List[str]] = None) -> int:
+        """ Reset schedule=False and next_run_time=NULL of the scheduled orders whose next_run_time is expired,
+            i.e. the purchase did not go through (see the trigger reset_schedule for the successful purchases).
+
+            Parameters:
+                - user_address (str): if given, only the orders of this user are reset.
+                - order_ids (list): if given, only these orders are reset.
+
+            Returns:
+                int: the number of orders reset.
+        """
+        session = Session()
+        stmt = update(DcaOrder).where(DcaOrder.schedule == True).where(  # type: ignore
+            DcaOrder.next_run_time < datetime.utcnow())
+        if user_address is not None:
+            stmt = stmt.where(DcaOrder.user_address == user_address)
+        if order_ids is not None:
+            stmt = stmt.where(DcaOrder.id.in_(order_ids))  # type: ignore
+        result = session.execute(stmt.values(
+            schedule=False, next_run_time=None).execution_options(synchronize_session=False))
+        if result.rowcount > 0:
+            logger.info("reset_expired_schedules: {} orders".format(
+                result.rowcount))
+        return result.rowcount
+
+    @db_persist
+    def update_schedule(self, order_id: str, schedule: bool, next_run_time: Optional[datetime]):
+        """ Only update the columns schedule and next_run_time of the order. The other columns are written by
+            the user sync only, so a stale order loaded before a sync can't overwrite them (the sync skips
+            the users whose sync_hash has not changed, so it would never repair them).
+        """
+        session = Session()
+        session.execute(update(DcaOrder).where(DcaOrder.id == order_id).values(
+            schedule=schedule, next_run_time=next_run_time).execution_options(synchronize_session=False))
+
+    @db_persist
+    def replace_routes(self, start_denoms: List[str], routes: List[Route],
+                       checkpoint: Optional[SyncCheckpoint] = None):
+        """ Delete all the routes starting from start_denoms and insert the new routes
+            within the same transaction.
+
+            :param SyncCheckpoint checkpoint: the depth of the materialized routes, saved with the routes.
+        """
+        session = Session()
+        session.execute(delete(Route).where(
+            Route.start_denom.in_(start_denoms)))  # type: ignore
+        session.add_all(routes)
+        if checkpoint is not None:
+            session.merge(checkpoint)
+
+    @db_query
+    def query(self, table_object, filters: List[Any] = [], order_by: List[Any] = []):
         session = Session()
         query = session.query(table_object)
         for f in filters:
             query = query.filter(f)
+        if order_by:
+            query = query.order_by(*order_by)
 
         result = query.all()
 
@@ -165,6 +438,115 @@ class Database:
             filters.append(PurchaseHistory.success == success)
         return self.query(PurchaseHistory, filters)
 
+    @db_query
+    def get_pending_txs(self, limit: Optional[int] = None) -> List[PendingTx]:
+        """ The oldest pending txs first.
+        """
+        session = Session()
+        query = session.query(PendingTx).order_by(PendingTx.create_at)
+        if limit is not None:
+            query = query.limit(limit)
+        result = query.all()
+        session.expunge_all()
+        return result
+
+    @db_query
+    def get_tx_order_ids(self, txhashes: Optional[List[str]] = None) -> List[str]:
+        """
+            Returns:
+                List[str]: the ids of the orders purchased by txhashes. If txhashes is None, the ids of
+                    the orders purchased by the pending txs.
+        """
+        session = Session()
+        query = session.query(PurchaseHistory.order_id).distinct()
+        if txhashes is None:
+            query = query.join(PendingTx, PendingTx.txhash == PurchaseHistory.txhash)
+        else:
+            query = query.filter(
+                PurchaseHistory.txhash.in_(txhashes))  # type: ignore
+        return [row[0] for row in query.all()]
+
+    @db_query
+    def get_pending_tx_users(self) -> Dict[str, Set[str]]:
+        """
+            Returns:
+                dict: key = hash of a pending tx, value = the addresses of the users purchased by the tx.
+        """
+        session = Session()
+        query = session.query(PendingTx.txhash, DcaOrder.user_address) \
+            .outerjoin(PurchaseHistory, PurchaseHistory.txhash == PendingTx.txhash) \
+            .outerjoin(DcaOrder, DcaOrder.id == PurchaseHistory.order_id)
+        result: Dict[str, Set[str]] = {}
+        for txhash, user_address in query.all():
+            users = result.setdefault(txhash, set())
+            if user_address is not None:
+                users.add(user_address)
+        return result
+
+    def heartbeat_worker(self, worker_id: str):
+        self.insert_or_update(ShardWorker(worker_id))
+
+    def get_live_workers(self, ttl: int) -> List[str]:
+        """
+            Returns:
+                List[str]: the ids of the workers whose last heartbeat is at most ttl seconds old.
+        """
+        min_heartbeat_at = datetime.utcnow() - timedelta(seconds=ttl)
+        return [str(w.id) for w in self.query(ShardWorker, [ShardWorker.heartbeat_at >= min_heartbeat_at],
+                                              [ShardWorker.id])]
+
+    @db_persist
+    def remove_worker(self, worker_id: str):
+        session = Session()
+        session.execute(delete(ShardWorker).where(
+            ShardWorker.id == worker_id))
+
+    @db_persist
+    def claim_lease(self, name: str, worker_id: str, expire_at: datetime, worker_ttl: int) -> bool:
+        """ Claim or renew the lease name with a single compare-and-set statement
+            (INSERT ... ON CONFLICT DO UPDATE ... WHERE). The lease is granted if it does not exist,
+            if it is already held by worker_id, if it has expired or if its holder is not alive anymore
+            (no heartbeat for worker_ttl seconds, see shard_worker table).
+
+            Returns:
+                bool: True if worker_id holds the lease until expire_at.
+        """
+        session = Session()
+        now = datetime.utcnow()
+        insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+        live_workers = select(ShardWorker.id).where(
+            ShardWorker.heartbeat_at >= now - timedelta(seconds=worker_ttl))
+        stmt = insert(Lease.__table__).values(
+            name=name, worker_id=worker_id, expire_at=expire_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Lease.name],
+            set_={"worker_id": stmt.excluded.worker_id,
+                  "expire_at": stmt.excluded.expire_at},
+            where=or_(Lease.worker_id == stmt.excluded.worker_id,
+                      Lease.expire_at < now,
+                      Lease.worker_id.not_in(live_workers)))  # type: ignore
+        return session.execute(stmt).rowcount == 1
+
+    @db_persist
+    def release_leases(self, names: List[str], worker_id: str):
+        """ Release the leases held by worker_id. The leases of the other workers are left untouched.
+        """
+        session = Session()
+        session.execute(delete(Lease).where(Lease.name.in_(names)).where(  # type: ignore
+            Lease.worker_id == worker_id))
+
+    def get_leases(self, worker_id: Optional[str] = None) -> List[Lease]:
+        filters = [] if worker_id is None else [Lease.worker_id == worker_id]
+        return self.query(Lease, filters)
+
+    def get_checkpoint(self, name: str) -> Optional[int]:
+        """
+            Returns:
+                Optional[int]: the last block height processed by the sync job name. None if it never ran.
+        """
+        result = self.query(SyncCheckpoint, [SyncCheckpoint.name == name])
+        return None if len(result) == 0 else int(str(result[0].height))
+
     def get_user_tip_balance(self, user_address: Optional[str] = None) -> List[UserTipBalance]:
         filters = [] if user_address == None else [
             UserTipBalance.user_address == user_address]
@@ -188,6 +570,25 @@ class Database:
     def get_whitelisted_hops(self) -> List[WhitelistedHop]:
         return self.query(WhitelistedHop)
 
+    def get_routes(self, start_denom: Optional[str] = None, target_denom: Optional[str] = None,
+                   hops_len: Optional[int] = None) -> List[Route]:
+        """ Indexed lookup of the materialized routes between a start asset and a target asset.
+
+            :param int hops_len: the maximum number of hops of the routes.
+        """
+        filters = [] if start_denom == None else [
+            Route.start_denom == start_denom]
+        if target_denom != None:
+            filters.append(Route.target_denom == target_denom)
+        if hops_len != None:
+            filters.append(Route.hops_len <= hops_len)
+        return self.query(Route, filters, [Route.hops_len, Route.id])
+
+    def get_pool_reserve(self, pair_ids: Optional[List[str]] = None) -> List[PoolReserve]:
+        filters = [] if pair_ids == None else [
+            PoolReserve.pair_id.in_(pair_ids)]  # type: ignore
+        return self.query(PoolReserve, filters)
+
     # @lru_cache(maxsize=10, typed=True)
     def get_whitelisted_hops_all(self, start_denom: str = "", target_denom: str = "", hops_len: int = 0) -> List[dict]:
         """ This view provide the complete list of hops (swap operations) that the bot can chose from.
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, event, \
-    DDL, DateTime
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Boolean, event, \
+    DDL, DateTime, Index
 from bot.db.base import Base
 from bot.type import Order
 from bot.db.table import row_string
@@ -15,15 +15,15 @@ class DcaOrder(Base):
     user_address = Column(String, ForeignKey('user.id', ondelete="CASCADE"))
     # The order id stored in the blockchain. It is unique only relative to the user.
     dca_order_id = Column(Integer, nullable=False)
-    token_allowance = Column(Integer)
+    token_allowance = Column(BigInteger)
     initial_asset_class = Column(String, nullable=False)
     initial_asset_denom = Column(String, nullable=False)
-    initial_asset_amount = Column(Integer, nullable=False)
+    initial_asset_amount = Column(BigInteger, nullable=False)
     target_asset_class = Column(String, nullable=False)
     target_asset_denom = Column(String, nullable=False)
     interval = Column(Integer, nullable=False)
-    last_purchase = Column(Integer)
-    dca_amount = Column(Integer, nullable=False)
+    last_purchase = Column(BigInteger)
+    dca_amount = Column(BigInteger, nullable=False)
     max_spread = Column(String, nullable=False)
     max_hops = Column(Integer, nullable=False)
 
@@ -37,6 +37,15 @@ class DcaOrder(Base):
     # if schedule=True.
     next_run_time = Column(DateTime)
 
+    __table_args__ = (
+        # the scheduler picks up the orders not scheduled yet and resets the expired ones
+        Index('ix_dca_order_schedule_next_run_time',
+              'schedule', 'next_run_time'),
+        # the orders of a user are synced and rescheduled together
+        Index('ix_dca_order_user_address_schedule',
+              'user_address', 'schedule'),
+    )
+
     def __init__(self, user_address: str, max_spread: str, max_hops: int,  order: Order):
         self.id = DcaOrder.build_id(user_address, order.id)
         self.user_address = user_address
@@ -71,21 +80,37 @@ class DcaOrder(Base):
 
 # After each successful purchase we expect the initial_asset_amount to decrese.
 # In this case the schedule flag will be reset to 0.
+# The trigger only fires when initial_asset_amount decreases and it only updates the same row (primary key lookup),
+# so a write on dca_order stays O(1) however large the table is.
 # Sometimes due to various reason (fees are insufficient, database lock, ..) the purchase does not go through but the
-# schedule flag is still True with an next_run_time less than the current time. Also for this situation we will
-# reset the schedule to False.
+# schedule flag is still True with an next_run_time less than the current time. These orders are reset explicitly
+# by Database.reset_expired_schedules (see ExecOrder.sync_and_schedule and ExecOrder.schedule_orders).
 # Entry with schedule=False will be re-schedule by the bot with an appropriate future next_run_time.
 reset_schedule = DDL("""
-CREATE TRIGGER reset_schedule AFTER UPDATE ON dca_order
+CREATE TRIGGER reset_schedule AFTER UPDATE OF initial_asset_amount ON dca_order
+WHEN new.initial_asset_amount < old.initial_asset_amount     /*successful purchase*/
 BEGIN
       UPDATE dca_order
-        SET schedule = 0, 
+        SET schedule = 0,
             next_run_time = NULL
-      WHERE  (
-                id = new.id AND (new.initial_asset_amount < old.initial_asset_amount)     /*successful purchase*/
-            ) OR ( 
-                schedule = 1 AND (ifnull(next_run_time, '9999-01-01') < datetime('now'))  /*unsuccessful purchase*/
-            );
+      WHERE id = new.id;
 END
   """)
-event.listen(DcaOrder.__table__, 'after_create', reset_schedule)
+event.listen(DcaOrder.__table__, 'after_create',
+             reset_schedule.execute_if(dialect="sqlite"))
+
+# postgresql equivalent of reset_schedule. The row is reset before it is written.
+reset_schedule_pg = DDL("""
+CREATE OR REPLACE FUNCTION dca_order_reset_schedule() RETURNS trigger AS $$
+BEGIN
+      NEW.schedule = FALSE;
+      NEW.next_run_time = NULL;
+      RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER reset_schedule BEFORE UPDATE OF initial_asset_amount ON dca_order
+FOR EACH ROW WHEN (NEW.initial_asset_amount < OLD.initial_asset_amount)
+EXECUTE FUNCTION dca_order_reset_schedule();
+  """)
+event.listen(DcaOrder.__table__, 'after_create',
+             reset_schedule_pg.execute_if(dialect="postgresql"))
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, String, DateTime
+from bot.db.base import Base
+from bot.db.table import row_string
+from datetime import datetime
+
+
+class Lease(Base):
+    """ A lease held by a worker of the sharded mode (see Database.claim_lease). The lease of an order is
+        held by the worker which schedules and purchases it, the lease 'leader' by the worker which runs
+        the singleton jobs.
+    """
+    __tablename__ = 'lease'
+
+    # an order id or the name of a singleton lease, example: leader
+    name = Column(String, primary_key=True)
+    worker_id = Column(String, nullable=False, index=True)
+    expire_at = Column(DateTime, nullable=False)
+
+    def __init__(self, name: str, worker_id: str, expire_at: datetime):
+        self.name = name
+        self.worker_id = worker_id
+        self.expire_at = expire_at
+
+    def __repr__(self) -> str:
+        return row_string(self)
@@ -10,8 +10,10 @@ class LogError(Base):
 
     id = Column(Integer, primary_key=True)
     create_at = Column(DateTime, default=datetime.utcnow())
-    order_id = Column(String, ForeignKey("dca_order.id", ondelete="CASCADE"))
-    user_address = Column(String, ForeignKey("user.id", ondelete="CASCADE"))
+    order_id = Column(String, ForeignKey(
+        "dca_order.id", ondelete="CASCADE"), index=True)
+    user_address = Column(String, ForeignKey(
+        "user.id", ondelete="CASCADE"), index=True)
     calling_method = Column(String)
     msg = Column(String)
 
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, String, DateTime
+from bot.db.base import Base
+from bot.db.table import row_string
+from datetime import datetime
+
+
+class PendingTx(Base):
+    """ A tx broadcast in sync mode which is not confirmed yet. The purchases of the tx are
+        stored in the purchase_history table with the same txhash.
+    """
+    __tablename__ = 'pending_tx'
+
+    txhash = Column(String, primary_key=True)
+    create_at = Column(DateTime, nullable=False)
+
+    def __init__(self, txhash: str):
+        self.txhash = txhash
+        self.create_at = datetime.utcnow()
+
+    def __repr__(self) -> str:
+        return row_string(self)
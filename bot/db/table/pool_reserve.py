@@ -0,0 +1,46 @@
+from sqlalchemy import Column, String, ForeignKey, DateTime
+from bot.db.base import Base
+from bot.type import Asset
+from bot.db.table import row_string
+from datetime import datetime
+from typing import Dict, List
+
+
+class PoolReserve(Base):
+    """ Snapshot of the reserves of a whitelisted astroport pair. The reserves are used
+        to simulate the swap operations off-chain (see bot/simulator.py).
+    """
+    __tablename__ = 'pool_reserve'
+
+    # The address of the astroport pair contract
+    pair_addr = Column(String, primary_key=True)
+    pair_id = Column(String, ForeignKey(
+        "whitelisted_hop.pair_id", ondelete="CASCADE"), nullable=False, index=True)
+    pair_type = Column(String, nullable=False)
+    # The amounts are stored as string because an Uint128 does not fit into a sqlite integer.
+    asset1_denom = Column(String, nullable=False)
+    asset1_amount = Column(String, nullable=False)
+    asset2_denom = Column(String, nullable=False)
+    asset2_amount = Column(String, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __init__(self, pair_addr: str, pair_id: str, pair_type: str, assets: List[Asset]):
+        self.pair_addr = pair_addr
+        self.pair_id = pair_id
+        self.pair_type = pair_type
+        self.asset1_denom = assets[0].get_denom()
+        self.asset1_amount = assets[0].get_asset()["amount"]
+        self.asset2_denom = assets[1].get_denom()
+        self.asset2_amount = assets[1].get_asset()["amount"]
+        self.updated_at = datetime.utcnow()
+
+    def get_reserves(self) -> Dict[str, int]:
+        """
+            Returns:
+                dict: key = asset's denomination, value = reserve amount
+        """
+        return {str(self.asset1_denom): int(str(self.asset1_amount)),
+                str(self.asset2_denom): int(str(self.asset2_amount))}
+
+    def __repr__(self) -> str:
+        return row_string(self)
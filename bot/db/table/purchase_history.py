@@ -1,8 +1,9 @@
 from xmlrpc.client import Boolean
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, DateTime, Boolean
 from bot.db.base import Base
 from bot.db.table import row_string
 from datetime import datetime
+from typing import Optional
 
 
 class PurchaseHistory(Base):
@@ -14,11 +15,12 @@ class PurchaseHistory(Base):
 
     id = Column(Integer, primary_key=True)
     create_at = Column(DateTime, default=datetime.utcnow())
-    order_id = Column(String, ForeignKey("dca_order.id", ondelete="CASCADE"))
-    initial_amount = Column(Integer, nullable=False)
+    order_id = Column(String, ForeignKey(
+        "dca_order.id", ondelete="CASCADE"), index=True)
+    initial_amount = Column(BigInteger, nullable=False)
     initial_denom = Column(String, nullable=False)
     target_denom = Column(String, nullable=False)
-    dca_amount = Column(Integer, nullable=False)
+    dca_amount = Column(BigInteger, nullable=False)
     # The actually hops which the bot has chosen to execute the purchase
     # of the target asset
     hops = Column(String, nullable=False)
@@ -27,10 +29,13 @@ class PurchaseHistory(Base):
     success = Column(Boolean, nullable=False)
     # If the purhcase was not successfull, the bot will report a err_msg
     err_msg = Column(String)
+    # The hash of the tx broadcast in sync mode. Until the tx is confirmed (see pending_tx table)
+    # success is False.
+    txhash = Column(String, index=True)
 
     def __init__(self, order_id: str, initial_amount: int, initial_denom: str,
                  target_denom: str, dca_amount: int, hops: str,
-                 fee_reedem, success: bool, err_msg: str):
+                 fee_reedem, success: bool, err_msg: str, txhash: Optional[str] = None):
         self.order_id = order_id
         self.initial_amount = initial_amount
         self.initial_denom = initial_denom
@@ -40,6 +45,7 @@ class PurchaseHistory(Base):
         self.fee_reedem = fee_reedem
         self.success = success
         self.err_msg = err_msg
+        self.txhash = txhash
 
     def __repr__(self) -> str:
         return row_string(self)
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, String, Integer, Index
+from bot.db.base import Base
+from bot.db.table import row_string
+
+
+class Route(Base):
+    """ This class model the materialized routes (hops strings) between a start asset and a target asset.
+        The table is rebuilt from the whitelisted_hop table every time the dca configuration is synced.
+    """
+    __tablename__ = 'route'
+
+    id = Column(Integer, primary_key=True)
+    start_denom = Column(String, nullable=False)
+    target_denom = Column(String, nullable=False)
+    hops_len = Column(Integer, nullable=False)
+    # example: '<1><inverse-2>'
+    hops = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index('ix_route_start_target_len',
+              'start_denom', 'target_denom', 'hops_len'),
+    )
+
+    def __init__(self, start_denom: str, target_denom: str, hops: str):
+        self.start_denom = start_denom
+        self.target_denom = target_denom
+        self.hops_len = len(hops.split("><"))
+        self.hops = hops
+
+    def __repr__(self) -> str:
+        return row_string(self)
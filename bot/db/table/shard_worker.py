@@ -0,0 +1,22 @@
+from sqlalchemy import Column, String, DateTime
+from bot.db.base import Base
+from bot.db.table import row_string
+from datetime import datetime
+
+
+class ShardWorker(Base):
+    """ A bot process of the sharded mode. A worker is alive as long as it refreshes its heartbeat
+        (see bot/shard.py).
+    """
+    __tablename__ = 'shard_worker'
+
+    id = Column(String, primary_key=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    heartbeat_at = Column(DateTime, nullable=False, index=True)
+
+    def __init__(self, id: str):
+        self.id = id
+        self.heartbeat_at = datetime.utcnow()
+
+    def __repr__(self) -> str:
+        return row_string(self)
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, String, BigInteger, DateTime
+from bot.db.base import Base
+from bot.db.table import row_string
+from datetime import datetime
+
+
+class SyncCheckpoint(Base):
+    """ The last block height processed by an incremental sync job (see Sync.sync_users_events),
+        or the max_hops the materialized routes have been built with (see Sync.refresh_routes).
+    """
+    __tablename__ = 'sync_checkpoint'
+
+    # The name of the sync job, example: user_events, routes
+    name = Column(String, primary_key=True)
+    height = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __init__(self, name: str, height: int):
+        self.name = name
+        self.height = height
+        self.updated_at = datetime.utcnow()
+
+    def __repr__(self) -> str:
+        return row_string(self)
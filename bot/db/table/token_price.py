@@ -38,4 +38,19 @@ BEGIN
         denom = new.denom;
 END
   """)
-event.listen(TokenPrice.__table__, 'after_create', trigger_updated_at)
+event.listen(TokenPrice.__table__, 'after_create',
+             trigger_updated_at.execute_if(dialect="sqlite"))
+
+# postgresql equivalent of trigger_updated_at
+trigger_updated_at_pg = DDL("""
+CREATE OR REPLACE FUNCTION token_price_updated_at() RETURNS trigger AS $$
+BEGIN
+      NEW.updated_at = now() AT TIME ZONE 'utc';
+      RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER trigger_updated_at BEFORE UPDATE ON token_price
+FOR EACH ROW EXECUTE FUNCTION token_price_updated_at();
+  """)
+event.listen(TokenPrice.__table__, 'after_create',
+             trigger_updated_at_pg.execute_if(dialect="postgresql"))
@@ -1,6 +1,7 @@
 from sqlalchemy import Column, String, Boolean, DateTime
 from bot.db.base import Base
 from datetime import datetime
+from typing import Optional
 from bot.db.table import row_string
 
 
@@ -13,10 +14,17 @@ class User(Base):
     # sync_data column indicates if the process of syncing the user blockchain data
     # has already started or not. By dafault this flag is false for new user
     sync_data = Column(Boolean, default=False)
+    # sync_hash column is the hash of the user data (config, tips and orders) of the last sync.
+    # If the data have not changed, the sync does not write the tips and the orders again.
+    # Set it to NULL to force the next sync to compare every row.
+    sync_hash = Column(String)
 
-    def __init__(self, user_address: str, sync_data: bool = False):
+    def __init__(self, user_address: str, sync_data: bool = False, sync_hash: Optional[str] = None):
         self.id = user_address
         self.sync_data = sync_data
+        # only set if given, so the upsert of the sync flag does not reset the hash
+        if sync_hash is not None:
+            self.sync_hash = sync_hash
 
     def set_sync_data(self, sync_data):
         self.sync_data = sync_data
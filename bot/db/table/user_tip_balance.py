@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, Integer
+from sqlalchemy import Column, String, ForeignKey, BigInteger
 from bot.db.base import Base
 from bot.type import Asset, AssetClass
 from bot.db.table import row_string
@@ -9,10 +9,10 @@ class UserTipBalance(Base):
 
     id = Column(String, primary_key=True)
     user_address = Column(String, ForeignKey(
-        "user.id", ondelete="CASCADE"))
+        "user.id", ondelete="CASCADE"), index=True)
     denom = Column(String)
     asset_class = Column(String, nullable=False)
-    amount = Column(Integer, nullable=False)
+    amount = Column(BigInteger, nullable=False)
 
     def __init__(self, user_address: str, asset: Asset):
         self.id = UserTipBalance.build_id(user_address, asset.get_denom())
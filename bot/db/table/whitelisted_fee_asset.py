@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, BigInteger
 from bot.db.base import Base
 from bot.type import Asset, AssetClass
 from bot.db.table import row_string
@@ -9,7 +9,7 @@ class WhitelistedFeeAsset(Base):
 
     denom = Column(String, primary_key=True)
     asset_class = Column(String, nullable=False)
-    amount = Column(Integer, nullable=False)
+    amount = Column(BigInteger, nullable=False)
 
     def __init__(self, asset: Asset):
         self.denom = asset.get_denom()
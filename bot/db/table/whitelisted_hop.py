@@ -3,6 +3,7 @@ from sqlalchemy import Column, String, Integer, ForeignKey, event, DDL
 from bot.db.base import Base
 from bot.type import AstroSwap
 from bot.db.table import row_string
+from typing import Optional
 
 
 class WhitelistedHop(Base):
@@ -18,11 +19,17 @@ class WhitelistedHop(Base):
         "whitelisted_token.denom", ondelete="CASCADE"))
     ask_denom = Column(String, ForeignKey(
         "whitelisted_token.denom", ondelete="CASCADE"))
+    # The address of the astroport pair contract
+    pair_addr = Column(String)
+    # The type of the astroport pair: xyk or stable
+    pair_type = Column(String)
 
-    def __init__(self, astro_swap: AstroSwap):
+    def __init__(self, astro_swap: AstroSwap, pair_addr: Optional[str] = None, pair_type: Optional[str] = None):
         self.pair_id = WhitelistedHop.build_pair_id(astro_swap)
         self.offer_denom = astro_swap.offer_asset_info.denom
         self.ask_denom = astro_swap.ask_asset_info.denom
+        self.pair_addr = pair_addr
+        self.pair_type = pair_type
 
     @staticmethod
     def build_pair_id(astro_swap: AstroSwap):
@@ -47,4 +54,21 @@ BEGIN
       WHERE  pair_id = new.pair_id  ; 
 END
   """)
-event.listen(WhitelistedHop.__table__, 'after_create', increment_id)
+event.listen(WhitelistedHop.__table__, 'after_create',
+             increment_id.execute_if(dialect="sqlite"))
+
+# postgresql equivalent of increment_id
+increment_id_pg = DDL("""
+CREATE OR REPLACE FUNCTION whitelisted_hop_increment_id() RETURNS trigger AS $$
+BEGIN
+      UPDATE whitelisted_hop
+        SET id = (SELECT COALESCE(MAX(id), 0) FROM whitelisted_hop) + 1
+      WHERE  pair_id = NEW.pair_id;
+      RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER increment_id AFTER INSERT ON whitelisted_hop
+FOR EACH ROW EXECUTE FUNCTION whitelisted_hop_increment_id();
+  """)
+event.listen(WhitelistedHop.__table__, 'after_create',
+             increment_id_pg.execute_if(dialect="postgresql"))
@@ -5,6 +5,7 @@ from sqlalchemy.sql import text
 drop_view_if_exist = text("DROP VIEW IF EXISTS whitelisted_hops_all")
 
 # This view will display all hops path between two assets (start_denom, target_denom)
+# The definition is portable between sqlite and postgresql.
 view_definition = text("""
             CREATE VIEW whitelisted_hops_all AS
             WITH RECURSIVE
@@ -5,8 +5,12 @@ from terra_sdk.client.lcd import LCDClient
 from bot.util import AssetInfo, parse_dict_to_asset, \
     parse_dict_to_asset_info, parse_dict_to_order, AstroSwap,\
     get_price
-from typing import List
+from typing import List, Optional, Set, Tuple
+from datetime import datetime, timedelta
+from sqlalchemy import true
 import json
+import hashlib
+import time
 import traceback
 from terra_sdk.key.mnemonic import MnemonicKey
 from bot.db.table.user_tip_balance import UserTipBalance
@@ -18,27 +22,226 @@ from bot.db.table.whitelisted_fee_asset import WhitelistedFeeAsset
 from bot.db.table.token_price import TokenPrice
 from bot.db.table.log_error import LogError
 from bot.db.table.purchase_history import PurchaseHistory
+from bot.db.table.route import Route
+from bot.db.table.pool_reserve import PoolReserve
+from bot.db.table.sync_checkpoint import SyncCheckpoint
 from bot.db.database import Database, create_database_objects, \
-    drop_database_objects
+    drop_database_objects, create_shard_objects, is_database_created
 from bot.settings import LCD_URL, CHAIN_ID, GAS_PRICE,\
-    GAS_ADJUSTMENT, MNEMONIC, DCA_CONTRACT_ADDR, TOKEN_INFO
+    GAS_ADJUSTMENT, MNEMONIC, DCA_CONTRACT_ADDR, TOKEN_INFO, \
+    POOL_COMMISSION_RATES, STABLE_POOL_AMP, POOL_RESERVE_HORIZON, POOL_RESERVE_TTL, \
+    SIMULATION_CACHE_SIZE, SIMULATION_CACHE_TTL, SIMULATION_CACHE_TOLERANCE, \
+    GAS_MODEL_MARGIN, GAS_MODEL_WINDOW, FEE_DENOM, BROADCAST_MODE, LCD_RATE_LIMIT, LCD_QUERY_TIMEOUT, \
+    LCD_MAX_RETRIES, LCD_RETRY_BACKOFF, SYNC_USER_WORKERS, SYNC_USER_BATCH_SIZE, \
+    SYNC_USER_EVENTS_MAX_PAGES, SHARD_HEARTBEAT_FREQ
 from bot.dca import DCA
+from bot.cache import SimulationCache
+from bot.gas import GasModel
+from bot.ratelimit import TokenBucket
+from bot.config import ConfigSnapshot
+from bot.route import RouteEngine, CompiledRoute
+from bot.simulator import Pool, PoolSimulator
+from bot.shard import ShardCoordinator
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+USER_EVENTS_CHECKPOINT = "user_events"
+# the max_hops the materialized routes have been built with
+ROUTES_CHECKPOINT = "routes"
+
 
 class Sync:
 
-    def __init__(self):
+    def __init__(self, shard: Optional[ShardCoordinator] = None, wallet_index: int = 0):
+        """
+            Parameters:
+                - shard (ShardCoordinator): in sharded mode, the bot only syncs and schedules the users
+                    of its partition. None if a single bot handles every user.
+                - wallet_index (int): the index of the bot wallet derived from MNEMONIC. The workers of
+                    the sharded mode sign with different wallets, so their txs don't share a sequence.
+        """
         terra = LCDClient(LCD_URL, CHAIN_ID,   Coins(  # type: ignore
             GAS_PRICE), GAS_ADJUSTMENT)  # type: ignore
-        mk = MnemonicKey(mnemonic=MNEMONIC)
-
-        self.dca = DCA(terra, terra.wallet(mk), DCA_CONTRACT_ADDR)
+        mk = MnemonicKey(mnemonic=MNEMONIC, index=wallet_index)
+
+        simulation_cache = SimulationCache(SIMULATION_CACHE_SIZE, SIMULATION_CACHE_TTL,
+                                           SIMULATION_CACHE_TOLERANCE) if SIMULATION_CACHE_TTL > 0 else None
+        gas_model = GasModel(GAS_MODEL_MARGIN, GAS_MODEL_WINDOW,
+                             FEE_DENOM) if GAS_MODEL_WINDOW > 0 else None
+        self.dca = DCA(terra, terra.wallet(mk), DCA_CONTRACT_ADDR,
+                       simulation_cache, gas_model, BROADCAST_MODE, TokenBucket(LCD_RATE_LIMIT))
         self.db = Database()
         self.cfg_dca = {}  # configuration of the dca contract
+        self.route_engine = None  # graph of the whitelisted hops
+        self.routes_max_hops = None  # depth of the materialized routes
+        self.config = None  # snapshot of the whitelisted tokens, hops and fee assets
+        self.shard = shard
+
+    def is_owned(self, user_address: str) -> bool:
+        """
+            Returns:
+                bool: True if the user belongs to the partition of the bot (always True without sharding).
+        """
+        return self.shard is None or self.shard.owns(user_address)
+
+    def is_leader(self) -> bool:
+        """
+            Returns:
+                bool: True if the bot runs the singleton jobs (always True without sharding, see ShardCoordinator).
+        """
+        return self.shard is None or self.shard.is_leader
+
+    def get_user_events_checkpoint(self) -> str:
+        """ Every worker of the sharded mode processes the contract txs for its own partition,
+            so it keeps its own checkpoint.
+        """
+        if self.shard is None:
+            return USER_EVENTS_CHECKPOINT
+        return "{}:{}".format(USER_EVENTS_CHECKPOINT, self.shard.worker_id)
+
+    def get_route_engine(self) -> RouteEngine:
+        if self.route_engine is None:
+            self.refresh_route_engine()
+        return self.route_engine  # type: ignore
+
+    def get_config(self) -> ConfigSnapshot:
+        if self.config is None:
+            self.refresh_config()
+        return self.config  # type: ignore
+
+    def refresh_config(self):
+        """ Rebuild the config snapshot from the whitelisted tables. The new snapshot replaces
+            the old one at once, so a purchase which already holds the old one is not affected.
+        """
+        version = 1 if self.config is None else self.config.version + 1
+        self.config = ConfigSnapshot(version, self.db.get_whitelisted_tokens(),
+                                     self.db.get_whitelisted_hops(), self.db.get_whitelisted_fee_asset())
+        logger.info("refresh_config: {}".format(self.config))
+
+    def refresh_route_engine(self):
+        self.route_engine = RouteEngine(self.db.get_whitelisted_hops())
+
+    def refresh_routes(self, changed_denoms: Set[str], old_route_engine: RouteEngine):
+        """ Rebuild the materialized routes which may be affected by a change of the whitelisted hops.
+            A route of at most max_hops hops can only go through one of the changed_denoms if it starts
+            at most max_hops hops away from it, either in the old or in the new hops graph. Only these
+            routes are rebuilt, all the other routes are left untouched.
+
+            If the materialized routes have been built with another max_hops than the one of the
+            dca configuration (or never built), all the routes are rebuilt.
+
+            Parameters:
+                - changed_denoms (Set[str]): the denominations of the hops which have been added, removed or modified.
+                - old_route_engine (RouteEngine): the hops graph before the change.
+        """
+        route_engine = self.get_route_engine()
+        max_hops = self.get_cfg_dca()["max_hops"]
+        routes_max_hops = self.db.get_checkpoint(ROUTES_CHECKPOINT)
+        if routes_max_hops != max_hops:
+            logger.info("refresh_routes: max_hops {} -> {}, rebuild all the routes".format(
+                routes_max_hops, max_hops))
+            affected_denoms = set(old_route_engine.graph.keys()) | set(
+                route_engine.graph.keys())
+        elif not changed_denoms:
+            return
+        else:
+            affected_denoms = old_route_engine.get_neighborhood(changed_denoms, max_hops) | \
+                route_engine.get_neighborhood(changed_denoms, max_hops)
+        logger.info("refresh_routes: affected_denoms={}".format(affected_denoms))
+
+        routes: List[Route] = []
+        for start_denom in affected_denoms:
+            all_routes = route_engine.get_all_routes(start_denom, max_hops)
+            for target_denom, list_hops_string in all_routes.items():
+                routes.extend([Route(start_denom, target_denom, h)
+                               for h in list_hops_string])
+
+        self.db.replace_routes(list(affected_denoms), routes,
+                               SyncCheckpoint(ROUTES_CHECKPOINT, max_hops))
+        self.routes_max_hops = None
+
+    def refresh_pool_reserves(self, hops: List[WhitelistedHop], ttl: Optional[int] = None):
+        """ Query the reserves of the pairs of the given hops and store them in the pool_reserve table.
+
+            Parameters:
+                - hops (List[WhitelistedHop]): the hops whose pair reserves need to be refreshed.
+                - ttl (int): the reserves which have been updated less than ttl seconds ago are not queried again.
+                    By default all the reserves are queried.
+        """
+        pool_reserves = {str(r.pair_addr): r for r in self.db.get_pool_reserve(
+            [str(h.pair_id) for h in hops])}
+        now = datetime.utcnow()
+        for h in hops:
+            if h.pair_addr is None:
+                continue
+            pool_reserve = pool_reserves.get(str(h.pair_addr))
+            if ttl is not None and pool_reserve is not None and \
+                    pool_reserve.updated_at > now - timedelta(seconds=ttl):  # type: ignore
+                continue
+            try:
+                output = self.dca.query_pool(str(h.pair_addr))
+                assets = [parse_dict_to_asset(a) for a in output["assets"]]
+                self.db.insert_or_update(PoolReserve(
+                    str(h.pair_addr), str(h.pair_id), str(h.pair_type), assets))
+            except:
+                err_msg = traceback.format_exc()
+                logger.error("Unable to query the reserves of pair_addr={}. err_msg={}".format(
+                    h.pair_addr, err_msg))
+
+    def get_pool_simulator(self, pair_ids: Optional[List[str]] = None) -> PoolSimulator:
+        """ Build a pool simulator from the pool_reserve table.
+
+            Parameters:
+                - pair_ids (List[str]): load only the reserves of these pairs. By default all the reserves are loaded.
+        """
+        pools = {str(r.pair_id): Pool(str(r.pair_type), r.get_reserves())
+                 for r in self.db.get_pool_reserve(pair_ids)}
+        return PoolSimulator(pools, POOL_COMMISSION_RATES, STABLE_POOL_AMP)
+
+    def sync_pool_reserve(self):
+        """ This method refreshes the stale reserves of the pairs used by the orders which
+            are scheduled to run in the next POOL_RESERVE_HORIZON minutes. In this way the number of
+            queries depends on the upcoming orders and not on the size of the whitelist.
+        """
+        logger.info("************ sync_pool_reserve ************")
+        try:
+            horizon = datetime.utcnow() + timedelta(minutes=POOL_RESERVE_HORIZON)
+            orders = [o for o in self.db.get_dca_orders(schedule=True)
+                      if self.is_owned(str(o.user_address))]
+
+            hop_ids: Set[int] = set()
+            routes_keys = set([(str(o.initial_asset_denom), str(o.target_asset_denom), o.max_hops.real)
+                               for o in orders if o.next_run_time is not None and o.next_run_time <= horizon])  # type: ignore
+            for start_denom, target_denom, max_hops in routes_keys:
+                for h in self.get_routes(start_denom, target_denom, max_hops):
+                    hop_ids.update(
+                        hop_id for hop_id, _ in CompiledRoute.parse_steps(h))
+
+            hops = self.get_config().get_hops(hop_ids)
+            self.refresh_pool_reserves(hops, POOL_RESERVE_TTL)
+        except:
+            err_msg = traceback.format_exc()
+            self.db.log_error(err_msg, "sync_pool_reserve")
+
+    def get_routes_max_hops(self) -> int:
+        """
+            Returns:
+                int: the max_hops the materialized routes have been built with. 0 if they have never been built.
+        """
+        if self.routes_max_hops is None:
+            self.routes_max_hops = self.db.get_checkpoint(ROUTES_CHECKPOINT)
+        return self.routes_max_hops or 0
+
+    def get_routes(self, start_denom: str, target_denom: str, max_hops: int) -> List[str]:
+        """ Returns the hops strings between start_denom and target_denom with at most max_hops hops.
+            The routes are read from the materialized route table. If max_hops exceeds the depth of the
+            materialized routes, the routes are computed on the fly by the route engine.
+        """
+        if max_hops > self.get_routes_max_hops():
+            return self.get_route_engine().get_routes(start_denom, target_denom, max_hops)
+        return [str(r.hops) for r in self.db.get_routes(start_denom, target_denom, max_hops)]
 
     def get_cfg_dca(self):
         if self.cfg_dca == {}:
@@ -64,6 +267,9 @@ class Sync:
             self.db.insert_or_update(tp)
 
     def sync_token_price(self):
+        if not self.is_leader():
+            # the prices are synced by the leader
+            return
         list_token_price = self.db.get_token_price()
         if not (list_token_price):
             self.fill_token_price_table()
@@ -84,69 +290,25 @@ class Sync:
         self.fill_token_price_table()
         self.sync_token_price()
 
-    def _sync_user_tip_balance(self, user_address: str,  user_tip_balances: List[dict]):
-        logger.debug("_sync_user_tip_balance")
-        user_tip_ids = []
-        # insert or update user tip
-        for a in user_tip_balances:
-            asset = parse_dict_to_asset(a)
-            user_tip_ids.append(UserTipBalance.build_id(
-                user_address, asset.get_denom()))
-            utb = UserTipBalance(user_address, asset)
-            self.db.insert_or_update(utb)
-
-        # remove orphan user tip
-        self.db.delete(UserTipBalance, (UserTipBalance.user_address == user_address) & (  # type: ignore
-            UserTipBalance.id.not_in(user_tip_ids)))  # type: ignore
-
-    def _sync_dca_oders(self, user_address: str, max_spread: str, max_hops: int, orders: List[dict]):
-        logger.debug("_sync_dca_oders")
-        new_order_ids = []
-        # insert or update user order
-        for o in orders:
-            order = parse_dict_to_order(o)
-            new_order_ids.append(DcaOrder.build_id(user_address, order.id))
-            dca_oder = DcaOrder(user_address, max_spread, max_hops, order)
-
-            # update dca_order
-            self.db.insert_or_update(dca_oder)
-            # Note: there is a trigger 'reset_schedule' on the the dca_orders
-            # which will reset schedule=False and next_run_time=NULL only if
-            # new.initial_asset_amount < old.initial_asset_amount
-
-        # remove orphan user oder
-        self.db.delete(DcaOrder, (DcaOrder.user_address == user_address) & (  # type: ignore
-            DcaOrder.id.not_in(new_order_ids)))  # type: ignore
-
     def _sync_whitelisted_fee_asset(self, whitelisted_fee_assets: List[dict]):
-
-        wl_fee_assets_denom = []
-        # insert or update whitelisted fee assets
-        for a in whitelisted_fee_assets:
-            asset = parse_dict_to_asset(a)
-            wl_fee_assets_denom.append(asset.get_denom())
-            wfa = WhitelistedFeeAsset(asset)
-            self.db.insert_or_update(wfa)
-
-        # remove orphan whitelisted fee assets
-        self.db.delete(WhitelistedFeeAsset,
-                       (WhitelistedFeeAsset.denom.not_in(wl_fee_assets_denom)))  # type: ignore
+        wl_fee_assets = [WhitelistedFeeAsset(parse_dict_to_asset(a))
+                         for a in whitelisted_fee_assets]
+        # insert or update whitelisted fee assets and remove orphan whitelisted fee assets
+        self.db.bulk_upsert(WhitelistedFeeAsset, wl_fee_assets, true())
 
     def _sync_whitelisted_token(self, whitelisted_tokens: List[dict]):
-        wl_tokens_denom = []
-        # insert or update whitelisted tokens
-        for a in whitelisted_tokens:
-            asset_info = parse_dict_to_asset_info(a)
-            wl_tokens_denom.append(asset_info.denom)
-            wt = WhitelistedToken(asset_info)
-            self.db.insert_or_update(wt)
-
-        # remove orphan whitelisted fee assets
-        self.db.delete(WhitelistedToken,
-                       (WhitelistedToken.denom.not_in(wl_tokens_denom)))  # type: ignore
-
-    def sync_whitelisted_hop(self):
+        wl_tokens = [WhitelistedToken(parse_dict_to_asset_info(a))
+                     for a in whitelisted_tokens]
+        # insert or update whitelisted tokens and remove orphan whitelisted tokens
+        self.db.bulk_upsert(WhitelistedToken, wl_tokens, true())
+
+    def sync_whitelisted_hop(self, old_hops: Optional[List[WhitelistedHop]] = None):
         """ this method need to run typically after sync_whitelisted_token!
+
+            Parameters:
+                - old_hops (List[WhitelistedHop]): the whitelisted hops before the sync of the whitelisted tokens.
+                    Removing a whitelisted token deletes its hops on cascade, so the caller should provide them
+                    in order to invalidate the affected routes. By default the current whitelisted hops are used.
         """
 
         whitelisted_tokens_denom = [w.denom
@@ -155,12 +317,18 @@ class Sync:
         def is_whitelisted_asset(asset_info: AssetInfo) -> bool:
             return whitelisted_tokens_denom.__contains__(asset_info.denom)
 
+        def _hop_key(h: WhitelistedHop):
+            return (h.id, h.offer_denom, h.ask_denom)
+
+        if old_hops is None:
+            old_hops = self.db.get_whitelisted_hops()
+        old_hops_map = {h.pair_id: _hop_key(h) for h in old_hops}
+
         p = self.dca.get_astro_pools()
         logger.debug(
             "dca.get_astro_pools -> result: {}".format(json.dumps(p, indent=4)))
 
-        wl_hops_pair_id = []
-        # insert or update whitelisted hop
+        wl_hops = []
         for pair in p["pairs"]:
             asset_infos = pair["asset_infos"]
             asset1 = parse_dict_to_asset_info(asset_infos[0])
@@ -170,13 +338,27 @@ class Sync:
             if not (is_whitelisted_asset(asset2)):
                 continue
             astro_swap = AstroSwap(asset1, asset2)
-            wl_hops_pair_id.append(WhitelistedHop.build_pair_id(astro_swap))
-            wh = WhitelistedHop(astro_swap)
-            self.db.insert_or_update(wh)
-
-        # remove orphan whitelisted hop
-        self.db.delete(WhitelistedHop,
-                       (WhitelistedHop.pair_id.not_in(wl_hops_pair_id)))  # type: ignore
+            # example: pair_type = {'xyk': {}}
+            pair_type = list(pair["pair_type"].keys())[0]
+            wl_hops.append(WhitelistedHop(
+                astro_swap, pair["contract_addr"], pair_type))
+
+        # insert or update whitelisted hop and remove orphan whitelisted hop
+        self.db.bulk_upsert(WhitelistedHop, wl_hops, true())
+
+        # find the denoms whose hops have been added, removed or modified
+        new_hops = self.db.get_whitelisted_hops()
+        new_hops_map = {h.pair_id: _hop_key(h) for h in new_hops}
+        changed_denoms: Set[str] = set()
+        for pair_id in set(old_hops_map.keys()) | set(new_hops_map.keys()):
+            old_hop = old_hops_map.get(pair_id)
+            new_hop = new_hops_map.get(pair_id)
+            if old_hop != new_hop:
+                changed_denoms.update(
+                    [str(d) for d in (old_hop or ())[1:] + (new_hop or ())[1:]])
+        # update the hops graph and the routes affected by the change
+        self.refresh_route_engine()
+        self.refresh_routes(changed_denoms, RouteEngine(old_hops))
 
     def sync_user_data(self, user_address):
         """ This method will sync the user oders and tip balances to the local db of the bot.
@@ -186,26 +368,104 @@ class Sync:
             "****** sync_user_data: user={} ******".format(user_address))
 
         try:
-            cfg_dca = self.get_cfg_dca()
             cfg_user = self.dca.query_get_user_config(user_address)
             dca_oders = self.dca.query_get_user_dca_orders(user_address)
-            max_spread = cfg_dca['max_spread'] if cfg_user['max_spread'] is None else cfg_user['max_spread']
-            max_hops = cfg_dca['max_hops'] if cfg_user['max_hops'] is None else cfg_user['max_hops']
-
-            self._sync_user_tip_balance(user_address, cfg_user["tip_balance"])
-            self._sync_dca_oders(user_address, max_spread, max_hops, dca_oders)
-
-            # update sync_data=True of the user
-            self.db.insert_or_update(User(user_address, True))
+            # the tips, the orders and sync_data=True of the user are saved within the same transaction
+            self.db.save_users_data(
+                [self._build_user_data(user_address, cfg_user, dca_oders)])
         except:
             err_msg = traceback.format_exc()
             self.db.log_error(err_msg, "sync_user_data", "", user_address)
 
+    def _build_user_data(self, user_address: str, cfg_user: dict,
+                         dca_oders: List[dict]) -> Tuple[str, str, List[UserTipBalance], List[DcaOrder]]:
+        """
+            Returns:
+                Tuple: (user address, sync hash, tip balances, dca orders) of the user (see Database.save_users_data).
+                    The sync hash identifies the content of the user data.
+        """
+        cfg_dca = self.get_cfg_dca()
+        max_spread = cfg_dca['max_spread'] if cfg_user['max_spread'] is None else cfg_user['max_spread']
+        max_hops = cfg_dca['max_hops'] if cfg_user['max_hops'] is None else cfg_user['max_hops']
+
+        tips = [UserTipBalance(user_address, parse_dict_to_asset(a))
+                for a in cfg_user["tip_balance"]]
+        orders = [DcaOrder(user_address, max_spread, max_hops, parse_dict_to_order(o))
+                  for o in dca_oders]
+        sync_hash = hashlib.sha256(json.dumps({"max_spread": max_spread, "max_hops": max_hops,
+                                               "tip_balance": cfg_user["tip_balance"], "orders": dca_oders},
+                                              sort_keys=True).encode()).hexdigest()
+        return user_address, sync_hash, tips, orders
+
     def sync_users_data(self):
+        """ Sync the users which are not synced yet. The users data are queried concurrently
+            (at most SYNC_USER_WORKERS queries at the same time, LCD_RATE_LIMIT queries per second) and
+            they are saved by batch of SYNC_USER_BATCH_SIZE users within a single transaction.
+        """
         logger.info("************ sync_users_data ************")
-        users = self.db.get_users(sync_data=False)
-        for u in users:
-            self.sync_user_data(u.id)
+        user_addresses = [str(u.id) for u in self.db.get_users(sync_data=False)
+                          if self.is_owned(str(u.id))]
+        for i in range(0, len(user_addresses), SYNC_USER_BATCH_SIZE):
+            batch = user_addresses[i:i + SYNC_USER_BATCH_SIZE]
+            try:
+                users_data = self.dca.query_users_data(batch, SYNC_USER_WORKERS, LCD_QUERY_TIMEOUT,
+                                                       LCD_MAX_RETRIES, LCD_RETRY_BACKOFF)
+                rows = []
+                for user_address in batch:
+                    user_data = users_data.get(user_address)
+                    if user_data is None:
+                        # the user is synced again in the next cycle (sync_data=False)
+                        self.db.log_error("Unable to query the user data", "sync_users_data",
+                                          None, user_address)
+                        continue
+                    try:
+                        rows.append(self._build_user_data(
+                            user_address, *user_data))
+                    except:
+                        self.db.log_error(traceback.format_exc(), "sync_users_data",
+                                          None, user_address)
+                self.db.save_users_data(rows)
+            except:
+                err_msg = traceback.format_exc()
+                self.db.log_error(err_msg, "sync_users_data")
+
+    def sync_users_events(self):
+        """ Incremental alternative to polling every user. Only the users touched by a tx of the
+            dca contract since the last processed height (see sync_checkpoint table) are synced again.
+            On the first run every user is synced. At most SYNC_USER_EVENTS_MAX_PAGES pages of txs are
+            processed per run, the checkpoint advances step by step through a larger backlog.
+        """
+        logger.info("************ sync_users_events ************")
+        try:
+            latest_height = self.dca.query_latest_height()
+            checkpoint_name = self.get_user_events_checkpoint()
+            checkpoint = self.db.get_checkpoint(checkpoint_name)
+            if checkpoint is None:
+                touched_users = {str(u.id) for u in self.db.get_users()
+                                 if self.is_owned(str(u.id))}
+            else:
+                txs, complete = self.dca.query_contract_txs(
+                    checkpoint + 1, max_pages=SYNC_USER_EVENTS_MAX_PAGES)
+                if not complete:
+                    # the txs of the last height may continue on the next page
+                    latest_height = max(checkpoint + 1,
+                                        max(tx.height for tx in txs) - 1)
+                # a user unknown to the bot (e.g. its first create_dca_order) is inserted
+                touched_users = {u for u in self.dca.get_touched_users(txs)
+                                 if self.is_owned(u)}
+            logger.info("sync_users_events: {} users touched since height={} till height={}".format(
+                len(touched_users), checkpoint, latest_height))
+
+            # the touched users are synced like new users (see sync_users_data)
+            for user_address in touched_users:
+                self.db.insert_or_update(User(user_address, False))
+            self.sync_users_data()
+
+            self.db.insert_or_update(SyncCheckpoint(
+                checkpoint_name, latest_height))
+        except:
+            err_msg = traceback.format_exc()
+            self.db.log_error(err_msg, "sync_users_events")
 
     def sync_dca_cfg(self):
         """ This method will sync the dca contract configurations to the local db of the bot.
@@ -215,19 +475,30 @@ class Sync:
         try:
             self.refresh_cfg_dca()
             cfg_dca = self.get_cfg_dca()
-
+            if not self.is_leader():
+                # the whitelists and the routes are synced by the leader, only reload them
+                self.refresh_route_engine()
+                self.routes_max_hops = None
+                self.refresh_config()
+                return
+
+            old_hops = self.db.get_whitelisted_hops()
             self._sync_whitelisted_fee_asset(cfg_dca["whitelisted_fee_assets"])
             self._sync_whitelisted_token(cfg_dca["whitelisted_tokens"])
-            self.sync_whitelisted_hop()
+            self.sync_whitelisted_hop(old_hops)
+            self.refresh_config()
         except:
             err_msg = traceback.format_exc()
             self.db.log_error(err_msg, "sync_dca_cfg")
 
 
-def initialize_db(reset_db: bool = False):
+def initialize_db(reset_db: bool = False, shard: Optional[ShardCoordinator] = None):
     """
         Parameters:
-            - reset_db (bool): this flag is responsible for dropping all objects in the database.                
+            - reset_db (bool): this flag is responsible for dropping all objects in the database.
+            - shard (ShardCoordinator): in sharded mode, only the leader worker creates the db objects, inserts
+                the initial users and fills the price table. The other workers wait for the db objects and
+                only sync the users of their partition. None if a single bot handles every user.
     """
     DCA_BOT = os.environ['DCA_BOT']
     logger.info(
@@ -238,36 +509,51 @@ def initialize_db(reset_db: bool = False):
     assert DCA_BOT in [
         'dev', 'prod', 'test'], "Expected environment variable DCA_BOT in ['dev','prod', 'test']. Got DCA_BOT={}".format(DCA_BOT)
 
-    if reset_db:
-        drop_database_objects()
-
-    create_database_objects()
-    s = Sync()
-
-    # insert some initial user into db
-    if DCA_BOT == "dev":
-        terra = LocalTerra()
-
-        u1 = terra.wallets["test1"].key.acc_address
-        u2 = terra.wallets["test2"].key.acc_address
-        u3 = terra.wallets["test3"].key.acc_address
-
-        s.insert_user_into_db(u1)
-        s.insert_user_into_db(u2)
-        s.insert_user_into_db(u3)
-
-    elif DCA_BOT == "prod":
-        # insert some dca user address here: ...
-        # s.insert_user_into_db(...)
-        pass
-    else:  # DCA_BOT == "test":
-        # insert some dca user address here: ...
-        # s.insert_user_into_db(...)
-        pass
-
+    if shard is None:
+        if reset_db:
+            drop_database_objects()
+        create_database_objects()
+    else:
+        assert not reset_db, "The db shared by the workers of the sharded mode can't be reset by a worker"
+        create_shard_objects()
+        shard.heartbeat()
+        # a worker becomes the leader if the leader stops heartbeating while it waits
+        while not shard.is_leader and not is_database_created():
+            logger.info("worker={}: wait for the leader to create the db objects".format(
+                shard.worker_id))
+            time.sleep(SHARD_HEARTBEAT_FREQ)
+            shard.heartbeat()
+        if shard.is_leader:
+            create_database_objects()
+
+    s = Sync(shard)
+    # the initial users are inserted by the leader, the other workers sync them once they own their partition
+    if s.is_leader():
+        if DCA_BOT == "dev":
+            terra = LocalTerra()
+
+            u1 = terra.wallets["test1"].key.acc_address
+            u2 = terra.wallets["test2"].key.acc_address
+            u3 = terra.wallets["test3"].key.acc_address
+
+            s.insert_user_into_db(u1)
+            s.insert_user_into_db(u2)
+            s.insert_user_into_db(u3)
+
+        elif DCA_BOT == "prod":
+            # insert some dca user address here: ...
+            # s.insert_user_into_db(...)
+            pass
+        else:  # DCA_BOT == "test":
+            # insert some dca user address here: ...
+            # s.insert_user_into_db(...)
+            pass
+
+    # a worker which is not the leader only reloads the config and syncs the users of its partition
     s.sync_dca_cfg()
     s.sync_users_data()
-    s.initialize_token_price_table()
+    if s.is_leader():
+        s.initialize_token_price_table()
 
 
 if __name__ == "__main__":
@@ -1,20 +1,27 @@
 
 from terra_sdk.core import Coins
 import base64
-from terra_sdk.client.lcd.api.tx import CreateTxOptions
 from terra_sdk.core.wasm import MsgStoreCode, MsgInstantiateContract,\
     MsgExecuteContract
 from terra_sdk.core.wasm.data import AccessConfig
+from terra_sdk.core.msg import Msg
+from terra_sdk.core.broadcast import is_tx_error
+from terra_sdk.core.tx import TxInfo
+from terra_sdk.exceptions import LCDResponseError
 from terra_sdk.core.bech32 import AccAddress
 from terra_proto.cosmwasm.wasm.v1 import AccessType
-from terra_sdk.client.lcd import LCDClient, Wallet
-from typing import List, Any, Optional
-from bot.util import perform_transaction, Asset, AssetInfo, \
-    perform_transactions, AstroSwap
+from terra_sdk.client.lcd import LCDClient, AsyncLCDClient, Wallet
+from typing import Dict, List, Any, Optional, Set, Tuple
+from bot.util import Asset, AssetInfo, AstroSwap
 from bot.type import AstroSwap, SimulateSwapOperation
+from bot.cache import SimulationCache
+from bot.sequence import SequenceManager, BROADCAST_MODE_BLOCK, BROADCAST_MODE_SYNC
+from bot.gas import GasModel
+from bot.ratelimit import TokenBucket, retry_async
 
 import json
-
+import asyncio
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,12 +29,55 @@ logger = logging.getLogger(__name__)
 
 class DCA:
 
-    def __init__(self, terra: LCDClient, wallet: Wallet,  dca_addr: str = ""):
-        self.terra = terra
-        self.wallet = wallet
+    def __init__(self, terra: LCDClient, wallet: Wallet,  dca_addr: str = "",
+                 simulation_cache: Optional[SimulationCache] = None, gas_model: Optional[GasModel] = None,
+                 broadcast_mode: str = BROADCAST_MODE_BLOCK, rate_limiter: Optional[TokenBucket] = None):
+        self._terra = terra
+        self._wallet = wallet
         self.dca_addr = dca_addr
         self.factory_addr = None
         self.router_addr = None
+        # if set, the results of simulate_swap_operations are served from memory
+        self.simulation_cache = simulation_cache
+        # The synchronous LCDClient runs every query on the event loop of the thread which created it,
+        # so it can't be shared between threads. Other threads get their own client (see terra property).
+        self._owner_thread = threading.get_ident()
+        self._local = threading.local()
+        # The txs of the bot wallet are signed and broadcast one at a time with the cached
+        # account sequence, so two concurrent txs can't get the same sequence.
+        self.sequence_manager = SequenceManager(gas_model, broadcast_mode)
+        # if set, the concurrent queries (batch methods) share this rate limit toward the LCD
+        self.rate_limiter = rate_limiter
+
+    @property
+    def terra(self) -> LCDClient:
+        if threading.get_ident() == self._owner_thread:
+            return self._terra
+        if not hasattr(self._local, "terra"):
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self._local.terra = LCDClient(self._terra.url, self._terra.chain_id,
+                                          self._terra.gas_prices, self._terra.gas_adjustment)
+        return self._local.terra
+
+    @property
+    def wallet(self) -> Wallet:
+        if threading.get_ident() == self._owner_thread:
+            return self._wallet
+        if not hasattr(self._local, "wallet"):
+            self._local.wallet = self.terra.wallet(self._wallet.key)
+        return self._local.wallet
+
+    def _perform_transaction(self, msg: Msg):
+        return self.sequence_manager.perform_transactions(self.terra, self.wallet, [msg])
+
+    def _perform_transactions(self, msgs: List[Msg]):
+        return self.sequence_manager.perform_transactions(self.terra, self.wallet, msgs)
+
+    def is_sync_broadcast(self) -> bool:
+        """ In sync broadcast mode the purchases return before their tx is included in a block.
+            The tx has to be confirmed with query_tx_infos.
+        """
+        return self.sequence_manager.broadcast_mode == BROADCAST_MODE_SYNC
 
     def set_dca_addr(self, dca_addr: str):
         self.dca_addr = dca_addr
@@ -60,11 +110,271 @@ class DCA:
         self._log_debug_output(output)
         return output
 
+    def query_pool(self, pair_addr: str) -> dict:
+        """ Query the reserves of an astroport pair.
+            example output: {'assets': [{'info': {'native_token': {'denom': 'uluna'}}, 'amount': '1000'},
+                                        {'info': {'token': {'contract_addr': 'addr'}}, 'amount': '2000'}],
+                             'total_share': '1414'}
+        """
+        output = self.terra.wasm.contract_query(pair_addr, {
+            "pool": {}
+        })
+        self._log_debug_output(output)
+        return output
+
     def simulate_swap_operations(self, swo: SimulateSwapOperation) -> int:
+        if self.simulation_cache is not None:
+            amount = self.simulation_cache.get(swo)
+            if amount is not None:
+                return amount
+
         output = self.terra.wasm.contract_query(self.get_router_addr(),
                                                 swo.to_dict())
+        amount = int(output["amount"])
+
+        if self.simulation_cache is not None:
+            self.simulation_cache.set(swo, amount)
+        return amount
+
+    def simulate_swap_operations_batch(self, list_swo: List[SimulateSwapOperation],
+                                       max_concurrency: int, timeout: float) -> List[Optional[int]]:
+        """ Simulate several swap operations concurrently. The latency is close to the one of the
+            slowest query instead of the sum of all the queries.
+
+            Parameters:
+                - list_swo (List[SimulateSwapOperation]): the swap operations to simulate.
+                - max_concurrency (int): the maximum number of queries sent to the LCD at the same time.
+                - timeout (float): the timeout in seconds of every single query.
 
-        return output["amount"]
+            Returns:
+                List[Optional[int]]: the simulated amount of the target asset for each element of list_swo
+                    (in the same order). The amount is None if the query failed or timed out.
+        """
+        result: List[Optional[int]] = [None] * len(list_swo)
+        missing = []  # index of the swo not found in the simulation cache
+        for i, swo in enumerate(list_swo):
+            if self.simulation_cache is not None:
+                result[i] = self.simulation_cache.get(swo)
+            if result[i] is None:
+                missing.append(i)
+        if len(missing) == 0:
+            return result
+
+        # The synchronous LCDClient runs every query on its own event loop which can't be shared.
+        # Therefore we use a dedicated event loop and AsyncLCDClient for the batch.
+        router_addr = self.get_router_addr()
+        loop = asyncio.new_event_loop()
+        try:
+            amounts = loop.run_until_complete(self._simulate_swap_operations_batch(
+                router_addr, [list_swo[i] for i in missing], max_concurrency, timeout))
+        finally:
+            loop.close()
+
+        for i, amount in zip(missing, amounts):
+            result[i] = amount
+            if amount is not None and self.simulation_cache is not None:
+                self.simulation_cache.set(list_swo[i], amount)
+        return result
+
+    async def _simulate_swap_operations_batch(self, router_addr: str, list_swo: List[SimulateSwapOperation],
+                                              max_concurrency: int, timeout: float) -> List[Optional[int]]:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async with AsyncLCDClient(self.terra.url, self.terra.chain_id, self.terra.gas_prices,
+                                  self.terra.gas_adjustment) as terra:
+
+            async def _simulate(swo: SimulateSwapOperation) -> Optional[int]:
+                async with semaphore:
+                    if self.rate_limiter is not None:
+                        await self.rate_limiter.acquire()
+                    try:
+                        output = await asyncio.wait_for(
+                            terra.wasm.contract_query(router_addr, swo.to_dict()), timeout)
+                        return int(output["amount"])
+                    except Exception as e:
+                        logger.error("Unable to simulate swo={}. err_msg={}".format(
+                            swo, repr(e)))
+                        return None
+
+            return await asyncio.gather(*[_simulate(swo) for swo in list_swo])
+
+    def query_tx_infos(self, txhashes: List[str], max_concurrency: int = 4,
+                       timeout: float = 10) -> Dict[str, Optional[TxInfo]]:
+        """ Query the info of several txs concurrently.
+
+            Returns:
+                dict: key = txhash, value = the tx info or None if the tx is not included in a block (yet).
+                    The txs whose query failed for another reason are missing.
+        """
+        if len(txhashes) == 0:
+            return {}
+        loop = asyncio.new_event_loop()
+        try:
+            infos = loop.run_until_complete(
+                self._query_tx_infos(txhashes, max_concurrency, timeout))
+        finally:
+            loop.close()
+        return {h: info for h, (found, info) in zip(txhashes, infos) if found}
+
+    async def _query_tx_infos(self, txhashes: List[str], max_concurrency: int, timeout: float):
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async with AsyncLCDClient(self.terra.url, self.terra.chain_id, self.terra.gas_prices,
+                                  self.terra.gas_adjustment) as terra:
+
+            async def _query(txhash: str):
+                async with semaphore:
+                    if self.rate_limiter is not None:
+                        await self.rate_limiter.acquire()
+                    try:
+                        return True, await asyncio.wait_for(terra.tx.tx_info(txhash), timeout)
+                    except LCDResponseError as e:
+                        if e.response.status == 404:
+                            return True, None
+                        logger.error("Unable to query tx={}. err_msg={}".format(
+                            txhash, repr(e)))
+                        return False, None
+                    except Exception as e:
+                        logger.error("Unable to query tx={}. err_msg={}".format(
+                            txhash, repr(e)))
+                        return False, None
+
+            return await asyncio.gather(*[_query(h) for h in txhashes])
+
+    def query_users_data(self, user_addresses: List[str], max_concurrency: int = 4, timeout: float = 10,
+                         retries: int = 3, backoff: float = 0.5) -> Dict[str, Optional[Tuple[dict, List[dict]]]]:
+        """ Query the config and the dca orders of several users concurrently (see query_get_user_config
+            and query_get_user_dca_orders). The queries are limited by rate_limiter and they are retried
+            with an exponential backoff if the LCD is overloaded or unavailable.
+
+            Parameters:
+                - max_concurrency (int): the maximum number of queries sent to the LCD at the same time.
+                - timeout (float): the timeout in seconds of every single query.
+                - retries (int): the maximum number of retries of a query.
+                - backoff (float): the delay in seconds before the first retry. It doubles at every retry.
+
+            Returns:
+                dict: key = user address, value = (user config, dca orders). The value is None if a query failed.
+        """
+        self.check_dca_addr()
+        if len(user_addresses) == 0:
+            return {}
+        loop = asyncio.new_event_loop()
+        try:
+            users_data = loop.run_until_complete(self._query_users_data(
+                user_addresses, max_concurrency, timeout, retries, backoff))
+        finally:
+            loop.close()
+        return dict(zip(user_addresses, users_data))
+
+    async def _query_users_data(self, user_addresses: List[str], max_concurrency: int, timeout: float,
+                                retries: int, backoff: float) -> List[Optional[Tuple[dict, List[dict]]]]:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async with AsyncLCDClient(self.terra.url, self.terra.chain_id, self.terra.gas_prices,
+                                  self.terra.gas_adjustment) as terra:
+
+            async def _query(query_msg: dict) -> Any:
+                async with semaphore:
+                    return await retry_async(
+                        lambda: asyncio.wait_for(terra.wasm.contract_query(
+                            self.dca_addr, query_msg), timeout),
+                        retries, backoff, self.rate_limiter)
+
+            async def _query_user(user_address: str) -> Optional[Tuple[dict, List[dict]]]:
+                try:
+                    cfg_user, orders = await asyncio.gather(
+                        _query({"user_config": {"user": user_address}}),
+                        _query({"user_dca_orders": {"user": user_address}}))
+                    return cfg_user, orders
+                except Exception as e:
+                    logger.error("Unable to query the data of user={}. err_msg={}".format(
+                        user_address, repr(e)))
+                    return None
+
+            return await asyncio.gather(*[_query_user(u) for u in user_addresses])
+
+    def query_latest_height(self) -> int:
+        output = self.terra.tendermint.block_info()
+        return int(output["block"]["header"]["height"])
+
+    def query_contract_txs(self, min_height: int, limit: int = 100, max_pages: int = 10) -> Tuple[List[TxInfo], bool]:
+        """ Search the txs which executed the dca contract at a height >= min_height.
+            The txs are searched from the latest one, page by page, till min_height is reached.
+
+            At most max_pages pages are searched from the latest tx. If min_height is not reached, the txs are
+            too many for a single run: the first tx at a height >= min_height is found with a binary search
+            and only the oldest max_pages pages of txs since min_height are returned, so the caller can
+            advance its checkpoint step by step.
+
+            Returns:
+                Tuple[List[TxInfo], bool]: the txs (latest first) and True if all the txs since min_height
+                    have been returned.
+        """
+        self.check_dca_addr()
+        txs = []
+        for page_index in range(max_pages):
+            page, _ = self._search_contract_txs(
+                page_index * limit, limit, "ORDER_BY_DESC")
+            txs += [tx for tx in page if tx.height >= min_height]
+            if len(page) < limit or page[-1].height < min_height:
+                return txs, True
+
+        # the offsets of the ascending order do not move when new txs are executed
+        _, total = self._search_contract_txs(0, 1, "ORDER_BY_ASC", True)
+        low, high = 0, total
+        while low < high:
+            mid = (low + high) // 2
+            page, _ = self._search_contract_txs(mid, 1, "ORDER_BY_ASC")
+            if len(page) > 0 and page[0].height < min_height:
+                low = mid + 1
+            else:
+                high = mid
+        logger.info("query_contract_txs: more than {} txs since height={}, resume from offset={}".format(
+            max_pages * limit, min_height, low))
+
+        txs = []
+        for page_index in range(max_pages):
+            page, _ = self._search_contract_txs(
+                low + page_index * limit, limit, "ORDER_BY_ASC")
+            txs += page
+            if len(page) < limit:
+                return txs[::-1], True
+        return txs[::-1], low + len(txs) >= total
+
+    def _search_contract_txs(self, offset: int, limit: int, order_by: str,
+                             count_total: bool = False) -> Tuple[List[TxInfo], int]:
+        """
+            Returns:
+                Tuple[List[TxInfo], int]: a page of the txs which executed the dca contract and the total
+                    number of these txs (0 unless count_total).
+        """
+        params = {"pagination.limit": str(limit),
+                  "pagination.offset": str(offset),
+                  "order_by": order_by}
+        if count_total:
+            params["pagination.count_total"] = "true"
+        output = self.terra.tx.search(
+            [["execute._contract_address", self.dca_addr]], params)
+        total = int((output.get("pagination") or {}).get("total") or 0)
+        return output["txs"], total
+
+    def get_touched_users(self, txs: List[TxInfo]) -> Set[str]:
+        """
+            Returns:
+                Set[str]: the addresses whose dca orders or tip balances may have been changed by txs.
+                    It is the user of a perform_dca_purchase msg or the sender of any other execute msg.
+        """
+        users = set()
+        for tx in txs:
+            for msg in tx.tx.body.messages:
+                if not isinstance(msg, MsgExecuteContract):
+                    continue
+                if isinstance(msg.msg, dict) and "perform_dca_purchase" in msg.msg:
+                    users.add(msg.msg["perform_dca_purchase"]["user_address"])
+                else:
+                    users.add(str(msg.sender))
+        return users
 
     def query_get_user_dca_orders(self, user_address: str) -> List[dict]:
         logger.debug("query_get_user_dca_orders")
@@ -112,9 +422,7 @@ class DCA:
 
         )
 
-        instantiate_tx_result = perform_transaction(self.terra,
-                                                    self.wallet,
-                                                    instantiate_msg)
+        instantiate_tx_result = self._perform_transaction(instantiate_msg)
 
         print("instantiate_tx_result: ", instantiate_tx_result)
 
@@ -166,7 +474,7 @@ class DCA:
         )
 
         msgs.append(msg_create_dca_order)
-        perform_transactions(self.terra, self.wallet, msgs)
+        self._perform_transactions(msgs)
 
     def execute_update_user_config(self,
                                    max_hops: Optional[int],
@@ -185,7 +493,7 @@ class DCA:
             Coins([])
         )
 
-        perform_transaction(self.terra, self.wallet, msg)
+        self._perform_transaction(msg)
 
     def execute_update_config(self, max_hops: Optional[int] = None,
                               max_spread: Optional[str] = None,
@@ -212,16 +520,11 @@ class DCA:
             Coins([])
         )
 
-        perform_transaction(self.terra, self.wallet, msg)
-
-    def execute_perform_dca_purchase(self, user_address: str, id: int, hops: List[AstroSwap],
-                                     fee_redeem: List[Asset]):
+        self._perform_transaction(msg)
 
-        self.check_dca_addr()
-        logger.info("***** call dca.execute_perform_dca_purchase: *****")
-        logger.debug("hops:{}, fee_reedem={}".format(hops, fee_redeem))
-
-        msg = MsgExecuteContract(
+    def build_perform_dca_purchase_msg(self, user_address: str, id: int, hops: List[AstroSwap],
+                                       fee_redeem: List[Asset]) -> MsgExecuteContract:
+        return MsgExecuteContract(
             self.wallet.key.acc_address,
             AccAddress(self.dca_addr), {
                 "perform_dca_purchase": {
@@ -234,7 +537,35 @@ class DCA:
             Coins([])
         )
 
-        perform_transaction(self.terra, self.wallet, msg)
+    def execute_perform_dca_purchase(self, user_address: str, id: int, hops: List[AstroSwap],
+                                     fee_redeem: List[Asset]):
+        """ Execute a perform_dca_purchase msg. If the tx fails, an error is thrown
+            (see execute_perform_dca_purchase_batch).
+        """
+        self.check_dca_addr()
+        logger.info("***** call dca.execute_perform_dca_purchase: *****")
+        logger.debug("hops:{}, fee_reedem={}".format(hops, fee_redeem))
+
+        msg = self.build_perform_dca_purchase_msg(
+            user_address, id, hops, fee_redeem)
+
+        result = self._perform_transaction(msg)
+        assert not is_tx_error(result), "tx={} failed: {}".format(
+            result.txhash, result.raw_log)
+        return result
+
+    def execute_perform_dca_purchase_batch(self, msgs: List[MsgExecuteContract]):
+        """ Execute several perform_dca_purchase msgs (see build_perform_dca_purchase_msg) in a single tx.
+            The tx is atomic: if one msg fails, none of the purchases is executed and an error is thrown.
+        """
+        self.check_dca_addr()
+        logger.info("***** call dca.execute_perform_dca_purchase_batch: {} msgs *****".format(
+            len(msgs)))
+
+        result = self._perform_transactions(msgs)
+        assert not is_tx_error(result), "tx={} failed: {}".format(
+            result.txhash, result.raw_log)
+        return result
 
     def execute_add_bot_tip(self, assets: List[Asset]):
         self.check_dca_addr()
@@ -267,7 +598,7 @@ class DCA:
             Coins(funds)
         ))
 
-        perform_transactions(self.terra, self.wallet, msgs)
+        self._perform_transactions(msgs)
 
     def upload_contract(self,
                         filepath: str
@@ -276,9 +607,7 @@ class DCA:
         file_bytes = base64.b64encode(contract_file.read()).decode()
         store_code = MsgStoreCode(self.wallet.key.acc_address, file_bytes, AccessConfig(
             AccessType.ACCESS_TYPE_EVERYBODY,   AccAddress("")))
-        store_code_tx = self.wallet.create_and_sign_tx(CreateTxOptions(
-            msgs=[store_code]))
-        store_code_tx_result = self.terra.tx.broadcast(store_code_tx)
+        store_code_tx_result = self._perform_transaction(store_code)
         print(store_code_tx_result.logs)
         if store_code_tx_result.logs == None:
             return ""
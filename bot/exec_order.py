@@ -1,13 +1,22 @@
 import traceback
 from bot.db.table.dca_order import DcaOrder
 from bot.db.table.purchase_history import PurchaseHistory
-from bot.type import AssetClass, TokenAsset, SimulateSwapOperation
-from bot.util import AstroSwap, NativeAsset,\
-    Asset, parse_hops_from_string
-from typing import List, Optional
-from bot.db.table.user_tip_balance import UserTipBalance
+from bot.db.table.pending_tx import PendingTx
+from bot.db.table.user import User
+from bot.type import SimulateSwapOperation
+from bot.util import AstroSwap, Asset
+from typing import Any, List, Optional, Set, Tuple
 from bot.db_sync import Sync
-from apscheduler.schedulers.blocking import BlockingScheduler
+from bot.shard import ShardCoordinator
+from bot.fee import FeeSchedule, compute_fee_redeem
+from bot.settings import SIMULATION_MAX_CONCURRENCY, SIMULATION_TIMEOUT, \
+    POOL_RESERVE_TTL, TX_CONFIRM_BATCH_SIZE, TX_CONFIRM_TIMEOUT, ORDER_LEASE_TTL, \
+    OFF_CHAIN_SIMULATION_TOLERANCE, TX_QUERY_MAX_CONCURRENCY, TX_QUERY_TIMEOUT
+from bot.gas import OUT_OF_GAS_CODE
+from terra_sdk.core.broadcast import is_tx_error
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from bot.jobs import PURCHASE_JOB_FUNC, set_context, get_job_next_run_times, is_order_queued
 from datetime import datetime, timedelta
 import logging
 
@@ -21,8 +30,30 @@ class ExecOrder(Sync):
     convenient methods for the execution of the dca orders
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, shard: Optional[ShardCoordinator] = None, wallet_index: int = 0):
+        super().__init__(shard, wallet_index)
+        # sharded mode: the orders which could not be scheduled because another worker holds their lease
+        self.unclaimed_order_ids: Set[str] = set()
+
+    def claim_order(self, order: DcaOrder, expire_at: datetime) -> bool:
+        """ Sharded mode: claim or renew the lease of the order till expire_at (see ShardCoordinator.claim).
+
+            Returns:
+                bool: True if the bot can schedule and purchase the order (always True without sharding).
+        """
+        if self.shard is None:
+            return True
+        if not self.is_owned(str(order.user_address)):
+            return False
+        return self.shard.claim(str(order.id), expire_at)
+
+    def build_fee_schedule(self, user_address: str, max_hops: int) -> FeeSchedule:
+        """ Read the user tip balances once and compute the fee redeem for every hops length
+            between 1 and max_hops.
+        """
+        logger.debug("build_fee_schedule")
+        return FeeSchedule(user_address, self.db.get_user_tip_balance(user_address),
+                           self.get_config().hop_fee_map, max_hops)
 
     def build_fee_redeem(self, user_address: str,  hops_len: int) -> List[Asset]:
         """ The bot will try to take fee from the first asset in user_tip_balance.
@@ -39,53 +70,12 @@ class ExecOrder(Sync):
                              - example: [Native('uluna', '1000'), TokenAsset('token_addrr', '2000' )]
 
         """
-
-        def _get_asset(tip: UserTipBalance) -> Asset:
-            fee_asset: Asset
-            if str(tip.asset_class) == AssetClass.NATIVE_TOKEN.value:
-                logger.debug("*** native ***")
-                fee_asset = NativeAsset(str(tip.denom), str(fee))
-                logger.debug(fee_asset.get_asset())
-            else:
-                logger.debug("*** token ***", )
-                fee_asset = TokenAsset(str(tip.denom), str(fee))
-                logger.debug(fee_asset.get_asset())
-            return fee_asset
-
         logger.debug("build_fee_redeem")
-        user_tip_balances = self.db.get_user_tip_balance(user_address)
-        whitelisted_fee_assets = self.db.get_whitelisted_fee_asset()
-
-        fee_redeem: List[Asset] = []
-        hop_fee_map = {}
-        for asset in whitelisted_fee_assets:
-            hop_fee_map[asset.denom] = asset.amount.real
-        assert len(user_tip_balances) > 0, "user_tip_balance is empty!"
-        logger.debug("hop_fee_map={}".format(hop_fee_map))
-
-        h = hops_len
-        for tip in user_tip_balances:
-            amount: int = tip.amount.real
-            tip_fee = hop_fee_map[tip.denom]
-            q = amount // tip_fee
-            if q >= h:
-                fee = tip_fee * h
-                fee_redeem.append(_get_asset(tip))
-                h = 0
-                break
-            else:
-                fee = tip_fee * q
-                fee_redeem.append(_get_asset(tip))
-                h = h - q
-        err_msg = """tip_balance={} is not sufficient to pays for fees
-                    based on hops_len={} and fees structure = {}""".format(user_tip_balances,
-                                                                           hops_len, hop_fee_map)
-        assert h == 0, err_msg
-
-        logger.debug("fee_redeem: {}".format(fee_redeem))
-        return fee_redeem
-
-    def build_fee_reedem_usd_map(self, user_address: str,  list_hops_string: List[str], prices: dict) -> dict:
+        return compute_fee_redeem(self.db.get_user_tip_balance(user_address),
+                                  self.get_config().hop_fee_map, hops_len)
+
+    def build_fee_reedem_usd_map(self, user_address: str,  list_hops_string: List[str], prices: dict,
+                                 fee_schedule: Optional[FeeSchedule] = None) -> dict:
         """
             Parameters:
                 - user_address (str): the address of the user.
@@ -95,6 +85,8 @@ class ExecOrder(Sync):
                 - prices (dict): key = asset's denomination, value = price in usd
                     example: {'uluna': 0.1
                               'token_addr1': 0.2}
+                - fee_schedule (FeeSchedule): the fee schedule of the user. If None, it is built
+                    for the longest hops string.
 
             returns:
                 dict: key = hops_string, value = fee_redeem
@@ -106,12 +98,14 @@ class ExecOrder(Sync):
         logger.info("build_fee_reedem_usd_map")
         fee_redem_usd_map = {}
         hops_len = 0
+        if fee_schedule is None:
+            fee_schedule = self.build_fee_schedule(
+                user_address, max([len(h.split("><")) for h in list_hops_string], default=0))
         for h in list_hops_string:
             try:
                 hops_len = len(h.split("><"))
-                fee_reedem = self.build_fee_redeem(user_address, hops_len)
-                fee_redem_usd_map[h] = self.convert_assets_to_usd_amount(
-                    fee_reedem, prices)
+                fee_redem_usd_map[h] = fee_schedule.get_fee_redeem_usd(
+                    hops_len, prices)
             except:
                 erro_msg = traceback.format_exc()
                 logger.error("Unable to build fee_redeem for user_address={} with hop_len={}. err_msg={}".format(
@@ -124,26 +118,6 @@ class ExecOrder(Sync):
         logger.debug("fee_reedem_usd_map={}".format(fee_redem_usd_map))
         return fee_redem_usd_map
 
-    def convert_assets_to_usd_amount(self, assets: List[Asset], prices: dict) -> float:
-        """
-            Parameters:
-                - assets (List[Asset]): list of assets.
-                    example: [Native('uluna', '1000'), TokenAsset('token_addrr', '2000' )]
-
-                - prices (dict): key = asset's denomination, value = price in usd
-                    example: {'uluna': 0.1
-                              'token_addr1': 0.2}
-            Returns:
-                float: the usd value of the list of assets
-
-        """
-        total_usd_amount = 0
-        for a in assets:
-            amount = int(a.get_asset()["amount"])
-            amount_usd = amount * prices[a.get_denom()]
-            total_usd_amount += amount_usd
-        return total_usd_amount
-
     def get_token_price_map(self) -> dict:
         """
             Returns:
@@ -159,7 +133,8 @@ class ExecOrder(Sync):
         return prices
 
     def build_hops(self, user_address: str,  offer_amount: int, start_denom: str,
-                   target_denom: str, hops_len: int) -> List[AstroSwap]:
+                   target_denom: str, hops_len: int,
+                   fee_schedule: Optional[FeeSchedule] = None) -> List[AstroSwap]:
         """
             Parameters:
                 - user_address (str): the address of the user.
@@ -167,6 +142,7 @@ class ExecOrder(Sync):
                 - start_denom (str): the denomination of the start asset 
                 - target_denom (str): the denomination of the target asset
                 - hops_len (int): the number of hops (swap operations) between a start asset and the target asset.
+                - fee_schedule (FeeSchedule): the fee schedule of the user. If None, it is built from the db.
 
             Returns:
                 List[AstroSwap]: the hops (swap operations) between a start asset and the target asset
@@ -177,26 +153,27 @@ class ExecOrder(Sync):
         """
         logger.info("build_hops:")
 
-        list_hops = self.db.get_whitelisted_hops_all(
+        list_hops_string = self.get_routes(
             start_denom, target_denom, hops_len)
 
         err_msg = """There are no hops with inputs:
                     start_denom={},
                     target_denom={},
                     hops_len={}""".format(start_denom, target_denom, hops_len)
-        assert len(list_hops) > 0, err_msg
+        assert len(list_hops_string) > 0, err_msg
 
-        list_hops_string = [h["hops"] for h in list_hops]
         prices = self.get_token_price_map()
         logger.debug("prices={}".format(prices))
 
+        if fee_schedule is None:
+            fee_schedule = self.build_fee_schedule(user_address, hops_len)
         fee_redem_usd_map = self.build_fee_reedem_usd_map(
-            user_address, list_hops_string, prices)
+            user_address, list_hops_string, prices, fee_schedule)
 
         best_hops_string = self.choose_best_execution_hop(target_denom,
                                                           offer_amount, fee_redem_usd_map, prices)
 
-        return parse_hops_from_string(best_hops_string, self.db.get_whitelisted_tokens(), self.db.get_whitelisted_hops())
+        return self.get_config().parse_hops(best_hops_string)
 
     def choose_best_execution_hop(self,  target_denom: str,
                                   offer_amount: int, fee_redem_usd_map: dict, prices: dict) -> str:
@@ -228,15 +205,35 @@ class ExecOrder(Sync):
             logger.info("best_hop: {}".format(list_hops_string[0]))
             return list_hops_string[0]
 
+        config = self.get_config()
+        swo_map = {}
+        for hop in list_hops_string:
+            try:
+                route = config.compile_route(hop)
+                swo_map[hop] = SimulateSwapOperation(
+                    offer_amount, route.operations, route.to_dict())
+            except:
+                erro_msg = traceback.format_exc()
+                logger.error("Unable to parse hop={}. err_msg={}".format(
+                    hop, erro_msg
+                ))
+
+        best_hop = self.choose_best_execution_hop_off_chain(
+            target_denom, swo_map, fee_redem_usd_map, prices)
+        if best_hop is not None:
+            return best_hop
+
+        # simulate all the candidate hops concurrently
+        list_simulated_hops = list(swo_map.keys())
+        list_target_token_receive = self.dca.simulate_swap_operations_batch(
+            [swo_map[h] for h in list_simulated_hops], SIMULATION_MAX_CONCURRENCY, SIMULATION_TIMEOUT)
+
         best_hop = list_hops_string[0]
         best_execution = 0
-        for hop in list_hops_string:
+        for hop, target_token_receive in zip(list_simulated_hops, list_target_token_receive):
             try:
+                assert target_token_receive is not None, "simulation failed"
                 hop_fees_usd_amount = fee_redem_usd_map[hop]
-                swap_operations = parse_hops_from_string(
-                    hop, self.db.get_whitelisted_tokens(), self.db.get_whitelisted_hops())
-                swo = SimulateSwapOperation(offer_amount, swap_operations)
-                target_token_receive = self.dca.simulate_swap_operations(swo)
                 target_usd_amount = target_token_receive * prices[target_denom]
                 hop_execution = target_usd_amount - hop_fees_usd_amount
                 if hop_execution > best_execution:
@@ -250,8 +247,120 @@ class ExecOrder(Sync):
         logger.info("best_hop={}".format(best_hop))
         return best_hop
 
-    def purchase(self, order: DcaOrder):
+    def choose_best_execution_hop_off_chain(self, target_denom: str, swo_map: dict,
+                                            fee_redem_usd_map: dict, prices: dict) -> Optional[str]:
+        """ Rank all the candidate hops with the off-chain pool simulator and confirm only
+            the best one with a simulate_swap_operations query.
+
+            Parameters:
+                - target_denom (str): the denomination of the target asset.
+                - swo_map (dict): key = hops_string, value = SimulateSwapOperation
+                - fee_redem_usd_map (dict): key = hops_string, value = fee redeem in usd
+                - prices (dict): key = asset's denomination, value = price in usd
+
+            Returns:
+                Optional[str]: the hops string with the greatest execution value. It is None if the
+                    reserves of some pools are unknown, the on-chain confirmation failed or its amount diverges
+                    from the off-chain one by more than OFF_CHAIN_SIMULATION_TOLERANCE (stale reserves).
+                    In this case the caller should simulate the hops on-chain.
+        """
+        try:
+            list_hops_string = list(swo_map.keys())
+            if len(list_hops_string) == 0:
+                return None
+
+            # refresh the stale reserves of the pairs used by the candidate hops
+            config = self.get_config()
+            hop_ids = set()
+            for hop in list_hops_string:
+                hop_ids.update(config.compile_route(hop).get_hop_ids())
+            hops = config.get_hops(hop_ids)
+            self.refresh_pool_reserves(hops, POOL_RESERVE_TTL)
+            simulator = self.get_pool_simulator([str(h.pair_id) for h in hops])
+
+            best_hop = list_hops_string[0]
+            best_execution = 0
+            off_chain_target_token_receive = {}
+            for hop in list_hops_string:
+                swo = swo_map[hop]
+                target_token_receive = simulator.simulate_swap_operations(
+                    swo.offer_amount, swo.operations)
+                if target_token_receive is None:
+                    return None
+                off_chain_target_token_receive[hop] = target_token_receive
+                hop_execution = target_token_receive * \
+                    prices[target_denom] - fee_redem_usd_map[hop]
+                if hop_execution > best_execution:
+                    best_execution = hop_execution
+                    best_hop = hop
+
+            # confirm the winner on chain
+            best_target_token_receive = off_chain_target_token_receive[best_hop]
+            target_token_receive = self.dca.simulate_swap_operations(
+                swo_map[best_hop])
+            logger.info("best_hop={} (off-chain simulation={}, on-chain simulation={})".format(
+                best_hop, best_target_token_receive, target_token_receive))
+            if target_token_receive is None or abs(target_token_receive - best_target_token_receive) > \
+                    OFF_CHAIN_SIMULATION_TOLERANCE * best_target_token_receive:
+                logger.warning("The off-chain simulation of best_hop={} diverges from the on-chain one".format(
+                    best_hop))
+                return None
+            return best_hop
+        except:
+            erro_msg = traceback.format_exc()
+            logger.error("Unable to choose the best hop off-chain. err_msg={}".format(
+                erro_msg))
+            return None
+
+    def prepare_purchase(self, order: DcaOrder) -> Tuple[List[AstroSwap], List[Asset]]:
+        """ Choose the hops and the fee redeem of the dca order.
+
+            Returns:
+                Tuple[List[AstroSwap], List[Asset]]: the hops and the fee redeem
+        """
+        fee_schedule = self.build_fee_schedule(
+            str(order.user_address), order.max_hops.real)
+        hops = self.build_hops(str(order.user_address),
+                               order.initial_asset_amount.real,
+                               str(order.initial_asset_denom),
+                               str(order.target_asset_denom),
+                               order.max_hops.real,
+                               fee_schedule
+                               )
+
+        fee_redeem = fee_schedule.get_fee_redeem(len(hops))
+        return hops, fee_redeem
+
+    def log_purchase(self, order: DcaOrder, hops: List[AstroSwap], fee_redeem: List[Asset],
+                     success: bool, err_msg: str, txhash: Optional[str] = None):
+        self.db.log_purchase_history(str(order.id), int(str(order.initial_asset_amount)),
+                                     str(order.initial_asset_denom), str(
+                                         order.target_asset_denom),
+                                     int(str(order.dca_amount)
+                                         ),  "{}".format(hops),
+                                     "{}".format([f.get_asset()
+                                                 for f in fee_redeem]),
+                                     success, err_msg, txhash)
+
+    def _track_tx(self, result: Any) -> Optional[str]:
+        """ In sync broadcast mode the tx is stored in the pending_tx table till it is confirmed
+            (see confirm_pending_txs).
+
+            Returns:
+                Optional[str]: the hash of the pending tx. None in block broadcast mode.
+        """
+        if not self.dca.is_sync_broadcast():
+            return None
+        assert not is_tx_error(result), "tx={} rejected by the mempool: {}".format(
+            result.txhash, result.raw_log)
+        self.db.insert_or_update(PendingTx(result.txhash))
+        return result.txhash
+
+    def purchase(self, order: DcaOrder) -> Optional[str]:
         """ execute the dca order.
+
+            Returns:
+                Optional[str]: the hash of the tx if it is pending (sync broadcast mode), otherwise None.
         """
         logger.info("""**************** Purchase Order *******************
             {}""".format(order))
@@ -260,36 +369,75 @@ class ExecOrder(Sync):
         success = True
         hops = []
         fee_redeem = []
+        txhash = None
         try:
-            hops = self.build_hops(str(order.user_address),
-                                   order.initial_asset_amount.real,
-                                   str(order.initial_asset_denom),
-                                   str(order.target_asset_denom),
-                                   order.max_hops.real,
-                                   )
-
-            fee_redeem = self.build_fee_redeem(
-                str(order.user_address),  len(hops))
+            hops, fee_redeem = self.prepare_purchase(order)
 
-            self.dca.execute_perform_dca_purchase(
+            result = self.dca.execute_perform_dca_purchase(
                 str(order.user_address), order.dca_order_id.real, hops, fee_redeem)
+            txhash = self._track_tx(result)
         except:
             err_msg = traceback.format_exc()
             # sometimes there may be an error (e.g timeout error.).
             # Nonetheless the purchase still went through.
-            # So success field should not be interpret in the strict sense
+            # So success field should not be interpret in the strict sense.
+            # In sync broadcast mode this ambiguity does not exist: the result is confirmed by confirm_pending_txs.
             success = False
 
-        self.db.log_purchase_history(str(order.id), int(str(order.initial_asset_amount)),
-                                     str(order.initial_asset_denom), str(
-                                         order.target_asset_denom),
-                                     int(str(order.dca_amount)
-                                         ),  "{}".format(hops),
-                                     "{}".format([f.get_asset()
-                                                 for f in fee_redeem]),
-                                     success, err_msg)
+        # a pending purchase is successful only once its tx is confirmed
+        self.log_purchase(order, hops, fee_redeem,
+                          success and txhash is None, err_msg, txhash)
+        return txhash
 
-    def purchase_and_sync(self, order_id: str, scheduler: Optional[BlockingScheduler] = None):
+    def purchase_batch(self, orders: List[DcaOrder]) -> List[str]:
+        """ execute several dca orders with a single tx. If the tx fails, the orders are split in two halves
+            which are executed again, till the failing orders are isolated. The result of every order is
+            logged in the purchase_history table.
+
+            Returns:
+                List[str]: the ids of the orders whose tx is pending (sync broadcast mode).
+        """
+        logger.info("""**************** Purchase Batch *******************
+            {} orders""".format(len(orders)))
+
+        batch = []
+        for order in orders:
+            try:
+                hops, fee_redeem = self.prepare_purchase(order)
+                msg = self.dca.build_perform_dca_purchase_msg(
+                    str(order.user_address), order.dca_order_id.real, hops, fee_redeem)
+                batch.append((order, hops, fee_redeem, msg))
+            except:
+                self.log_purchase(order, [], [], False, traceback.format_exc())
+
+        return self._execute_purchase_batch(batch)
+
+    def _execute_purchase_batch(self, batch: List[Tuple[DcaOrder, List[AstroSwap], List[Asset], Any]]) -> List[str]:
+        if len(batch) == 0:
+            return []
+
+        err_msg = ""
+        txhash = None
+        try:
+            result = self.dca.execute_perform_dca_purchase_batch(
+                [b[3] for b in batch])
+            txhash = self._track_tx(result)
+        except:
+            err_msg = traceback.format_exc()
+
+        if err_msg != "" and len(batch) > 1:
+            # the tx is atomic: none of the purchases went through, bisect to isolate the failing orders
+            logger.info("purchase batch of {} orders failed: bisect".format(
+                len(batch)))
+            mid = len(batch) // 2
+            return self._execute_purchase_batch(batch[:mid]) + self._execute_purchase_batch(batch[mid:])
+
+        for order, hops, fee_redeem, _ in batch:
+            self.log_purchase(order, hops, fee_redeem,
+                              err_msg == "" and txhash is None, err_msg, txhash)
+        return [] if txhash is None else [str(b[0].id) for b in batch]
+
+    def purchase_and_sync(self, order_id: str, scheduler: Optional[BaseScheduler] = None):
         """ execute the dca order, sync the local db and optionally re-schedule the next execution
         """
         try:
@@ -301,40 +449,182 @@ class ExecOrder(Sync):
                 orders) == 1, "Got multiple order with the same id: {}".format(orders)
 
             order = orders[0]
-            user_address = str(order.user_address)
-            self.purchase(order)
-            self.sync_user_data(user_address)
-
-            orders = self.db.get_dca_orders(
-                user_address=user_address, schedule=False)
-            if len(orders) == 0:
-                logger.info("""Can't schedule next run time for order_id={1}.
-                The order is either fully completed and removed from the dca_order table or
-                the trigger 'reset_schedule' didn't work because something went wrong.
-                Check this query to investigate further:
-
-                select *
-                from {0}
-                where
-                    success = 0
-                    and order_id = '{1}'
-                """.format(PurchaseHistory.__tablename__, order.id))
-            if scheduler is not None and len(orders) > 0:
-                self.schedule_next_run(orders, scheduler)
+            if not self.claim_order(order, datetime.utcnow() + timedelta(seconds=ORDER_LEASE_TTL)):
+                # the partitions have changed since the job was scheduled, the new owner schedules the order
+                logger.info("skip order_id={}: the order belongs to another worker".format(order_id))
+                return
+            if self.purchase(order) is None:
+                self.sync_and_schedule(order, scheduler)
+            else:
+                self.hold_order(order)
         except:
             err_msg = traceback.format_exc()
             calling_method = "purchase_and_sync"
             self.db.log_error(err_msg, calling_method, order_id)
 
-    def schedule_next_run(self, orders: List[DcaOrder], scheduler: BlockingScheduler):
+    def purchase_batch_and_sync(self, order_ids: List[str], scheduler: Optional[BaseScheduler] = None):
+        """ execute the dca orders in a single tx (see purchase_batch), sync the local db and
+            optionally re-schedule the next executions
+        """
+        orders = []
+        for order_id in order_ids:
+            try:
+                expire_at = datetime.utcnow() + timedelta(seconds=ORDER_LEASE_TTL)
+                orders += [o for o in self.db.get_dca_orders(order_id)
+                           if self.claim_order(o, expire_at)]
+            except:
+                self.db.log_error(traceback.format_exc(),
+                                  "purchase_batch_and_sync", order_id)
+
+        pending_order_ids = []
+        try:
+            pending_order_ids = self.purchase_batch(orders)
+        except:
+            self.db.log_error(traceback.format_exc(), "purchase_batch_and_sync")
+
+        for order in orders:
+            try:
+                if str(order.id) in pending_order_ids:
+                    self.hold_order(order)
+                else:
+                    self.sync_and_schedule(order, scheduler)
+            except:
+                self.db.log_error(traceback.format_exc(),
+                                  "purchase_batch_and_sync", str(order.id))
+
+    def hold_order(self, order: DcaOrder):
+        """ Keep the order scheduled while the tx of its purchase is pending, so it can't be purchased
+            again by schedule_orders in the meantime. The order is released by confirm_pending_txs.
+        """
+        order.schedule = True
+        order.next_run_time = datetime.utcnow() + timedelta(seconds=2 * TX_CONFIRM_TIMEOUT)
+        self.claim_order(order, order.next_run_time +
+                         timedelta(seconds=ORDER_LEASE_TTL))
+        logger.info("hold order_id={} till its tx is confirmed: next_run_time={}".format(
+            order.id, order.next_run_time))
+        self.db.update_schedule(str(order.id), True, order.next_run_time)
+
+    def confirm_pending_txs(self, scheduler: Optional[BaseScheduler] = None):
+        """ Confirm the oldest txs of the pending_tx table (at most TX_CONFIRM_BATCH_SIZE) and update the
+            success of their purchases. A tx which is not found after TX_CONFIRM_TIMEOUT seconds is a failed
+            purchase. The orders of the confirmed txs are synced and scheduled again, like after a purchase
+            in block broadcast mode.
+
+            A batched tx (see purchase_batch) is only checked by the mempool in sync broadcast mode, so a single
+            failing order fails the whole tx in the block. The orders of a failed tx of several orders are split
+            in two halves which are purchased again, like the bisection of purchase_batch in block broadcast mode.
+        """
+        if self.shard is None:
+            pending_txs = self.db.get_pending_txs(TX_CONFIRM_BATCH_SIZE)
+        else:
+            # the txs of the other partitions are confirmed by their worker. A tx whose orders
+            # have been removed meanwhile can be confirmed by any worker.
+            tx_users = self.db.get_pending_tx_users()
+            pending_txs = []
+            for pending_tx in self.db.get_pending_txs():
+                users = tx_users.get(str(pending_tx.txhash), set())
+                if len(users) == 0 or any(self.is_owned(u) for u in users):
+                    pending_txs.append(pending_tx)
+            pending_txs = pending_txs[:TX_CONFIRM_BATCH_SIZE]
+        if len(pending_txs) == 0:
+            return
+        tx_infos = self.dca.query_tx_infos([str(p.txhash) for p in pending_txs],
+                                           TX_QUERY_MAX_CONCURRENCY, TX_QUERY_TIMEOUT)
+        gas_model = self.dca.sequence_manager.gas_model
+        now = datetime.utcnow()
+
+        confirmed_txhashes = []
+        # the order ids of the failed txs of several orders
+        split_order_ids: List[List[str]] = []
+        for pending_tx in pending_txs:
+            txhash = str(pending_tx.txhash)
+            info = tx_infos.get(txhash)
+            if info is None:
+                # the tx is not in a block yet or the query failed: try again till the tx expires,
+                # so a tx whose query keeps failing does not block the newer txs
+                if (now - pending_tx.create_at).total_seconds() < TX_CONFIRM_TIMEOUT:  # type: ignore
+                    continue
+                success = False
+                err_msg = "tx={} not found after {} seconds".format(
+                    txhash, TX_CONFIRM_TIMEOUT)
+            else:
+                success = info.code in [None, 0]
+                err_msg = "" if success else info.rawlog
+                if gas_model is not None:
+                    msgs = info.tx.body.messages
+                    if info.code == OUT_OF_GAS_CODE and info.codespace == "sdk":
+                        gas_model.invalidate(msgs)
+                    else:
+                        gas_model.update(msgs, info.gas_used)
+
+            logger.info("confirm tx={}: success={}".format(txhash, success))
+            if info is not None and not success:
+                tx_order_ids = sorted(self.db.get_tx_order_ids([txhash]))
+                if len(tx_order_ids) > 1:
+                    split_order_ids.append(tx_order_ids)
+            self.db.confirm_pending_tx(txhash, success, err_msg)
+            confirmed_txhashes.append(txhash)
+
+        if len(confirmed_txhashes) == 0:
+            return
+        resubmitted_order_ids = set(
+            order_id for order_ids in split_order_ids for order_id in order_ids)
+        for order_id in self.db.get_tx_order_ids(confirmed_txhashes):
+            try:
+                for order in self.db.get_dca_orders(order_id):
+                    # release the order (see hold_order)
+                    order.schedule = False
+                    order.next_run_time = None
+                    self.db.update_schedule(order_id, False, None)
+                    if order_id not in resubmitted_order_ids:
+                        self.sync_and_schedule(order, scheduler)
+            except:
+                self.db.log_error(traceback.format_exc(),
+                                  "confirm_pending_txs", order_id)
+
+        for order_ids in split_order_ids:
+            logger.info("tx of {} orders failed: bisect".format(len(order_ids)))
+            mid = len(order_ids) // 2
+            self.purchase_batch_and_sync(order_ids[:mid], scheduler)
+            self.purchase_batch_and_sync(order_ids[mid:], scheduler)
+
+    def sync_and_schedule(self, order: DcaOrder, scheduler: Optional[BaseScheduler] = None):
+        """ sync the user data of the order after a purchase and optionally re-schedule the next execution
+        """
+        user_address = str(order.user_address)
+        self.sync_user_data(user_address)
+        # a successful purchase is reset by the trigger 'reset_schedule', a failed one is reset here
+        self.db.reset_expired_schedules(user_address)
+
+        orders = self.db.get_dca_orders(
+            user_address=user_address, schedule=False)
+        if len(orders) == 0:
+            logger.info("""Can't schedule next run time for order_id={1}.
+            The order is either fully completed and removed from the dca_order table or
+            it has not been reset (trigger 'reset_schedule' or reset_expired_schedules)
+            because something went wrong.
+            Check this query to investigate further:
+
+            select *
+            from {0}
+            where
+                success = 0
+                and order_id = '{1}'
+            """.format(PurchaseHistory.__tablename__, order.id))
+        if scheduler is not None and len(orders) > 0:
+            self.schedule_next_run(orders, scheduler)
+
+    def schedule_next_run(self, orders: List[DcaOrder], scheduler: BaseScheduler):
         """ It schedules for each order a one off purchase job to be executed at a future date.
 
             Parameters:
                 - orders (List[DcaOrder]): a list of dca orders
-                - scheduler (BlockingScheduler): a instance of BlockingScheduler which is responsible for
+                - scheduler (BaseScheduler): a instance of BaseScheduler which is responsible for
                     executing the schedule jobs.
         """
 
+        # the job is stored by textual reference, so it finds the bot and the scheduler in the job context
+        set_context(self, scheduler)
         delta = 20
         for order in orders:
             next_run_time = datetime.utcfromtimestamp(
@@ -343,29 +633,148 @@ class ExecOrder(Sync):
                 next_run_time = datetime.utcnow() + timedelta(seconds=delta)
                 delta += 60
 
-            scheduler.add_job(self.purchase_and_sync, 'date',
-                              run_date=next_run_time,  id=order.id,  args=[order.id, scheduler])
+            # sharded mode: the lease is held till the purchase, so no other worker schedules the order meanwhile
+            if not self.claim_order(order, next_run_time + timedelta(seconds=ORDER_LEASE_TTL)):
+                if self.is_owned(str(order.user_address)):
+                    logger.info("order_id={} is leased by another worker, try again on the next heartbeat".format(
+                        order.id))
+                    self.unclaimed_order_ids.add(str(order.id))
+                continue
+            self.unclaimed_order_ids.discard(str(order.id))
+
+            scheduler.add_job(PURCHASE_JOB_FUNC, 'date',
+                              run_date=next_run_time,  id=order.id,  args=[order.id], replace_existing=True)
 
             logger.info(
                 "update order_id={}: schedule=True, next_run_time={}".format(
                     order.id, next_run_time))
             order.schedule = True
             order.next_run_time = next_run_time
-            self.db.insert_or_update(order)
+            self.db.update_schedule(str(order.id), True, next_run_time)
+
+    def reconcile_jobs(self, scheduler: BaseScheduler, jobstore: SQLAlchemyJobStore) -> List[DcaOrder]:
+        """ Restart path of the bot. The purchase jobs survive a restart in the persistent jobstore,
+            so only the orders whose job has drifted are scheduled again:
+                - the order is not scheduled or its job is missing
+                - the job is paused or its next run time is expired
+                - the next run time of the job differs from the one of the order
+            The jobs of the orders which no longer exist or belong to another worker (sharded mode) are removed.
+            The orders of the pending txs are not scheduled (see hold_order).
 
-    def schedule_orders(self, scheduler: BlockingScheduler):
+            Parameters:
+                - scheduler (BaseScheduler): the scheduler (it does not need to be started yet).
+                - jobstore (SQLAlchemyJobStore): the persistent jobstore of the scheduler.
+
+            Returns:
+                List[DcaOrder]: the orders which have been scheduled again.
+        """
+        job_next_run_times = get_job_next_run_times(jobstore)
+        # the orders of the pending txs are held till their tx is confirmed (see hold_order)
+        pending_order_ids = set(self.db.get_tx_order_ids())
+        now = datetime.utcnow()
+
+        drifted_orders = []
+        for order in self.db.get_dca_orders():
+            if not self.is_owned(str(order.user_address)):
+                continue
+            job_next_run_time = job_next_run_times.pop(str(order.id), None)
+            if str(order.id) in pending_order_ids:
+                continue
+            if not order.schedule or order.next_run_time is None or job_next_run_time is None \
+                    or job_next_run_time < now \
+                    or abs((job_next_run_time - order.next_run_time).total_seconds()) > 1:  # type: ignore
+                drifted_orders.append(order)
+
+        for job_id in job_next_run_times.keys():
+            logger.info("remove job_id={}: the order does not exist or belongs to another worker".format(
+                job_id))
+            jobstore.remove_job(job_id)
+        if self.shard is not None:
+            self.shard.release(list(job_next_run_times.keys()))
+
+        logger.info("reconcile_jobs: {} orders to reschedule, {} orphan jobs removed".format(
+            len(drifted_orders), len(job_next_run_times)))
+        if len(drifted_orders) > 0:
+            self.schedule_next_run(drifted_orders, scheduler)
+        return drifted_orders
+
+    def schedule_orders(self, scheduler: BaseScheduler):
         """ This method is basically like schedule_next_run but it does not depend
             on the orders arguments. It will be schedule to run on regular basis to pick
             up new orders which are not scheduled yet or orders with next_run_time expired.
         """
-        orders = self.db.get_dca_orders(schedule=False)
+        # the orders with next_run_time expired are not scheduled anymore
+        self.reset_expired_orders(scheduler)
+
+        orders = [o for o in self.db.get_dca_orders(schedule=False)
+                  if self.is_owned(str(o.user_address))]
+        if len(orders) > 0:
+            self.schedule_next_run(orders, scheduler)
+
+    def reset_expired_orders(self, scheduler: BaseScheduler) -> int:
+        """ Reset the expired schedules of the orders of the bot (see Database.reset_expired_schedules).
+            The orders of the other partitions and the orders whose purchase may still go through are kept
+            scheduled: their job is late, their purchase is queued in the executor, their tx is pending
+            or another worker holds their lease.
+
+            Returns:
+                int: the number of orders reset.
+        """
+        orders = [o for o in self.db.get_dca_orders(schedule=True, expired_next_run_time=True)
+                  if self.is_owned(str(o.user_address))]
+        if len(orders) == 0:
+            return 0
+        busy_order_ids = set(self.db.get_tx_order_ids())
+        if self.shard is not None:
+            now = datetime.utcnow()
+            busy_order_ids |= set(str(l.name) for l in self.db.get_leases()
+                                  if str(l.worker_id) != self.shard.worker_id and l.expire_at > now)
+        order_ids = [str(o.id) for o in orders if str(o.id) not in busy_order_ids
+                     and not is_order_queued(str(o.id)) and scheduler.get_job(str(o.id)) is None]
+        if len(order_ids) == 0:
+            return 0
+        return self.db.reset_expired_schedules(order_ids=order_ids)
+
+    def heartbeat(self, scheduler: BaseScheduler, jobstore: SQLAlchemyJobStore):
+        """ Sharded mode: refresh the heartbeat of the worker, rebalance the orders when a worker
+            has joined or left the ring and try again to schedule the orders leased by another worker.
+        """
+        assert self.shard is not None, "heartbeat is only used in sharded mode"
+        try:
+            if self.shard.heartbeat():
+                self.rebalance(scheduler, jobstore)
+            self.schedule_unclaimed_orders(scheduler)
+        except:
+            err_msg = traceback.format_exc()
+            self.db.log_error(err_msg, "heartbeat")
+
+    def schedule_unclaimed_orders(self, scheduler: BaseScheduler):
+        """ Sharded mode: the lease of an order moved to the worker may still be held by its previous owner
+            (see schedule_next_run). The order is scheduled once the lease is released or expired.
+        """
+        order_ids = set(self.unclaimed_order_ids)
+        self.unclaimed_order_ids -= order_ids
+        orders = []
+        for order_id in order_ids:
+            orders += self.db.get_dca_orders(order_id)
         if len(orders) > 0:
             self.schedule_next_run(orders, scheduler)
 
-        expired_next_run_time_orders = self.db.get_dca_orders(
-            expired_next_run_time=True)
-        if len(expired_next_run_time_orders) > 0:
-            self.schedule_next_run(expired_next_run_time_orders, scheduler)
+    def rebalance(self, scheduler: BaseScheduler, jobstore: SQLAlchemyJobStore) -> List[DcaOrder]:
+        """ Take over the orders of the users acquired by the worker and drop the jobs of the users
+            which moved to another worker (see reconcile_jobs). The acquired users are synced again,
+            since their previous owner may have missed some of their txs.
+
+            Returns:
+                List[DcaOrder]: the orders which have been scheduled by the worker.
+        """
+        assert self.shard is not None, "rebalance is only used in sharded mode"
+        user_addresses = [str(u.id) for u in self.db.get_users()]
+        logger.info("rebalance: users by worker={}".format(
+            self.shard.get_partition_sizes(user_addresses)))
+        for user_address in self.shard.get_acquired_users(user_addresses):
+            self.db.insert_or_update(User(user_address, False))
+        return self.reconcile_jobs(scheduler, jobstore)
 
 
 if __name__ == "__main__":
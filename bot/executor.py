@@ -0,0 +1,160 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class PurchaseExecutor:
+    """ Execute the purchases of the due orders on a bounded pool of workers.
+
+        Route building and simulations of different orders run in parallel, while the signing and the
+        broadcast of the txs are serialized by the DCA class, so two purchases can't collide on the
+        account sequence. An order is queued at most once: if it is submitted again while it is still
+        queued or running, the pending execution is returned instead.
+    """
+
+    def __init__(self, bot: Any, max_workers: int):
+        """
+            Parameters:
+                - bot (ExecOrder): the bot which executes the purchases.
+                - max_workers (int): the maximum number of purchases executed at the same time.
+        """
+        self.bot = bot
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="purchase")
+        # key = order id, value = pending execution of the order
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, order_id: str, scheduler: Optional[Any] = None) -> Future:
+        """
+            Parameters:
+                - order_id (str): the id of the dca order.
+                - scheduler (BaseScheduler): the scheduler used to re-schedule the next purchase.
+
+            Returns:
+                Future: the pending execution of the order.
+        """
+        with self._lock:
+            future = self._futures.get(order_id)
+            if future is not None and not future.done():
+                logger.info(
+                    "order_id={} is already queued for execution".format(order_id))
+                return future
+            future = self._pool.submit(self._run, order_id, scheduler)
+            self._futures[order_id] = future
+            return future
+
+    def _run(self, order_id: str, scheduler: Optional[Any]):
+        try:
+            self.bot.purchase_and_sync(order_id, scheduler)
+        finally:
+            with self._lock:
+                self._futures.pop(order_id, None)
+
+    def pending(self) -> int:
+        """ The number of orders queued or running.
+        """
+        with self._lock:
+            return len(self._futures)
+
+    def is_pending(self, order_id: str) -> bool:
+        """ True if the order is queued or running.
+        """
+        with self._lock:
+            future = self._futures.get(order_id)
+            return future is not None and not future.done()
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+class PurchaseBatcher:
+    """ Collect the orders which are due within a small time window and execute them with a
+        single tx (see ExecOrder.purchase_batch_and_sync). It can replace the PurchaseExecutor
+        in the job context (see bot.jobs.set_executor).
+    """
+
+    def __init__(self, bot: Any, window: float, max_size: int):
+        """
+            Parameters:
+                - bot (ExecOrder): the bot which executes the purchases.
+                - window (float): the number of seconds the first order of a batch waits for other orders.
+                - max_size (int): the maximum number of orders of a batch. A full batch is executed immediately.
+        """
+        self.bot = bot
+        self.window = window
+        self.max_size = max_size
+        self._order_ids: List[str] = []
+        # the orders of the batch being executed
+        self._running_order_ids: List[str] = []
+        self._scheduler: Optional[Any] = None
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        # the batches are executed one at a time
+        self._flush_lock = threading.Lock()
+
+    def submit(self, order_id: str, scheduler: Optional[Any] = None):
+        """
+            Parameters:
+                - order_id (str): the id of the dca order.
+                - scheduler (BaseScheduler): the scheduler used to re-schedule the next purchase.
+        """
+        flush = False
+        with self._lock:
+            if order_id not in self._order_ids:
+                self._order_ids.append(order_id)
+            self._scheduler = scheduler
+            if len(self._order_ids) >= self.max_size:
+                flush = True
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """ Execute the collected orders.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                order_ids = self._order_ids
+                self._order_ids = []
+                self._running_order_ids = order_ids
+                scheduler = self._scheduler
+            if len(order_ids) > 0:
+                logger.info("execute a batch of {} orders".format(len(order_ids)))
+                try:
+                    self.bot.purchase_batch_and_sync(order_ids, scheduler)
+                finally:
+                    with self._lock:
+                        self._running_order_ids = []
+
+    def pending(self) -> int:
+        """ The number of orders waiting for the next batch.
+        """
+        with self._lock:
+            return len(self._order_ids)
+
+    def is_pending(self, order_id: str) -> bool:
+        """ True if the order waits for the next batch or its batch is running.
+        """
+        with self._lock:
+            return order_id in self._order_ids or order_id in self._running_order_ids
+
+    def shutdown(self, wait: bool = True):
+        if wait:
+            self.flush()
+        else:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
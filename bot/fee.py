@@ -0,0 +1,135 @@
+from typing import Dict, List
+from bot.db.table.user_tip_balance import UserTipBalance
+from bot.type import Asset, AssetClass, NativeAsset, TokenAsset
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def compute_fee_redeem(user_tip_balances: List[UserTipBalance], hop_fee_map: Dict[str, int],
+                       hops_len: int) -> List[Asset]:
+    """ The bot will try to take fee from the first asset in user_tip_balance.
+        If this is not sufficient, it will consider also the second asset and so on.
+        For each hop the bot can take a fee amount as configured in whitelisted_fee_assets.
+        If user_tip_balance is not sufficient to pay the fees for the bot, this method will throw an error.
+
+        Parameters:
+            - user_tip_balances (List[UserTipBalance]): the tip balances of the user.
+            - hop_fee_map (dict): key = fee asset's denomination, value = fee amount per hop
+            - hops_len (int): the number of hops (swap operations) between a start asset and the target asset.
+
+        Returns:
+            List[Asset]: list of Assets
+                         - example: [Native('uluna', '1000'), TokenAsset('token_addrr', '2000' )]
+    """
+
+    def _get_asset(tip: UserTipBalance) -> Asset:
+        fee_asset: Asset
+        if str(tip.asset_class) == AssetClass.NATIVE_TOKEN.value:
+            fee_asset = NativeAsset(str(tip.denom), str(fee))
+        else:
+            fee_asset = TokenAsset(str(tip.denom), str(fee))
+        logger.debug(fee_asset.get_asset())
+        return fee_asset
+
+    fee_redeem: List[Asset] = []
+    assert len(user_tip_balances) > 0, "user_tip_balance is empty!"
+    logger.debug("hop_fee_map={}".format(hop_fee_map))
+
+    h = hops_len
+    for tip in user_tip_balances:
+        amount: int = tip.amount.real
+        tip_fee = hop_fee_map[tip.denom]
+        q = amount // tip_fee
+        if q >= h:
+            fee = tip_fee * h
+            fee_redeem.append(_get_asset(tip))
+            h = 0
+            break
+        else:
+            fee = tip_fee * q
+            fee_redeem.append(_get_asset(tip))
+            h = h - q
+    err_msg = """tip_balance={} is not sufficient to pays for fees
+                based on hops_len={} and fees structure = {}""".format(user_tip_balances,
+                                                                       hops_len, hop_fee_map)
+    assert h == 0, err_msg
+
+    logger.debug("fee_redeem: {}".format(fee_redeem))
+    return fee_redeem
+
+
+def convert_assets_to_usd_amount(assets: List[Asset], prices: dict) -> float:
+    """
+        Parameters:
+            - assets (List[Asset]): list of assets.
+                example: [Native('uluna', '1000'), TokenAsset('token_addrr', '2000' )]
+
+            - prices (dict): key = asset's denomination, value = price in usd
+                example: {'uluna': 0.1
+                          'token_addr1': 0.2}
+        Returns:
+            float: the usd value of the list of assets
+
+    """
+    total_usd_amount = 0
+    for a in assets:
+        amount = int(a.get_asset()["amount"])
+        amount_usd = amount * prices[a.get_denom()]
+        total_usd_amount += amount_usd
+    return total_usd_amount
+
+
+class FeeSchedule:
+    """ The fee redeem of a user for every hops length between 1 and max_hops.
+
+        The schedule is computed from a single read of the user tip balances, so the candidate
+        routes of a purchase look up their fee by hops length and the purchase itself reuses
+        the fee redeem of the chosen route.
+    """
+
+    def __init__(self, user_address: str, user_tip_balances: List[UserTipBalance],
+                 hop_fee_map: Dict[str, int], max_hops: int):
+        """
+            Parameters:
+                - user_address (str): the address of the user.
+                - user_tip_balances (List[UserTipBalance]): the tip balances of the user.
+                - hop_fee_map (dict): key = fee asset's denomination, value = fee amount per hop
+                - max_hops (int): the maximum number of hops (swap operations) of a route.
+        """
+        self.user_address = user_address
+        self.max_hops = max_hops
+        # key = hops length, value = fee redeem
+        self.fee_redeem: Dict[int, List[Asset]] = {}
+        # key = hops length, value = error message if the tip balance can't pay for the fees
+        self.errors: Dict[int, str] = {}
+        for hops_len in range(1, max_hops + 1):
+            try:
+                self.fee_redeem[hops_len] = compute_fee_redeem(
+                    user_tip_balances, hop_fee_map, hops_len)
+            except Exception as e:
+                self.errors[hops_len] = repr(e)
+
+    def get_fee_redeem(self, hops_len: int) -> List[Asset]:
+        """ It throws an error if the tip balance is not sufficient to pay for the fees of hops_len.
+        """
+        assert hops_len in self.fee_redeem, self.errors.get(
+            hops_len, "hops_len={} is greater than max_hops={}".format(hops_len, self.max_hops))
+        return self.fee_redeem[hops_len]
+
+    def get_fee_redeem_usd(self, hops_len: int, prices: dict) -> float:
+        """
+            Parameters:
+                - hops_len (int): the number of hops (swap operations).
+                - prices (dict): key = asset's denomination, value = price in usd
+
+            Returns:
+                float: the usd value of the fee redeem
+        """
+        return convert_assets_to_usd_amount(self.get_fee_redeem(hops_len), prices)
+
+    def __repr__(self) -> str:
+        return "FeeSchedule(user_address={}, fee_redeem={}, errors={})".format(
+            self.user_address, {k: [a.get_asset() for a in v] for k, v in self.fee_redeem.items()},
+            list(self.errors.keys()))
@@ -0,0 +1,101 @@
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from terra_sdk.core import Coins
+from terra_sdk.core.fee import Fee
+from terra_sdk.core.msg import Msg
+from terra_sdk.core.wasm import MsgExecuteContract
+import threading
+import math
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# error code of the cosmos sdk (codespace 'sdk') for a tx which ran out of gas
+OUT_OF_GAS_CODE = 11
+
+
+class GasModel:
+    """ Learn the gas used by the txs of the bot from the past broadcast results.
+
+        The msgs of a tx are described by their shape (msg type, hop count, fee asset count), for example
+        ('perform_dca_purchase', 2, 1). Txs with the same shapes use almost the same gas, so the fee of a
+        known shape is set directly and the gas simulation of the LCD is skipped. A shape is forgotten
+        when one of its txs runs out of gas.
+    """
+
+    def __init__(self, margin: float, window: int, fee_denom: str = "uluna"):
+        """
+            Parameters:
+                - margin (float): the gas limit is the max gas used of the recent txs times margin, example: 1.2
+                - window (int): the number of recent txs of a shape considered.
+                - fee_denom (str): the denomination of the gas price the fees are paid with.
+        """
+        self.margin = margin
+        self.window = window
+        self.fee_denom = fee_denom
+        # key = tuple of msg shapes, value = gas used by the recent txs
+        self._gas_used: Dict[Tuple, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_msg_shape(msg: Msg) -> Optional[Tuple[str, int, int]]:
+        """
+            Returns:
+                Optional[Tuple[str, int, int]]: the shape (msg type, hop count, fee asset count) of a contract msg.
+                    It is None for the other msgs.
+        """
+        if not isinstance(msg, MsgExecuteContract) or not isinstance(msg.msg, dict) or len(msg.msg) != 1:
+            return None
+        msg_type = list(msg.msg.keys())[0]
+        body = msg.msg[msg_type] or {}
+        return (msg_type, len(body.get("hops", [])), len(body.get("fee_redeem", [])))
+
+    def build_key(self, msgs: List[Msg]) -> Optional[Tuple]:
+        shapes = [self.build_msg_shape(m) for m in msgs]
+        if len(shapes) == 0 or None in shapes:
+            return None
+        return tuple(sorted(shapes))  # type: ignore
+
+    def get_gas(self, msgs: List[Msg]) -> Optional[int]:
+        """
+            Returns:
+                Optional[int]: the gas limit of a tx with these msgs. It is None if the shape is unknown.
+        """
+        key = self.build_key(msgs)
+        with self._lock:
+            if key is None or key not in self._gas_used:
+                return None
+            return math.ceil(max(self._gas_used[key]) * self.margin)
+
+    def get_fee(self, msgs: List[Msg], gas_prices: Coins) -> Optional[Fee]:
+        """
+            Returns:
+                Optional[Fee]: the fee of a tx with these msgs, paid in fee_denom only like the fee estimated
+                    by the LCD with fee_denoms=[fee_denom]. It is None if the shape is unknown and the gas
+                    has to be simulated, or if there is no gas price for fee_denom.
+        """
+        gas = self.get_gas(msgs)
+        if gas is None:
+            return None
+        gas_price = Coins(gas_prices).filter(lambda c: c.denom == self.fee_denom)
+        if len(gas_price) == 0:
+            logger.warning("no gas price for fee_denom={} in gas_prices={}".format(
+                self.fee_denom, gas_prices))
+            return None
+        return Fee(gas, gas_price.mul(gas).to_int_ceil_coins())
+
+    def update(self, msgs: List[Msg], gas_used: int):
+        key = self.build_key(msgs)
+        if key is None:
+            return
+        with self._lock:
+            self._gas_used.setdefault(
+                key, deque(maxlen=self.window)).append(gas_used)
+
+    def invalidate(self, msgs: List[Msg]):
+        key = self.build_key(msgs)
+        with self._lock:
+            if key in self._gas_used:
+                logger.info("forget the gas used by shape={}".format(key))
+                del self._gas_used[key]
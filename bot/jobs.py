@@ -0,0 +1,90 @@
+from typing import Any, Dict, Optional
+from datetime import datetime
+from sqlalchemy import select
+from apscheduler.schedulers.base import BaseScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
+from bot.db.base import engine
+from bot.settings import JOBSTORE_TABLE, JOB_MISFIRE_GRACE_TIME
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# The purchase jobs are stored in the bot db (see build_jobstores), therefore they are pickled.
+# A job can only reference a module level function by its textual reference and it can't hold the
+# bot or the scheduler as arguments. The job functions below find them in this context instead.
+PURCHASE_JOB_FUNC = "bot.jobs:purchase_and_sync"
+PERSISTENT_JOBSTORE = "default"
+MEMORY_JOBSTORE = "memory"
+
+_context = {"bot": None, "scheduler": None, "executor": None}
+
+
+def set_context(bot: Any, scheduler: Optional[BaseScheduler]):
+    """
+        Parameters:
+            - bot (ExecOrder): the bot which executes the jobs.
+            - scheduler (BaseScheduler): the scheduler used to re-schedule the next purchase.
+    """
+    _context["bot"] = bot
+    _context["scheduler"] = scheduler
+
+
+def set_executor(executor: Any):
+    """
+        Parameters:
+            - executor (PurchaseExecutor or PurchaseBatcher): if set, the purchase jobs are submitted to it
+                instead of running on the scheduler thread.
+    """
+    _context["executor"] = executor
+
+
+def purchase_and_sync(order_id: str):
+    bot = _context["bot"]
+    assert bot is not None, "The job context is not set. Call bot.jobs.set_context first."
+    executor = _context["executor"]
+    if executor is not None:
+        executor.submit(order_id, _context["scheduler"])
+    else:
+        bot.purchase_and_sync(order_id, _context["scheduler"])
+
+
+def is_order_queued(order_id: str) -> bool:
+    """
+        Returns:
+            bool: True if the purchase of the order is queued or running in the executor of the job context.
+    """
+    executor = _context["executor"]
+    return executor is not None and executor.is_pending(order_id)
+
+
+def build_jobstores(worker_id: str = "") -> dict:
+    """ The purchase jobs survive a restart of the bot in the persistent job store. The recurring jobs
+        are added again on every start (see main.start), so they are kept in memory.
+
+        Parameters:
+            - worker_id (str): in sharded mode every worker stores the jobs of its partition in its own table,
+                otherwise every scheduler would run the jobs of the shared table.
+    """
+    tablename = JOBSTORE_TABLE if worker_id == "" else "{}_{}".format(
+        JOBSTORE_TABLE, worker_id)
+    return {PERSISTENT_JOBSTORE: SQLAlchemyJobStore(engine=engine, tablename=tablename),
+            MEMORY_JOBSTORE: MemoryJobStore()}
+
+
+def build_job_defaults() -> dict:
+    return {"misfire_grace_time": JOB_MISFIRE_GRACE_TIME, "coalesce": True}
+
+
+def get_job_next_run_times(jobstore: SQLAlchemyJobStore) -> Dict[str, Optional[datetime]]:
+    """ Read the id and the next run time of the stored jobs without unpickling them.
+
+        Returns:
+            dict: key = job id, value = next run time in utc (None if the job is paused)
+    """
+    jobstore.jobs_t.create(jobstore.engine, checkfirst=True)
+    stmt = select(jobstore.jobs_t.c.id, jobstore.jobs_t.c.next_run_time)
+    with jobstore.engine.connect() as conn:
+        return {row[0]: None if row[1] is None else datetime.utcfromtimestamp(row[1])
+                for row in conn.execute(stmt)}
@@ -1,12 +1,22 @@
 import os
+import argparse
 import logging
 from logging.handlers import RotatingFileHandler
 from apscheduler.schedulers.blocking import BlockingScheduler
 from bot.exec_order import ExecOrder
+from bot.jobs import build_jobstores, build_job_defaults, set_context, \
+    set_executor, PERSISTENT_JOBSTORE, MEMORY_JOBSTORE
+from bot.executor import PurchaseExecutor, PurchaseBatcher
 from bot.db_sync import initialize_db
-from bot.settings import LOG_PATH_FILE, SYNC_USER_FREQ, SYNC_CFG_FREQ, \
-    SCHEDULE_ORDER_FREQ, SYNC_TOKEN_PRICE_FREQ
+from bot.db.database import Database
+from bot.db.base import is_sqlite
+from bot.shard import ShardCoordinator
+from bot.settings import DB_URL, LOG_PATH_FILE, SYNC_USER_FREQ, SYNC_USER_EVENTS_FREQ, SYNC_CFG_FREQ, \
+    SCHEDULE_ORDER_FREQ, SYNC_TOKEN_PRICE_FREQ, SYNC_POOL_RESERVE_FREQ, PURCHASE_WORKERS, \
+    PURCHASE_BATCH_WINDOW, PURCHASE_BATCH_SIZE, TX_CONFIRM_FREQ, SHARD_HEARTBEAT_FREQ, SHARD_WORKER_TTL, \
+    SHARD_VNODES
 from pathlib import Path
+from typing import Optional
 
 
 def init_log(logging_level):
@@ -33,35 +43,89 @@ def init_log(logging_level):
 logger = init_log(logging.INFO)
 
 
-def start():
+def build_shard(worker_id: str) -> Optional[ShardCoordinator]:
     """
-        When the bot start it will reschedule all the orders in the DB, regardless
-        of whether they have been already schedule in the past or not.
+        Returns:
+            Optional[ShardCoordinator]: the coordinator of the sharded mode. None if worker_id is not set.
     """
-    logger.info("*************** BOT START ****************************")
-    bot = ExecOrder()
+    if worker_id == "":
+        return None
+    # the workers share the db: the sharded mode is only tested with postgresql (see make test-unit-pg)
+    assert not is_sqlite(DB_URL), "The sharded mode requires a postgresql DB_URL. Got DB_URL={}".format(
+        DB_URL)
+    return ShardCoordinator(Database(), worker_id, SHARD_WORKER_TTL, SHARD_VNODES)
+
 
-    scheduler = BlockingScheduler(timezone='utc')
-    oders = bot.db.get_dca_orders()
-    bot.schedule_next_run(oders, scheduler)
+def start(shard: Optional[ShardCoordinator] = None, wallet_index: int = 0):
+    """
+        The purchase jobs are persisted in the bot db. When the bot start it will only reschedule
+        the orders whose job is missing or has drifted (see ExecOrder.reconcile_jobs).
 
-    # schedule recurrening job
+        Parameters:
+            - shard (ShardCoordinator): if set, the bot runs in sharded mode and only handles the users of its
+                partition (see bot/shard.py). It has joined the ring in initialize_db.
+            - wallet_index (int): the index of the wallet derived from the bot mnemonic.
+    """
+    logger.info("*************** BOT START ****************************")
+    worker_id = ""
+    if shard is not None:
+        worker_id = shard.worker_id
+        logger.info("sharded mode: worker_id={}, wallet_index={}".format(
+            worker_id, wallet_index))
+        shard.heartbeat()
+    bot = ExecOrder(shard, wallet_index)
+
+    jobstores = build_jobstores(worker_id)
+    scheduler = BlockingScheduler(timezone='utc', jobstores=jobstores,
+                                  job_defaults=build_job_defaults())
+    set_context(bot, scheduler)
+    if PURCHASE_BATCH_WINDOW > 0:
+        executor = PurchaseBatcher(
+            bot, PURCHASE_BATCH_WINDOW, PURCHASE_BATCH_SIZE)
+    else:
+        executor = PurchaseExecutor(bot, PURCHASE_WORKERS)
+    set_executor(executor)
+    bot.reconcile_jobs(scheduler, jobstores[PERSISTENT_JOBSTORE])
+
+    # schedule recurrening job (they are added again on every start)
     scheduler.add_job(bot.sync_users_data, 'interval', id="sync_users_data",
-                      minutes=SYNC_USER_FREQ)
+                      minutes=SYNC_USER_FREQ, jobstore=MEMORY_JOBSTORE)
+    scheduler.add_job(bot.sync_users_events, 'interval', id="sync_users_events",
+                      minutes=SYNC_USER_EVENTS_FREQ, jobstore=MEMORY_JOBSTORE)
     scheduler.add_job(bot.sync_dca_cfg, 'interval', id="sync_dca_cfg",
-                      minutes=SYNC_CFG_FREQ)
+                      minutes=SYNC_CFG_FREQ, jobstore=MEMORY_JOBSTORE)
     scheduler.add_job(bot.schedule_orders, 'interval',
-                      minutes=SCHEDULE_ORDER_FREQ, id="schedule_orders",  args=[scheduler])
+                      minutes=SCHEDULE_ORDER_FREQ, id="schedule_orders",  args=[scheduler],
+                      jobstore=MEMORY_JOBSTORE)
     scheduler.add_job(bot.sync_token_price, 'interval',
-                      minutes=SYNC_TOKEN_PRICE_FREQ, id="sync_token_price")
+                      minutes=SYNC_TOKEN_PRICE_FREQ, id="sync_token_price", jobstore=MEMORY_JOBSTORE)
+    scheduler.add_job(bot.sync_pool_reserve, 'interval',
+                      minutes=SYNC_POOL_RESERVE_FREQ, id="sync_pool_reserve", jobstore=MEMORY_JOBSTORE)
+    if shard is not None:
+        scheduler.add_job(bot.heartbeat, 'interval', seconds=SHARD_HEARTBEAT_FREQ, id="heartbeat",
+                          args=[scheduler, jobstores[PERSISTENT_JOBSTORE]], jobstore=MEMORY_JOBSTORE)
+    if bot.dca.is_sync_broadcast():
+        scheduler.add_job(bot.confirm_pending_txs, 'interval',
+                          seconds=TX_CONFIRM_FREQ, id="confirm_pending_txs", args=[scheduler],
+                          jobstore=MEMORY_JOBSTORE)
 
     try:
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         scheduler.shutdown()
+        executor.shutdown()
+        if shard is not None:
+            shard.leave()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="dca bot")
+    parser.add_argument("--worker-id", default="",
+                        help="run in sharded mode with this worker id")
+    parser.add_argument("--wallet-index", type=int, default=0,
+                        help="index of the bot wallet derived from the mnemonic")
+    args = parser.parse_args()
+
     # logging.getLogger('sqlalchemy.engine.Engine').setLevel(logging.DEBUG)
     # logging.getLogger('bot.db.database').setLevel(logging.DEBUG)
     # logging.getLogger('apscheduler').setLevel(logging.DEBUG)
@@ -69,7 +133,9 @@ if __name__ == "__main__":
     # load initial dca users data into the database,
     # sync configuration and
     # fill price table
-    initialize_db(reset_db=False)
+    # in sharded mode, the worker joins the ring first so that only the leader bootstraps the db
+    shard = build_shard(args.worker_id)
+    initialize_db(reset_db=False, shard=shard)
 
     # Once the bot start to process the initial user orders, we can still include new users
     # by adding them to the database directly via sql or in this way:
@@ -77,4 +143,4 @@ if __name__ == "__main__":
     # s = Sync()
     # s.insert_user_into_db(new_user_address)
     # """"
-    start()
+    start(shard, args.wallet_index)
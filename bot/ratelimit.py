@@ -0,0 +1,84 @@
+from typing import Any, Awaitable, Callable, Optional
+from terra_sdk.exceptions import LCDResponseError
+import asyncio
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """ Limit the rate of the queries sent to the LCD.
+
+        The bucket holds at most capacity tokens and it is refilled with rate tokens per second.
+        Every query takes a token, so bursts of capacity queries are allowed but on average the LCD
+        receives at most rate queries per second. A single bucket can be shared by the event loops
+        of several threads.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+            Parameters:
+                - rate (float): the number of tokens added per second.
+                - capacity (float): the maximum number of tokens, by default rate.
+        """
+        assert rate > 0, "Expected rate > 0. Got rate={}".format(rate)
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """
+            Returns:
+                float: 0 if a token has been taken, otherwise the number of seconds to wait for the next token.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire()
+
+    def __repr__(self) -> str:
+        return "TokenBucket(rate={}, capacity={})".format(self.rate, self.capacity)
+
+
+def is_retryable(e: Exception) -> bool:
+    """ The LCD is overloaded (429), unavailable (5xx) or too slow.
+    """
+    if isinstance(e, LCDResponseError):
+        return e.response.status == 429 or e.response.status >= 500
+    return isinstance(e, asyncio.TimeoutError)
+
+
+async def retry_async(func: Callable[[], Awaitable[Any]], retries: int, backoff: float,
+                      rate_limiter: Optional[TokenBucket] = None) -> Any:
+    """ Call func till it succeeds. A retryable error (see is_retryable) is retried at most retries times,
+        waiting backoff * 2^attempt seconds in between. Every call takes a token from rate_limiter.
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            return await func()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff * 2 ** attempt
+            logger.info("retry in {}s: {}".format(delay, repr(e)))
+            await asyncio.sleep(delay)
+            attempt += 1
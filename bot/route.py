@@ -0,0 +1,186 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from bot.db.table.whitelisted_hop import WhitelistedHop
+from bot.type import AssetInfo, AstroSwap
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class RouteEngine:
+    """ In-memory graph of the whitelisted hops.
+
+        Every whitelisted hop (offer_denom, ask_denom) is an edge which can be traversed in both
+        directions. The forward direction is encoded as '<id>', the backward direction as '<inverse-id>'.
+        This is the same hops string format used by the view whitelisted_hops_all, so the output of
+        this class can be passed directly to CompiledRoute.compile.
+
+        The graph is meant to be rebuilt every time the whitelisted hops change (see Sync.sync_dca_cfg).
+        Routes are enumerated with a bounded depth first search and memoized per
+        (start_denom, target_denom, max_hops), so repeated lookups are a dictionary access.
+    """
+
+    def __init__(self, whitelisted_hops: List[WhitelistedHop]):
+        # key = denom, value = list of (hop string, next denom)
+        self.graph: Dict[str, List[Tuple[str, str]]] = {}
+        self._routes: Dict[Tuple[str, str, int], List[str]] = {}
+
+        for h in sorted(whitelisted_hops, key=lambda h: h.id.real):
+            offer_denom = str(h.offer_denom)
+            ask_denom = str(h.ask_denom)
+            self.graph.setdefault(offer_denom, []).append(
+                ("<{}>".format(h.id), ask_denom))
+            self.graph.setdefault(ask_denom, []).append(
+                ("<inverse-{}>".format(h.id), offer_denom))
+
+        logger.debug("route graph={}".format(self.graph))
+
+    def get_routes(self, start_denom: str, target_denom: str, max_hops: int) -> List[str]:
+        """
+            Parameters:
+                - start_denom (str): the denomination of the start asset
+                - target_denom (str): the denomination of the target asset
+                - max_hops (int): the maximum number of hops (swap operations) of a route
+
+            Returns:
+                List[str]: all the simple routes between start_denom and target_denom sorted by hops length.
+                    A denomination is never visited twice within the same route.
+                    example: ['<3>', '<1><2>']
+        """
+        key = (start_denom, target_denom, max_hops)
+        if key not in self._routes:
+            self._routes[key] = self._find_routes(
+                start_denom, target_denom, max_hops)
+        return self._routes[key]
+
+    def get_all_routes(self, start_denom: str, max_hops: int) -> Dict[str, List[str]]:
+        """
+            Parameters:
+                - start_denom (str): the denomination of the start asset
+                - max_hops (int): the maximum number of hops (swap operations) of a route
+
+            Returns:
+                dict: key = target denomination, value = all the simple routes from start_denom
+                    to the target denomination sorted by hops length.
+                    example: {'denom2': ['<1>'],
+                              'denom3': ['<3>', '<1><2>']}
+        """
+        return self._find_routes(start_denom, None, max_hops)
+
+    def get_neighborhood(self, denoms: Iterable[str], max_hops: int) -> Set[str]:
+        """ Returns all the denominations which are at most max_hops hops away from the given denoms,
+            including the given denoms themselves. A route of at most max_hops hops which goes through
+            one of the given denoms can only start from one of these denominations.
+        """
+        neighborhood = set(denoms)
+        frontier = list(neighborhood)
+        for _ in range(max_hops):
+            next_frontier = []
+            for denom in frontier:
+                for _, next_denom in self.graph.get(denom, []):
+                    if next_denom not in neighborhood:
+                        neighborhood.add(next_denom)
+                        next_frontier.append(next_denom)
+            frontier = next_frontier
+        return neighborhood
+
+    def _find_routes(self, start_denom: str, target_denom: Optional[str], max_hops: int) -> Any:
+        """ Bounded depth first search. If target_denom is None, the routes to every reachable
+            denomination are returned as a dict, otherwise the list of routes to target_denom.
+        """
+        routes: Dict[str, List[List[str]]] = {}
+
+        def _dfs(denom: str, path: List[str], visited: set):
+            for hop, next_denom in self.graph.get(denom, []):
+                if next_denom in visited:
+                    continue
+                if target_denom is None or next_denom == target_denom:
+                    routes.setdefault(next_denom, []).append(path + [hop])
+                    if target_denom is not None:
+                        continue
+                if len(path) + 1 < max_hops:
+                    visited.add(next_denom)
+                    _dfs(next_denom, path + [hop], visited)
+                    visited.remove(next_denom)
+
+        if start_denom != target_denom:
+            _dfs(start_denom, [], {start_denom})
+
+        output: Dict[str, List[str]] = {}
+        for denom, list_routes in routes.items():
+            # sorted is stable: routes with the same length keep the traversal order
+            list_routes.sort(key=len)
+            output[denom] = ["".join(r) for r in list_routes]
+
+        if target_denom is None:
+            return output
+        return output.get(target_denom, [])
+
+
+class CompiledRoute:
+    """ Compact representation of a hops string resolved against a config snapshot.
+
+        A route is a tuple of (hop_id, inverse) steps, example: '<1><inverse-2>' -> ((1, False), (2, True)).
+        The AstroSwap operations and their serialized payload are computed once, so turning a route
+        into a contract message is a lookup instead of a parse. Compiled routes are cached per
+        config version (see ConfigSnapshot.compile_route) and must not be modified.
+    """
+    __slots__ = ("hops", "steps", "operations", "_payload")
+
+    def __init__(self, hops: str, steps: Tuple[Tuple[int, bool], ...], operations: List[AstroSwap]):
+        self.hops = hops
+        self.steps = steps
+        self.operations = operations
+        self._payload: Optional[List[dict]] = None
+
+    @staticmethod
+    def parse_steps(hops: str) -> Tuple[Tuple[int, bool], ...]:
+        """ example: '<1><inverse-2>' -> ((1, False), (2, True))
+        """
+        steps = []
+        for h in hops[1:-1].split("><"):
+            inverse = h.startswith("inverse-")
+            steps.append((int(h[8:] if inverse else h), inverse))
+        return tuple(steps)
+
+    @classmethod
+    def compile(cls, hops: str, asset_info_map: Dict[str, AssetInfo],
+                hop_map: Dict[int, WhitelistedHop]) -> "CompiledRoute":
+        """
+            Parameters:
+                - hops (str): the hops string, example: '<1><inverse-2>'
+                - asset_info_map (dict): key = asset's denomination, value = AssetInfo
+                - hop_map (dict): key = whitelisted hop id, value = WhitelistedHop
+        """
+        steps = cls.parse_steps(hops)
+        operations = []
+        for hop_id, inverse in steps:
+            assert hop_id in hop_map, "Missing hop_id={} in the whitelisted_hop={}".format(
+                hop_id, list(hop_map.values()))
+            offer_denom = str(hop_map[hop_id].offer_denom)
+            ask_denom = str(hop_map[hop_id].ask_denom)
+            assert offer_denom in asset_info_map, "Missing offer_denom={} in the whithelisted_tokens={}".format(
+                offer_denom, list(asset_info_map.keys()))
+            assert ask_denom in asset_info_map, "Missing ask_denom={} in the whithelisted_tokens={}".format(
+                ask_denom, list(asset_info_map.keys()))
+            if inverse:
+                offer_denom, ask_denom = ask_denom, offer_denom
+            operations.append(
+                AstroSwap(asset_info_map[offer_denom], asset_info_map[ask_denom]))
+        return cls(hops, steps, operations)
+
+    def get_hop_ids(self) -> List[int]:
+        return [hop_id for hop_id, _ in self.steps]
+
+    def to_dict(self) -> List[dict]:
+        """ The serialized swap operations, example: [{'astro_swap': {...}}]. The result is memoized.
+        """
+        if self._payload is None:
+            self._payload = [op.to_dict() for op in self.operations]
+        return self._payload
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __repr__(self) -> str:
+        return "CompiledRoute(hops={}, steps={})".format(self.hops, self.steps)
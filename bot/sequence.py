@@ -0,0 +1,154 @@
+from typing import List, Optional, Union
+from terra_sdk.client.lcd import LCDClient, Wallet
+from terra_sdk.client.lcd.api.tx import CreateTxOptions
+from terra_sdk.core.broadcast import BlockTxBroadcastResult, SyncTxBroadcastResult
+from terra_sdk.core.msg import Msg
+from bot.gas import GasModel, OUT_OF_GAS_CODE
+from bot.util import broadcast_transaction, broadcast_transaction_sync
+import threading
+import re
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# error code of the cosmos sdk (codespace 'sdk') for a wrong account sequence
+SEQUENCE_MISMATCH_CODE = 32
+SEQUENCE_MISMATCH_REGEX = re.compile(
+    r"account sequence mismatch, expected (\d+)")
+
+BROADCAST_MODE_BLOCK = "block"
+BROADCAST_MODE_SYNC = "sync"
+BroadcastResult = Union[BlockTxBroadcastResult, SyncTxBroadcastResult]
+
+
+class SequenceManager:
+    """ Cache the account number and the sequence of the bot wallet.
+
+        Without it every tx queries the LCD for the account info before signing. The sequence is
+        increased locally after each tx included in a block and it is synced again with the LCD
+        on a sequence mismatch. The txs are signed and broadcast one at a time, so it is safe to
+        share a SequenceManager between threads.
+
+        If a gas model is given, the fee of a tx with a known shape is set from the model instead
+        of being simulated by the LCD.
+
+        In sync broadcast mode the txs are only checked by the mempool. The sequence is increased
+        for every tx accepted in the mempool and the result of the tx has to be confirmed later.
+    """
+
+    def __init__(self, gas_model: Optional[GasModel] = None, broadcast_mode: str = BROADCAST_MODE_BLOCK):
+        assert broadcast_mode in [BROADCAST_MODE_BLOCK, BROADCAST_MODE_SYNC], \
+            "Expected broadcast_mode in ['{}', '{}']. Got broadcast_mode={}".format(
+                BROADCAST_MODE_BLOCK, BROADCAST_MODE_SYNC, broadcast_mode)
+        self.account_number: Optional[int] = None
+        self.sequence: Optional[int] = None
+        self.gas_model = gas_model
+        self.broadcast_mode = broadcast_mode
+        self._lock = threading.RLock()
+
+    def sync(self, wallet: Wallet):
+        """ Query the account number and the sequence of the wallet.
+        """
+        with self._lock:
+            info = wallet.account_number_and_sequence()
+            self.account_number = int(info["account_number"])
+            self.sequence = int(info["sequence"])
+            logger.info("sync account_number={}, sequence={}".format(
+                self.account_number, self.sequence))
+
+    def reset(self):
+        """ The next tx will sync the account info again.
+        """
+        with self._lock:
+            self.sequence = None
+
+    def perform_transactions(self, terra: LCDClient, wallet: Wallet, msgs: List[Msg]) -> BroadcastResult:
+        """ Sign the msgs with the cached account info and broadcast them in a single tx.
+            On a sequence mismatch the account info is synced and the tx is sent once again.
+            If a tx with a modelled fee runs out of gas, it is sent once again with a simulated fee.
+        """
+        with self._lock:
+            result = self._perform_transactions_with_sequence(
+                terra, wallet, msgs)
+            if self.gas_model is None or self.broadcast_mode != BROADCAST_MODE_BLOCK:
+                # in sync mode the gas used is only known once the tx is confirmed
+                return result
+            if self._is_out_of_gas(result) and result.gas_wanted is not None:
+                if self.gas_model.get_gas(msgs) == int(result.gas_wanted):
+                    logger.info("out of gas with the modelled fee, simulate the tx: {}".format(
+                        result.raw_log))
+                    self.gas_model.invalidate(msgs)
+                    result = self._perform_transactions_with_sequence(
+                        terra, wallet, msgs)
+            if result.height > 0 and not self._is_out_of_gas(result) and result.gas_used is not None:
+                self.gas_model.update(msgs, int(result.gas_used))
+            return result
+
+    def _perform_transactions_with_sequence(self, terra: LCDClient, wallet: Wallet, msgs: List[Msg]) -> BroadcastResult:
+        try:
+            result = self._perform_transactions(terra, wallet, msgs)
+        except Exception as e:
+            if not self._on_sequence_mismatch(wallet, str(e)):
+                raise
+            result = self._perform_transactions(terra, wallet, msgs)
+        else:
+            if result.code == SEQUENCE_MISMATCH_CODE and self._on_sequence_mismatch(wallet, str(result.raw_log)):
+                result = self._perform_transactions(terra, wallet, msgs)
+        return result
+
+    def _perform_transactions(self, terra: LCDClient, wallet: Wallet, msgs: List[Msg]) -> BroadcastResult:
+        if self.sequence is None or self.account_number is None:
+            self.sync(wallet)
+
+        # without a fee the gas is simulated by the LCD
+        fee = None if self.gas_model is None else self.gas_model.get_fee(
+            msgs, terra.gas_prices)
+        # the simulated fee is paid in the same denom as the fee of the gas model
+        fee_denoms = None if self.gas_model is None else [
+            self.gas_model.fee_denom]
+        signed_tx = wallet.create_and_sign_tx(CreateTxOptions(
+            msgs=msgs, account_number=self.account_number, sequence=self.sequence, fee=fee,
+            fee_denoms=fee_denoms))
+        try:
+            if self.broadcast_mode == BROADCAST_MODE_SYNC:
+                result = broadcast_transaction_sync(terra, signed_tx)
+            else:
+                result = broadcast_transaction(terra, signed_tx)
+        except:
+            # it is unknown whether the tx has been included in a block
+            self.reset()
+            raise
+
+        if self._is_sequence_used(result):
+            # the sequence increases for every tx included in a block, even a failed one
+            self.sequence += 1  # type: ignore
+        elif result.code != SEQUENCE_MISMATCH_CODE:
+            self.reset()
+        logger.debug("perform_transactions output: {}".format(result))
+        return result
+
+    def _is_sequence_used(self, result: BroadcastResult) -> bool:
+        if self.broadcast_mode == BROADCAST_MODE_SYNC:
+            # the tx is in the mempool
+            return result.code in [None, 0]
+        return result.height > 0  # type: ignore
+
+    @staticmethod
+    def _is_out_of_gas(result: BlockTxBroadcastResult) -> bool:
+        return result.code == OUT_OF_GAS_CODE and result.codespace == "sdk"
+
+    def _on_sequence_mismatch(self, wallet: Wallet, err_msg: str) -> bool:
+        """
+            Returns:
+                bool: True if err_msg is a sequence mismatch error. In this case the account info is synced.
+        """
+        m = SEQUENCE_MISMATCH_REGEX.search(err_msg)
+        if m is None:
+            return False
+        logger.info("account sequence mismatch: {}".format(err_msg))
+        if self.account_number is None:
+            self.sync(wallet)
+        else:
+            self.sequence = int(m.group(1))
+        return True
@@ -1,5 +1,12 @@
 
 DB_URL = ""
+# DB_PRAGMAS are the sqlite pragmas set on every new db connection (foreign_keys is always on).
+# DB_POOL_CLASS is the pool of db connections: "queue" keeps up to DB_POOL_SIZE open connections,
+# "null" opens a connection per session and "" lets sqlalchemy choose (required for an in memory db).
+# See bot/settings/prod.py for the production profile.
+DB_PRAGMAS = {}
+DB_POOL_CLASS = ""
+DB_POOL_SIZE = 5
 
 DCA_CONTRACT_ADDR = ""
 
@@ -10,6 +17,17 @@ DCA_CONTRACT_ADDR = ""
 # - dca_orders
 SYNC_USER_FREQ = 12 * 60
 
+# SYNC_USER_EVENTS_FREQ is responsible for syncing every x minutes only the users touched by a tx of the dca contract
+# since the last processed block height (see sync_checkpoint table).
+SYNC_USER_EVENTS_FREQ = 1
+# At most SYNC_USER_EVENTS_MAX_PAGES pages of 100 txs are processed per run. A larger backlog is processed
+# over several runs.
+SYNC_USER_EVENTS_MAX_PAGES = 10
+# The users are synced by batch of SYNC_USER_BATCH_SIZE users, with at most SYNC_USER_WORKERS queries at the same time.
+# The data of a batch are saved within a single db transaction.
+SYNC_USER_WORKERS = 8
+SYNC_USER_BATCH_SIZE = 100
+
 # SYNC_CFG_FREQ is responsible for refreshing following tables every x minutes:
 # - whitelisted_fee_asset
 # - whitelisted_hop
@@ -25,8 +43,93 @@ SCHEDULE_ORDER_FREQ = 4 * 60
 # SYNC_TOKEN_PRICE_FREQ is responsible for refreshing the token price data from coingecko every x minutes
 SYNC_TOKEN_PRICE_FREQ = 2
 
+# SYNC_POOL_RESERVE_FREQ is responsible for refreshing every x minutes the pool_reserve table of the pairs
+# used by the orders scheduled to run in the next POOL_RESERVE_HORIZON minutes.
+SYNC_POOL_RESERVE_FREQ = 1
+POOL_RESERVE_HORIZON = 5
+# POOL_RESERVE_TTL is the time in seconds after which the reserves of a pair are considered stale.
+# Only stale reserves are queried again.
+POOL_RESERVE_TTL = 60
+# The best hop chosen with the off-chain pool simulator is confirmed on chain. If the on-chain amount differs by more
+# than OFF_CHAIN_SIMULATION_TOLERANCE (relative) from the off-chain one, all the hops are simulated on chain.
+OFF_CHAIN_SIMULATION_TOLERANCE = 0.01
+
+# The concurrent queries are limited to LCD_RATE_LIMIT queries per second toward the LCD. A query which fails because
+# the LCD is overloaded (429) or unavailable (5xx) is retried at most LCD_MAX_RETRIES times with an exponential backoff
+# starting from LCD_RETRY_BACKOFF seconds. LCD_QUERY_TIMEOUT is the timeout in seconds of a single query.
+LCD_RATE_LIMIT = 10
+LCD_MAX_RETRIES = 3
+LCD_RETRY_BACKOFF = 0.5
+LCD_QUERY_TIMEOUT = 10
+
 LOG_PATH_FILE = "./logs/bot.log"
 
+# The purchase jobs are persisted in the JOBSTORE_TABLE table of the bot db, so a restart of the bot
+# only reschedules the orders whose job has drifted (see ExecOrder.reconcile_jobs).
+JOBSTORE_TABLE = "apscheduler_jobs"
+# JOB_MISFIRE_GRACE_TIME is the number of seconds a job is still allowed to run after its scheduled time.
+JOB_MISFIRE_GRACE_TIME = 60
+# PURCHASE_WORKERS is the maximum number of purchases executed at the same time.
+# The txs are still signed and broadcast one at a time.
+PURCHASE_WORKERS = 4
+# If PURCHASE_BATCH_WINDOW > 0, the orders due within PURCHASE_BATCH_WINDOW seconds are executed with a single tx
+# of at most PURCHASE_BATCH_SIZE perform_dca_purchase msgs. If the tx fails, the batch is bisected to isolate the
+# failing orders.
+PURCHASE_BATCH_WINDOW = 0
+PURCHASE_BATCH_SIZE = 10
+
+# SIMULATION_MAX_CONCURRENCY is the maximum number of simulate_swap_operations queries
+# sent to the LCD at the same time when the bot is choosing the best execution hop.
+SIMULATION_MAX_CONCURRENCY = 4
+# SIMULATION_TIMEOUT is the timeout in seconds of a single simulate_swap_operations query.
+SIMULATION_TIMEOUT = 10
+# The results of simulate_swap_operations are cached in memory for SIMULATION_CACHE_TTL seconds
+# (SIMULATION_CACHE_SIZE entries at most). A cached quote is reused for an offer amount which differs
+# at most by SIMULATION_CACHE_TOLERANCE (relative) from the cached one. Set the TTL to 0 to disable the cache.
+SIMULATION_CACHE_SIZE = 1000
+SIMULATION_CACHE_TTL = 6
+SIMULATION_CACHE_TOLERANCE = 0.001
+
+# The gas of the txs is learnt from the gas used by the last GAS_MODEL_WINDOW txs with the same msg shapes
+# (msg type, hop count, fee asset count). The gas limit is the max gas used times GAS_MODEL_MARGIN and the
+# gas simulation is skipped. Set the window to 0 to always simulate the gas.
+GAS_MODEL_MARGIN = 1.15
+GAS_MODEL_WINDOW = 20
+# The fees of the txs are paid in FEE_DENOM only, even if GAS_PRICE has a price for several denoms.
+FEE_DENOM = "uluna"
+
+# BROADCAST_MODE is either "block" or "sync". In block mode a purchase waits until its tx is included in a block.
+# In sync mode the purchase returns as soon as the tx is accepted in the mempool and its hash is stored in the
+# pending_tx table. Every TX_CONFIRM_FREQ seconds up to TX_CONFIRM_BATCH_SIZE pending txs are confirmed and the
+# success of their purchases is updated. A tx which is not found, or whose query keeps failing, after
+# TX_CONFIRM_TIMEOUT seconds is a failed purchase.
+BROADCAST_MODE = "block"
+TX_CONFIRM_FREQ = 5
+TX_CONFIRM_BATCH_SIZE = 50
+TX_CONFIRM_TIMEOUT = 120
+# The pending txs are queried with at most TX_QUERY_MAX_CONCURRENCY queries at the same time,
+# TX_QUERY_TIMEOUT is the timeout in seconds of a single tx query.
+TX_QUERY_MAX_CONCURRENCY = 4
+TX_QUERY_TIMEOUT = 10
+
+# Sharded mode (python bot/main.py --worker-id <id> --wallet-index <i>): several bot processes share the db and
+# every worker syncs and schedules the users of its partition of a consistent hash ring (SHARD_VNODES points per
+# worker). A worker refreshes its heartbeat every SHARD_HEARTBEAT_FREQ seconds and it leaves the ring when its
+# heartbeat is older than SHARD_WORKER_TTL seconds. The partitions are rebalanced when a worker joins or leaves.
+SHARD_HEARTBEAT_FREQ = 10
+SHARD_WORKER_TTL = 30
+SHARD_VNODES = 100
+# In sharded mode an order is only scheduled and purchased by the worker holding its lease. The lease is held till
+# the next run time of the order plus ORDER_LEASE_TTL seconds, or ORDER_LEASE_TTL seconds during a purchase, so an
+# order is never purchased twice within one interval. The lease of a worker which stops heartbeating is free after
+# SHARD_WORKER_TTL seconds. The singleton jobs (sync_dca_cfg, sync_token_price) only run on the leader worker.
+ORDER_LEASE_TTL = 120
+
+# POOL_COMMISSION_RATES and STABLE_POOL_AMP are used to simulate the swap operations off-chain
+# (see bot/simulator.py). They should match the astroport factory pair configs.
+POOL_COMMISSION_RATES = {"xyk": 0.003, "stable": 0.0005}
+STABLE_POOL_AMP = 10
+
 
 # list of ids: https://api.coingecko.com/api/v3/coins/list
 # map the blockchain token address/denomination to the coingecko token id
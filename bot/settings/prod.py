@@ -1,4 +1,20 @@
 DB_URL = 'sqlite:///bot/db/dca.db'
+# The purchase workers, the sync jobs and the price job write to the db at the same time.
+# In WAL mode the readers don't block the writer and a writer waits up to busy_timeout ms
+# for the lock instead of failing with 'database is locked'. synchronous=NORMAL is safe in WAL mode,
+# only the last transactions may be lost on a power failure. mmap_size and cache_size (negative = KiB)
+# keep the hot pages in memory.
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 10000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+# one connection per purchase worker and job thread
+DB_POOL_CLASS = "queue"
+DB_POOL_SIZE = 8
 
 
 DCA_CONTRACT_ADDR = ""
@@ -0,0 +1,152 @@
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from bot.db.database import Database
+import bisect
+import hashlib
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# the lease held by the worker which runs the singleton jobs
+LEADER_LEASE = "leader"
+
+
+class HashRing:
+    """ Consistent hash ring of the workers. Every worker is placed vnodes times on the ring and a key
+        belongs to the first worker found clockwise from the hash of the key. When a worker joins or leaves
+        the ring, only the keys of its arcs move (about 1/N of the keys for N workers).
+    """
+
+    def __init__(self, workers: List[str], vnodes: int):
+        """
+            Parameters:
+                - workers (List[str]): the ids of the workers.
+                - vnodes (int): the number of points of a worker on the ring. More points balance the
+                    keys better between the workers.
+        """
+        assert vnodes > 0, "Expected vnodes > 0. Got vnodes={}".format(vnodes)
+        self.workers = sorted(set(workers))
+        points = sorted((self.hash("{}#{}".format(w, i)), w)
+                        for w in self.workers for i in range(vnodes))
+        self._hashes = [p[0] for p in points]
+        self._workers = [p[1] for p in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def get_worker(self, key: str) -> Optional[str]:
+        """
+            Returns:
+                Optional[str]: the worker owning key. None if the ring is empty.
+        """
+        if len(self._hashes) == 0:
+            return None
+        i = bisect.bisect(self._hashes, self.hash(key)) % len(self._hashes)
+        return self._workers[i]
+
+
+class ShardCoordinator:
+    """ Partition the users between the bot processes of the sharded mode. Every worker refreshes its heartbeat
+        in the shard_worker table and builds the same hash ring from the live workers, so the users
+        (user.id) are split between the workers without a central process. A worker which stops heartbeating
+        for worker_ttl seconds leaves the ring and its users are taken over by the other workers.
+
+        The partitions only change on a heartbeat, so two workers may briefly consider the same user as theirs.
+        An order is therefore scheduled and purchased only by the worker holding its lease (see claim), and the
+        singleton jobs only run on the worker holding the leader lease.
+    """
+
+    def __init__(self, db: Database, worker_id: str, worker_ttl: int, vnodes: int):
+        """
+            Parameters:
+                - db (Database): the db shared by the workers.
+                - worker_id (str): the unique id of this worker, example: worker-1
+                - worker_ttl (int): a worker is alive if its last heartbeat is at most worker_ttl seconds old.
+                - vnodes (int): the number of points of a worker on the ring (see HashRing).
+        """
+        assert worker_id != "", "Expected a worker_id"
+        self.db = db
+        self.worker_id = worker_id
+        self.worker_ttl = worker_ttl
+        self.vnodes = vnodes
+        self.ring = HashRing([worker_id], vnodes)
+        self.previous_ring: Optional[HashRing] = None
+        self.is_leader = False
+        self._lock = threading.Lock()
+
+    def heartbeat(self) -> bool:
+        """ Refresh the heartbeat of the worker, renew or claim the leader lease and rebuild
+            the ring from the live workers.
+
+            Returns:
+                bool: True if the workers of the ring have changed since the last heartbeat.
+        """
+        self.db.heartbeat_worker(self.worker_id)
+        is_leader = self.claim(LEADER_LEASE, datetime.utcnow() +
+                               timedelta(seconds=self.worker_ttl))
+        if is_leader != self.is_leader:
+            logger.info("worker={}: is_leader={}".format(
+                self.worker_id, is_leader))
+        self.is_leader = is_leader
+        workers = set(self.db.get_live_workers(self.worker_ttl))
+        # the worker owns its partition even if its heartbeat could not be saved
+        workers.add(self.worker_id)
+        with self._lock:
+            if workers == set(self.ring.workers):
+                return False
+            logger.info("shard workers changed: {} -> {}".format(
+                self.ring.workers, sorted(workers)))
+            self.previous_ring = self.ring
+            self.ring = HashRing(list(workers), self.vnodes)
+            return True
+
+    def leave(self):
+        """ Remove the worker from the ring and release its leases. The other workers take over its users
+            on their next heartbeat.
+        """
+        logger.info("worker={} leaves the ring".format(self.worker_id))
+        self.release([str(l.name)
+                     for l in self.db.get_leases(self.worker_id)])
+        self.is_leader = False
+        self.db.remove_worker(self.worker_id)
+
+    def claim(self, name: str, expire_at: datetime) -> bool:
+        """ Claim or renew the lease name till expire_at (see Database.claim_lease). The lease of a
+            worker which stops heartbeating can be claimed by another worker after worker_ttl seconds.
+
+            Returns:
+                bool: True if the worker holds the lease.
+        """
+        return self.db.claim_lease(name, self.worker_id, expire_at, self.worker_ttl) is True
+
+    def release(self, names: List[str]):
+        if len(names) > 0:
+            self.db.release_leases(names, self.worker_id)
+
+    def owns(self, user_address: str) -> bool:
+        with self._lock:
+            return self.ring.get_worker(user_address) == self.worker_id
+
+    def get_acquired_users(self, user_addresses: List[str]) -> List[str]:
+        """
+            Returns:
+                List[str]: the users owned by the worker since the last change of the ring.
+        """
+        with self._lock:
+            if self.previous_ring is None:
+                return []
+            return [u for u in user_addresses if self.ring.get_worker(u) == self.worker_id
+                    and self.previous_ring.get_worker(u) != self.worker_id]
+
+    def get_partition_sizes(self, user_addresses: List[str]) -> Dict[str, int]:
+        """
+            Returns:
+                dict: key = worker id, value = number of users owned by the worker.
+        """
+        sizes = {w: 0 for w in self.ring.workers}
+        for u in user_addresses:
+            sizes[self.ring.get_worker(u)] += 1  # type: ignore
+        return sizes
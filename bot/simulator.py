@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional
+from bot.type import AstroSwap
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+XYK = "xyk"
+STABLE = "stable"
+
+# number of coins in an astroport pool
+N_COINS = 2
+# maximum number of iterations of the newton method used by the stableswap invariant
+ITERATIONS = 32
+
+
+def xyk_swap(offer_pool: int, ask_pool: int, offer_amount: int, commission_rate: float) -> int:
+    """ Constant product (x * y = k) swap as computed by the astroport xyk pair contract.
+
+        Parameters:
+            - offer_pool (int): the reserve of the offer asset in the pool
+            - ask_pool (int): the reserve of the ask asset in the pool
+            - offer_amount (int): the amount of the offer asset to swap
+            - commission_rate (float): the commission of the pool, example: 0.003
+
+        Returns:
+            int: the amount of the ask asset received (net of the commission)
+    """
+    if offer_pool <= 0 or ask_pool <= 0 or offer_amount <= 0:
+        return 0
+    cp = offer_pool * ask_pool
+    return_amount = ask_pool - cp // (offer_pool + offer_amount)
+    commission_amount = int(return_amount * commission_rate)
+    return max(return_amount - commission_amount, 0)
+
+
+def compute_d(amp: int, offer_pool: int, ask_pool: int) -> int:
+    """ Compute the stableswap invariant D with the newton method.
+    """
+    s = offer_pool + ask_pool
+    if s == 0:
+        return 0
+    ann = amp * N_COINS
+    d = s
+    for _ in range(ITERATIONS):
+        d_p = d * d // (offer_pool * N_COINS) * d // (ask_pool * N_COINS)
+        d_prev = d
+        d = (ann * s + d_p * N_COINS) * d // ((ann - 1) * d + (N_COINS + 1) * d_p)
+        if abs(d - d_prev) <= 1:
+            break
+    return d
+
+
+def compute_y(amp: int, new_offer_pool: int, d: int) -> int:
+    """ Compute the new reserve of the ask asset which keeps the stableswap invariant D constant.
+    """
+    ann = amp * N_COINS
+    c = d * d // (new_offer_pool * N_COINS) * d // (ann * N_COINS)
+    b = new_offer_pool + d // ann
+    y = d
+    for _ in range(ITERATIONS):
+        y_prev = y
+        y = (y * y + c) // (2 * y + b - d)
+        if abs(y - y_prev) <= 1:
+            break
+    return y
+
+
+def stable_swap(offer_pool: int, ask_pool: int, offer_amount: int, commission_rate: float, amp: int) -> int:
+    """ Stableswap curve swap as computed by the astroport stable pair contract.
+
+        Parameters:
+            - offer_pool (int): the reserve of the offer asset in the pool
+            - ask_pool (int): the reserve of the ask asset in the pool
+            - offer_amount (int): the amount of the offer asset to swap
+            - commission_rate (float): the commission of the pool, example: 0.0005
+            - amp (int): the amplification coefficient of the pool
+
+        Returns:
+            int: the amount of the ask asset received (net of the commission)
+    """
+    if offer_pool <= 0 or ask_pool <= 0 or offer_amount <= 0:
+        return 0
+    d = compute_d(amp, offer_pool, ask_pool)
+    new_ask_pool = compute_y(amp, offer_pool + offer_amount, d)
+    return_amount = ask_pool - new_ask_pool - 1
+    commission_amount = int(return_amount * commission_rate)
+    return max(return_amount - commission_amount, 0)
+
+
+class Pool:
+    """ Snapshot of the reserves of an astroport pair.
+    """
+
+    def __init__(self, pair_type: str, reserves: Dict[str, int]):
+        """
+            Parameters:
+                - pair_type (str): 'xyk' or 'stable'
+                - reserves (dict): key = asset's denomination, value = reserve amount
+                    example: {'uluna': 1000000, 'token_addr1': 2000000}
+        """
+        self.pair_type = pair_type
+        self.reserves = reserves
+
+    def swap(self, offer_denom: str, ask_denom: str, offer_amount: int,
+             commission_rates: Dict[str, float], stable_amp: int) -> int:
+        offer_pool = self.reserves[offer_denom]
+        ask_pool = self.reserves[ask_denom]
+        commission_rate = commission_rates[self.pair_type]
+        if self.pair_type == STABLE:
+            return stable_swap(offer_pool, ask_pool, offer_amount, commission_rate, stable_amp)
+        return xyk_swap(offer_pool, ask_pool, offer_amount, commission_rate)
+
+    def __repr__(self) -> str:
+        return "Pool(pair_type={}, reserves={})".format(self.pair_type, self.reserves)
+
+
+class PoolSimulator:
+    """ Off-chain simulation of the astroport swap operations based on the pool reserves.
+        It allows to rank many candidate hops without querying the router contract for each of them.
+    """
+
+    def __init__(self, pools: Dict[str, Pool], commission_rates: Dict[str, float], stable_amp: int):
+        """
+            Parameters:
+                - pools (dict): key = pair_id (see WhitelistedHop.build_pair_id), value = Pool
+                - commission_rates (dict): key = pair_type, value = commission rate
+                    example: {'xyk': 0.003, 'stable': 0.0005}
+                - stable_amp (int): the amplification coefficient of the stable pools
+        """
+        self.pools = pools
+        self.commission_rates = commission_rates
+        self.stable_amp = stable_amp
+
+    @staticmethod
+    def build_pair_id(offer_denom: str, ask_denom: str) -> str:
+        l = [offer_denom, ask_denom]
+        l.sort()
+        return "-".join(l)
+
+    def simulate_swap_operations(self, offer_amount: int, operations: List[AstroSwap]) -> Optional[int]:
+        """
+            Returns:
+                Optional[int]: the simulated amount of the target asset. It is None if the reserves of
+                    one of the pools of the swap operations are unknown.
+        """
+        amount = offer_amount
+        for op in operations:
+            offer_denom = op.offer_asset_info.denom
+            ask_denom = op.ask_asset_info.denom
+            pool = self.pools.get(self.build_pair_id(offer_denom, ask_denom))
+            if pool is None or offer_denom not in pool.reserves or ask_denom not in pool.reserves:
+                logger.debug("missing reserves for the pair {}-{}".format(offer_denom, ask_denom))
+                return None
+            amount = pool.swap(offer_denom, ask_denom, amount,
+                               self.commission_rates, self.stable_amp)
+        return amount
@@ -1,5 +1,5 @@
 from terra_sdk.core import Coin
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from abc import ABC, abstractmethod
 from enum import Enum
 import json
@@ -82,13 +82,27 @@ class Order():
 
 class SimulateSwapOperation():
 
-    def __init__(self, offer_amount: int, operations: List[AstroSwap]):
+    def __init__(self, offer_amount: int, operations: List[AstroSwap],
+                 operations_payload: Optional[List[dict]] = None):
+        """
+            Parameters:
+                - offer_amount (int): the amount of the start asset.
+                - operations (List[AstroSwap]): the swap operations.
+                - operations_payload (List[dict]): the serialized operations if they are already known
+                    (see CompiledRoute.to_dict).
+        """
         self.offer_amount = offer_amount
         self.operations = operations
+        self.operations_payload = operations_payload
+
+    def operations_to_dict(self) -> List[dict]:
+        if self.operations_payload is None:
+            self.operations_payload = [a.to_dict() for a in self.operations]
+        return self.operations_payload
 
     def to_dict(self):
         return {"simulate_swap_operations": {"offer_amount": str(self.offer_amount),
-                                             "operations": [a.to_dict() for a in self.operations]
+                                             "operations": self.operations_to_dict()
                                              }
                 }
 
@@ -3,14 +3,15 @@ import os
 from terra_sdk.client.lcd.api.tx import CreateTxOptions
 from terra_sdk.core.msg import Msg
 from terra_sdk.core.tx import Tx
-from terra_sdk.core.broadcast import BlockTxBroadcastResult
+from terra_sdk.core.broadcast import BlockTxBroadcastResult, SyncTxBroadcastResult
 from terra_sdk.client.lcd import LCDClient, Wallet
-from typing import List, Any
+from typing import List, Any, Dict
 import logging
 from bot.db.table.whitelisted_hop import WhitelistedHop
 from bot.db.table.whitelisted_token import WhitelistedToken
 from bot.type import AssetClass, Asset, AssetInfo, Order, \
     NativeAsset, TokenAsset, AstroSwap
+from bot.route import CompiledRoute
 
 
 logger = logging.getLogger(__name__)
@@ -58,6 +59,12 @@ def broadcast_transaction(terra: LCDClient, signed_tx: Tx) -> BlockTxBroadcastRe
     return terra.tx.broadcast(signed_tx)
 
 
+def broadcast_transaction_sync(terra: LCDClient, signed_tx: Tx) -> SyncTxBroadcastResult:
+    """ It returns as soon as the tx passed the CheckTx stage (mempool), without waiting for the next block.
+    """
+    return terra.tx.broadcast_sync(signed_tx)
+
+
 def perform_transaction(
     terra: LCDClient,
     wallet: Wallet,
@@ -112,49 +119,25 @@ def parse_dict_to_order(d: dict) -> Order:
 
 def parse_hops_from_string(hops: str,  whithelisted_tokens: List[WhitelistedToken],
                            whithelisted_hops: List[WhitelistedHop]) -> List[AstroSwap]:
-
+    """ example: '<1><inverse-2>' -> [AstroSwap(offer1, ask1), AstroSwap(ask2, offer2)]
+        The hops string is parsed by CompiledRoute, use ConfigSnapshot.compile_route to reuse the result.
+    """
     logger.debug("parse_hops_from_string: hops: {}".format(hops))
 
-    output: List[AstroSwap] = []
+    map_hops = {h.id: h for h in whithelisted_hops}
+    return CompiledRoute.compile(hops, build_asset_info_map(whithelisted_tokens), map_hops).operations
 
+
+def build_asset_info_map(whithelisted_tokens: List[WhitelistedToken]) -> Dict[str, AssetInfo]:
+    """
+        Returns:
+            dict: key = asset's denomination, value = AssetInfo
+    """
     map_wt = {}
     for wt in whithelisted_tokens:
         ac = AssetClass.NATIVE_TOKEN if wt.asset_class == AssetClass.NATIVE_TOKEN.value else AssetClass.TOKEN
         map_wt[wt.denom] = AssetInfo(ac, str(wt.denom))
-    map_hops = {}
-    for h in whithelisted_hops:
-        map_hops[h.id] = h
-
-    logger.debug("map_hops={}".format(map_hops))
-    l = hops.split("><")
-    length = len(l)
-    if length == 0:
-        assert length > 0
-
-    for h in l:
-        hop = h.replace("<", "").replace(">", "")
-        hop_id = int(hop) if not (hop.__contains__("inverse-")
-                                  ) else int(hop.replace("inverse-", ""))
-
-        assert hop_id in map_hops, "Missing hop_id={} in the whitelisted_hop={}".format(
-            hop_id, whithelisted_hops)
-
-        offer_denom: str = map_hops[hop_id].offer_denom
-        ask_denom: str = map_hops[hop_id].ask_denom
-        assert offer_denom in map_wt, "Missing offer_denom={} in the whithelisted_tokens={}".format(offer_denom,
-                                                                                                    whithelisted_tokens)
-        assert ask_denom in map_wt, "Missing ask_denom={} in the whithelisted_tokens={}".format(ask_denom,
-                                                                                                whithelisted_tokens)
-        offer_asset_info = map_wt[offer_denom]
-        ask_asset_info = map_wt[ask_denom]
-
-        if hop.__contains__("inverse-"):
-            output.append(AstroSwap(ask_asset_info, offer_asset_info))
-        else:
-            output.append(AstroSwap(offer_asset_info, ask_asset_info))
-
-    logger.debug("SwapOperations: {}".format(output))
-    return output
+    return map_wt
 
 
 def get_price(token_ids: str):
@@ -0,0 +1,102 @@
+""" Compare the concurrent write throughput of the default and the production (see bot/settings/prod.py)
+    storage profiles of the bot db.
+
+    Every writer thread commits one log_error row per transaction, like the purchase workers logging their
+    results, while the reader threads count the rows, like the scheduling and sync jobs.
+
+    Usage:
+        DCA_BOT=test PYTHONPATH=. python test/benchmark/bench_db.py [--writers 8] [--readers 2] [--duration 5]
+"""
+from typing import Any, Dict
+import argparse
+import os
+import tempfile
+import threading
+import time
+os.environ.setdefault('DCA_BOT', 'test')
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from bot.db.base import Base, build_engine  # noqa: E402
+from bot.db.table.log_error import LogError  # noqa: E402
+import bot.db.database  # noqa: E402,F401 registers all the tables
+from bot.settings import prod  # noqa: E402
+
+
+PROFILES = {
+    "default": {"pragmas": {}, "pool_class": "", "pool_size": 5},
+    "production": {"pragmas": prod.DB_PRAGMAS, "pool_class": prod.DB_POOL_CLASS, "pool_size": prod.DB_POOL_SIZE},
+}
+
+
+def run_profile(profile: Dict[str, Any], writers: int, readers: int, duration: float) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = build_engine("sqlite:///{}".format(os.path.join(tmp_dir, "dca.db")),
+                              profile["pragmas"], profile["pool_class"], profile["pool_size"])
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        counters = {"writes": 0, "reads": 0, "errors": 0}
+        lock = threading.Lock()
+        stop = time.time() + duration
+
+        def _count(name: str):
+            with lock:
+                counters[name] += 1
+
+        def _write():
+            while time.time() < stop:
+                session = Session()
+                try:
+                    session.add(LogError(None, None, "bench", "x" * 200))
+                    session.commit()
+                    _count("writes")
+                except Exception:
+                    # database is locked
+                    session.rollback()
+                    _count("errors")
+                finally:
+                    session.close()
+
+        def _read():
+            while time.time() < stop:
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(select(func.count(LogError.id))).scalar()
+                    _count("reads")
+                except Exception:
+                    _count("errors")
+
+        threads = [threading.Thread(target=_write) for _ in range(writers)] + \
+            [threading.Thread(target=_read) for _ in range(readers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+    return {"writes/s": counters["writes"] / duration,
+            "reads/s": counters["reads"] / duration,
+            "errors": counters["errors"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    print("writers={}, readers={}, duration={}s".format(
+        args.writers, args.readers, args.duration))
+    print("{:<12}{:>12}{:>12}{:>10}".format(
+        "profile", "writes/s", "reads/s", "errors"))
+    for name, profile in PROFILES.items():
+        result = run_profile(profile, args.writers,
+                             args.readers, args.duration)
+        print("{:<12}{:>12.1f}{:>12.1f}{:>10}".format(
+            name, result["writes/s"], result["reads/s"], result["errors"]))
+
+
+if __name__ == "__main__":
+    main()
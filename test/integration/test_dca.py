@@ -113,6 +113,33 @@ class TestDca(unittest.TestCase):
         output = self.dca2.get_astro_pools()
         self.assertEqual(len(output["pairs"]), 4)
 
+    def test_query_pool(self):
+        pair = self.dca2.get_astro_pools()["pairs"][0]
+        output = self.dca2.query_pool(pair["contract_addr"])
+        self.assertEqual(len(output["assets"]), 2)
+        self.assertEqual([a["info"] for a in output["assets"]],
+                         pair["asset_infos"])
+
+    def test_simulate_swap_operations_batch(self):
+        from bot.type import SimulateSwapOperation
+        token_AAA = AssetInfo(AssetClass.TOKEN,
+                              self.network["tokenAddresses"]["AAA"])
+        token_BBB = AssetInfo(AssetClass.TOKEN,
+                              self.network["tokenAddresses"]["BBB"])
+        luna = AssetInfo(AssetClass.NATIVE_TOKEN, 'uluna')
+
+        list_swo = [SimulateSwapOperation(1000, [AstroSwap(token_AAA, token_BBB)]),
+                    SimulateSwapOperation(1000, [AstroSwap(token_AAA, token_BBB),
+                                                 AstroSwap(token_BBB, luna)]),
+                    # invalid swap operations
+                    SimulateSwapOperation(1000, [AstroSwap(luna, luna)])]
+
+        output = self.dca2.simulate_swap_operations_batch(list_swo, 2, 10)
+        self.assertEqual(len(output), 3)
+        self.assertEqual(output[0], self.dca2.simulate_swap_operations(list_swo[0]))
+        self.assertEqual(output[1], self.dca2.simulate_swap_operations(list_swo[1]))
+        self.assertIsNone(output[2])
+
      # @unittest.skip("skip test_upload_contract")
     def test_upload_contract(self):
         """ test2 user is uploading the dca contract. 
@@ -327,6 +354,8 @@ if __name__ == '__main__':
         "test_query_get_user_config",
         "test_query_get_user_dca_orders",
         "test_get_astro_pools",
+        "test_query_pool",
+        "test_simulate_swap_operations_batch",
         "test_upload_contract",
         "test_instantiate",
         "test_execute_update_user_config",
@@ -3,11 +3,22 @@ from test.unit.test_database import get_test_names as test_db_names
 from test.unit.test_pd_df import get_test_names as test_df_names
 from test.unit.test_db_sync import get_test_names as test_sync_names
 from test.unit.test_exec_order import get_test_names as test_exec_order_names
+from test.unit.test_route import get_test_names as test_route_names
+from test.unit.test_simulator import get_test_names as test_simulator_names
+from test.unit.test_cache import get_test_names as test_cache_names
+from test.unit.test_executor import get_test_names as test_executor_names
+from test.unit.test_sequence import get_test_names as test_sequence_names
+from test.unit.test_gas import get_test_names as test_gas_names
+from test.unit.test_ratelimit import get_test_names as test_ratelimit_names
+from test.unit.test_shard import get_test_names as test_shard_names
 
 
 def get_test_names():
     testFullNames = test_df_names() + test_db_names() + \
-        test_sync_names() + test_exec_order_names()
+        test_sync_names() + test_exec_order_names() + test_route_names() + \
+        test_simulator_names() + test_cache_names() + \
+        test_executor_names() + test_sequence_names() + test_gas_names() + \
+        test_ratelimit_names() + test_shard_names()
     return testFullNames
 
 
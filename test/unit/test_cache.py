@@ -0,0 +1,124 @@
+import unittest
+from unittest import mock
+import os
+from bot.type import AssetInfo, AssetClass, AstroSwap, SimulateSwapOperation
+
+
+DENOM1 = AssetInfo(AssetClass.TOKEN, "denom1")
+DENOM2 = AssetInfo(AssetClass.TOKEN, "denom2")
+DENOM3 = AssetInfo(AssetClass.TOKEN, "denom3")
+
+
+def build_swo(offer_amount: int, operations=[AstroSwap(DENOM1, DENOM2)]):
+    return SimulateSwapOperation(offer_amount, operations)
+
+
+class TestSimulationCache(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+
+    def test_get_set(self):
+        from bot.cache import SimulationCache
+        cache = SimulationCache(10, 60, 0.001)
+
+        self.assertIsNone(cache.get(build_swo(1000000)))
+        cache.set(build_swo(1000000), 2000000)
+        self.assertEqual(cache.get(build_swo(1000000)), 2000000)
+        # a different route is a different entry
+        self.assertIsNone(cache.get(build_swo(
+            1000000, [AstroSwap(DENOM1, DENOM3)])))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_tolerance(self):
+        from bot.cache import SimulationCache
+        cache = SimulationCache(10, 60, 0.001)
+        cache.set(build_swo(1000000), 2000000)
+
+        # within the tolerance the cached quote is scaled
+        self.assertEqual(cache.get(build_swo(1000500)), 2001000)
+        self.assertEqual(cache.get(build_swo(999000)), 1998000)
+        # outside the tolerance
+        self.assertIsNone(cache.get(build_swo(1002000)))
+
+        # no tolerance: only the exact amount is reused
+        cache = SimulationCache(10, 60, 0)
+        cache.set(build_swo(1000000), 2000000)
+        self.assertEqual(cache.get(build_swo(1000000)), 2000000)
+        self.assertIsNone(cache.get(build_swo(1000001)))
+
+    def test_ttl(self):
+        from bot.cache import SimulationCache
+        cache = SimulationCache(10, 60, 0.001)
+        with mock.patch("bot.cache.time.time", return_value=1000):
+            cache.set(build_swo(1000000), 2000000)
+        with mock.patch("bot.cache.time.time", return_value=1060):
+            self.assertEqual(cache.get(build_swo(1000000)), 2000000)
+        with mock.patch("bot.cache.time.time", return_value=1061):
+            self.assertIsNone(cache.get(build_swo(1000000)))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        from bot.cache import SimulationCache
+        cache = SimulationCache(2, 60, 0)
+        cache.set(build_swo(1), 1)
+        cache.set(build_swo(2), 2)
+        # 1 becomes the most recently used entry
+        self.assertEqual(cache.get(build_swo(1)), 1)
+        cache.set(build_swo(3), 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(build_swo(2)))
+        self.assertEqual(cache.get(build_swo(1)), 1)
+        self.assertEqual(cache.get(build_swo(3)), 3)
+
+    def test_dca_simulate_swap_operations(self):
+        from bot.cache import SimulationCache
+        from bot.dca import DCA
+        terra = mock.Mock()
+        terra.wasm.contract_query.return_value = {"amount": "2000000"}
+        dca = DCA(terra, mock.Mock(), "dca_addr",
+                  SimulationCache(10, 60, 0.001))
+        dca.router_addr = "router_addr"
+
+        self.assertEqual(dca.simulate_swap_operations(
+            build_swo(1000000)), 2000000)
+        self.assertEqual(dca.simulate_swap_operations(
+            build_swo(1000000)), 2000000)
+        self.assertEqual(terra.wasm.contract_query.call_count, 1)
+
+        # only the missing simulations are queried
+        with mock.patch.object(DCA, "_simulate_swap_operations_batch") as batch:
+            batch.return_value = mock.Mock()
+            with mock.patch("bot.dca.asyncio.new_event_loop") as new_event_loop:
+                new_event_loop.return_value.run_until_complete.return_value = [
+                    3000000]
+                result = dca.simulate_swap_operations_batch(
+                    [build_swo(1000000), build_swo(2000000)], 4, 10)
+            self.assertEqual(result, [2000000, 3000000])
+            self.assertEqual(len(batch.call_args[0][1]), 1)
+        self.assertEqual(dca.simulate_swap_operations(
+            build_swo(2000000)), 3000000)
+        self.assertEqual(terra.wasm.contract_query.call_count, 1)
+
+
+def get_test_names():
+    testNames = [
+        "test_get_set",
+        "test_tolerance",
+        "test_ttl",
+        "test_lru",
+        "test_dca_simulate_swap_operations"
+    ]
+    testFullNames = [
+        "test_cache.TestSimulationCache.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
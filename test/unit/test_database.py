@@ -231,8 +231,7 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(1000, orders[0].initial_asset_amount)
         orders[0].initial_asset_amount = 2000
         self.db.insert_or_update(orders[0])
-        orders = self.db.get_dca_orders()
-        self.assertEqual(2, len(orders))
+        self.assertEqual(2, len(self.db.get_dca_orders()))
 
         order_updated = self.db.get_dca_orders(str(orders[0].id))
         self.assertEqual(orders[0].id, order_updated[0].id)
@@ -263,6 +262,311 @@ class TestDatabase(unittest.TestCase):
         orders = self.db.get_dca_orders()
         self.assertEqual(0, len(orders))
 
+    def test_bulk_upsert(self):
+        from bot.db.table.dca_order import DcaOrder
+        self.db.bulk_upsert(DcaOrder, [DcaOrder(TEST_USER_1, '0.1', 1, ORDER_1),
+                                       DcaOrder(TEST_USER_1, '0.1', 1, ORDER_2),
+                                       DcaOrder(TEST_USER_2, '0.1', 1, ORDER_1)],
+                            DcaOrder.user_address == TEST_USER_1)
+        self.assertEqual(3, len(self.db.get_dca_orders()))
+
+        next_run_time = datetime.utcnow() + timedelta(hours=1)
+        order = self.db.get_dca_orders(DcaOrder.build_id(TEST_USER_1, 5))[0]
+        order.schedule = True
+        order.next_run_time = next_run_time
+        self.db.insert_or_update(order)
+
+        # update the order 5, insert the order 7 and delete the orphan order 6 of the user 1
+        self.db.bulk_upsert(DcaOrder, [DcaOrder(TEST_USER_1, '0.2', 1, ORDER_1),
+                                       DcaOrder(TEST_USER_1, '0.1', 1, ORDER_3)],
+                            DcaOrder.user_address == TEST_USER_1)
+        orders = {o.id: o for o in self.db.get_dca_orders(user_address=TEST_USER_1)}
+        self.assertEqual(sorted(orders.keys()), [DcaOrder.build_id(TEST_USER_1, 5),
+                                                 DcaOrder.build_id(TEST_USER_1, 7)])
+        order = orders[DcaOrder.build_id(TEST_USER_1, 5)]
+        self.assertEqual(order.max_spread, '0.2')
+        # the columns which are not set by the sync are preserved
+        self.assertTrue(order.schedule)
+        self.assertEqual(order.next_run_time, next_run_time)
+        self.assertFalse(orders[DcaOrder.build_id(TEST_USER_1, 7)].schedule)
+        self.assertEqual(1, len(self.db.get_dca_orders(user_address=TEST_USER_2)))
+
+        # the rows of a statement set the same columns, otherwise the columns only set by the later
+        # rows would not be updated
+        order = DcaOrder(TEST_USER_1, '0.3', 1, ORDER_3)
+        order.next_run_time = next_run_time
+        with self.assertRaises(AssertionError):
+            self.db.bulk_upsert(DcaOrder, [DcaOrder(TEST_USER_1, '0.3', 1, ORDER_1), order])
+        self.assertEqual(self.db.get_dca_orders(DcaOrder.build_id(TEST_USER_1, 5))[0].max_spread, '0.2')
+
+        # empty dca_order table
+        self.db.bulk_upsert(DcaOrder, [], DcaOrder.user_address.in_(  # type: ignore
+            [TEST_USER_1, TEST_USER_2]))
+        self.assertEqual(0, len(self.db.get_dca_orders()))
+
+    def test_reset_schedule(self):
+        from bot.db.table.dca_order import DcaOrder
+        orders = [DcaOrder(TEST_USER_1, '0.1', 1, ORDER_1),
+                  DcaOrder(TEST_USER_1, '0.1', 1, ORDER_2),
+                  DcaOrder(TEST_USER_2, '0.1', 1, ORDER_3)]
+        next_run_times = [datetime.utcnow() + timedelta(hours=1),
+                          datetime.utcnow() - timedelta(seconds=1),
+                          datetime.utcnow() - timedelta(seconds=1)]
+        for order, next_run_time in zip(orders, next_run_times):
+            order.schedule = True
+            order.next_run_time = next_run_time
+            self.db.insert_or_update(order)
+
+        def _schedules():
+            return [o.schedule for o in sorted(self.db.get_dca_orders(), key=lambda o: o.id)]
+
+        # successful purchase of the order 5: the trigger only resets this order
+        self.db.bulk_upsert(DcaOrder, [DcaOrder(TEST_USER_1, '0.1', 1, Order(
+            5, 10, TokenAsset("Token1", "900"), AssetInfo(AssetClass.TOKEN, "token1"), 2, 500, 100))])
+        self.assertEqual(_schedules(), [False, True, True])
+        order = self.db.get_dca_orders(orders[0].id)[0]
+        self.assertIsNone(order.next_run_time)
+
+        # an increase of the amount does not reset the order
+        order.schedule = True
+        order.next_run_time = next_run_times[0]
+        order.initial_asset_amount = 2000
+        self.db.insert_or_update(order)
+        self.assertEqual(_schedules(), [True, True, True])
+
+        # the failed purchases (expired next_run_time) are reset explicitly
+        self.assertEqual(self.db.reset_expired_schedules(TEST_USER_1), 1)
+        self.assertEqual(_schedules(), [True, False, True])
+        self.assertEqual(self.db.reset_expired_schedules(), 1)
+        self.assertEqual(_schedules(), [True, False, False])
+
+        # clean order table
+        self.db.exec_sql("delete from dca_order")
+
+    def _query_plans(self, func, *args, **kwargs) -> list:
+        """ Call func and return the query plan (EXPLAIN QUERY PLAN) of every statement it executes.
+        """
+        from sqlalchemy import event
+        from bot.db.base import engine
+        statements = []
+
+        def _capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                statements.append((statement, parameters))
+        event.listen(engine, "before_cursor_execute", _capture)
+        try:
+            func(*args, **kwargs)
+        finally:
+            event.remove(engine, "before_cursor_execute", _capture)
+
+        plans = []
+        with engine.connect() as conn:
+            for statement, parameters in statements:
+                plans.append([row[-1] for row in conn.exec_driver_sql(
+                    "EXPLAIN QUERY PLAN " + statement, parameters)])
+        return plans
+
+    def test_update_schedule(self):
+        from bot.db.table.dca_order import DcaOrder
+        dcao1 = DcaOrder(TEST_USER_1, '0.1', 1, ORDER_1)
+        self.db.insert_or_update(dcao1)
+        stale_order = self.db.get_dca_orders(str(dcao1.id))[0]
+
+        # the user sync writes the new amount of the order
+        dcao1.initial_asset_amount = 500
+        self.db.insert_or_update(dcao1)
+
+        next_run_time = datetime.utcnow() + timedelta(hours=1)
+        self.db.update_schedule(str(stale_order.id), True, next_run_time)
+        order = self.db.get_dca_orders(str(dcao1.id))[0]
+        self.assertTrue(order.schedule)
+        self.assertEqual(order.next_run_time, next_run_time)
+        # the stale columns are not written back
+        self.assertEqual(order.initial_asset_amount, 500)
+
+        self.db.update_schedule(str(stale_order.id), False, None)
+        order = self.db.get_dca_orders(str(dcao1.id))[0]
+        self.assertFalse(order.schedule)
+        self.assertIsNone(order.next_run_time)
+
+        self.db.delete(DcaOrder, DcaOrder.id == dcao1.id)
+
+    def test_query_plans(self):
+        from bot.db.base import engine
+        if engine.dialect.name != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is specific to sqlite")
+        hot_queries = [
+            (self.db.get_dca_orders, {"schedule": False}),
+            (self.db.get_dca_orders, {
+             "user_address": TEST_USER_1, "schedule": False}),
+            (self.db.get_dca_orders, {"id": "order_id"}),
+            (self.db.reset_expired_schedules, {}),
+            (self.db.reset_expired_schedules, {"user_address": TEST_USER_1}),
+            (self.db.get_user_tip_balance, {"user_address": TEST_USER_1}),
+            (self.db.get_purchase_history, {"order_id": "order_id"}),
+            (self.db.get_log_error, {"order_id": "order_id"}),
+            (self.db.get_log_error, {"user_address": TEST_USER_1}),
+            (self.db.get_pool_reserve, {"pair_ids": ["denom1-denom2"]}),
+            (self.db.get_tx_order_ids, {"txhashes": ["txhash"]}),
+        ]
+        for func, kwargs in hot_queries:
+            plans = self._query_plans(func, **kwargs)
+            self.assertGreater(len(plans), 0)
+            for plan in plans:
+                # a full scan of the table is reported as 'SCAN <table>'
+                full_scans = [p for p in plan if p.startswith("SCAN")]
+                self.assertEqual(full_scans, [], "{}({}): {}".format(
+                    func.__name__, kwargs, plan))
+
+    def test_upgrade_database_objects(self):
+        from sqlalchemy import inspect
+        from bot.db.base import engine
+        from bot.db.database import create_database_objects
+        # a db created by a previous version of the bot
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_purchase_history_txhash")
+            conn.exec_driver_sql(
+                "ALTER TABLE purchase_history DROP COLUMN txhash")
+            conn.exec_driver_sql('ALTER TABLE "user" DROP COLUMN sync_hash')
+            conn.exec_driver_sql(
+                "DROP INDEX ix_dca_order_schedule_next_run_time")
+
+        # the upgrade is idempotent
+        create_database_objects()
+        create_database_objects()
+        inspector = inspect(engine)
+        self.assertIn("sync_hash", [c["name"]
+                      for c in inspector.get_columns("user")])
+        self.assertIn("txhash", [c["name"]
+                      for c in inspector.get_columns("purchase_history")])
+        self.assertIn("ix_purchase_history_txhash", [i["name"]
+                      for i in inspector.get_indexes("purchase_history")])
+        self.assertIn("ix_dca_order_schedule_next_run_time", [i["name"]
+                      for i in inspector.get_indexes("dca_order")])
+        # the rows are kept
+        self.assertEqual(sorted([str(u.id) for u in self.db.get_users()]),
+                         sorted([TEST_USER_1, TEST_USER_2]))
+
+    def test_upgrade_trigger(self):
+        from bot.db.base import engine
+        from bot.db.database import create_database_objects
+        if engine.dialect.name != "sqlite":
+            self.skipTest("the trigger of the previous version is specific to sqlite")
+
+        def _trigger_sql():
+            with engine.connect() as conn:
+                return conn.exec_driver_sql(
+                    "SELECT sql FROM sqlite_master WHERE type='trigger' AND name='reset_schedule'").scalar()
+        trigger_sql = _trigger_sql()
+        # the trigger of a previous version scans the whole table after every update
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TRIGGER reset_schedule")
+            conn.exec_driver_sql("""
+                CREATE TRIGGER reset_schedule AFTER UPDATE ON dca_order
+                BEGIN
+                    UPDATE dca_order SET schedule = 0, next_run_time = NULL
+                    WHERE id = new.id OR (schedule = 1 AND next_run_time < datetime('now'));
+                END""")
+        self.assertNotEqual(_trigger_sql(), trigger_sql)
+
+        create_database_objects()
+        self.assertEqual(_trigger_sql(), trigger_sql)
+
+    def test_upgrade_column_types(self):
+        from sqlalchemy import inspect, BigInteger
+        from bot.db.base import engine
+        from bot.db.database import create_database_objects
+        from bot.db.table.dca_order import DcaOrder
+        if engine.dialect.name != "postgresql":
+            self.skipTest("a sqlite integer is always stored on 64 bits")
+
+        # the amounts of a previous version are stored on 32 bits
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP TRIGGER reset_schedule ON dca_order")
+            conn.exec_driver_sql(
+                "ALTER TABLE dca_order ALTER COLUMN initial_asset_amount TYPE INTEGER")
+            conn.exec_driver_sql(
+                "ALTER TABLE purchase_history ALTER COLUMN dca_amount TYPE INTEGER")
+
+        create_database_objects()
+        inspector = inspect(engine)
+        for table, column in [("dca_order", "initial_asset_amount"), ("purchase_history", "dca_amount")]:
+            column_type = [c["type"] for c in inspector.get_columns(table)
+                           if c["name"] == column][0]
+            self.assertIsInstance(column_type, BigInteger)
+
+        dcao1 = DcaOrder(TEST_USER_1, '0.1', 1, ORDER_1)
+        dcao1.initial_asset_amount = 2**40
+        self.db.insert_or_update(dcao1)
+        self.assertEqual(self.db.get_dca_orders(str(dcao1.id))[
+                         0].initial_asset_amount, 2**40)
+
+        self.db.delete(DcaOrder, DcaOrder.id == dcao1.id)
+
+    def test_token_price_updated_at(self):
+        from bot.db.table.token_price import TokenPrice
+        tp = TokenPrice("uluna", "terra-luna-2", "luna", 6, 1.5)
+        tp.updated_at = datetime(2020, 1, 1)
+        self.db.insert_or_update(tp)
+        self.assertEqual(self.db.get_token_price()[
+                         0].updated_at, datetime(2020, 1, 1))
+
+        # the trigger refreshes updated_at on every update
+        before = datetime.utcnow().replace(microsecond=0)
+        tp = self.db.get_token_price()[0]
+        make_transient(tp)
+        tp.price = 2.5
+        self.db.insert_or_update(tp)
+        tp = self.db.get_token_price()[0]
+        self.assertEqual(tp.price, 2.5)
+        self.assertGreaterEqual(tp.updated_at, before)
+
+        self.db.delete(TokenPrice, TokenPrice.denom == "uluna")
+
+    def test_build_engine(self):
+        import tempfile
+        from sqlalchemy.pool import QueuePool
+        from bot.db.base import build_engine
+        from bot.settings import prod
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = build_engine("sqlite:///{}".format(os.path.join(tmp_dir, "dca.db")),
+                                  prod.DB_PRAGMAS, prod.DB_POOL_CLASS, prod.DB_POOL_SIZE)
+            self.assertIsInstance(engine.pool, QueuePool)
+            with engine.connect() as conn:
+                def _pragma(name):
+                    return conn.exec_driver_sql("pragma {}".format(name)).scalar()
+                self.assertEqual(_pragma("foreign_keys"), 1)
+                self.assertEqual(_pragma("journal_mode"), "wal")
+                # NORMAL
+                self.assertEqual(_pragma("synchronous"), 1)
+                self.assertEqual(_pragma("busy_timeout"),
+                                 prod.DB_PRAGMAS["busy_timeout"])
+                self.assertEqual(_pragma("cache_size"),
+                                 prod.DB_PRAGMAS["cache_size"])
+            engine.dispose()
+
+        # an in memory db only lives as long as its connection
+        with self.assertRaises(AssertionError):
+            build_engine("sqlite:///:memory:", {}, "queue")
+
+    def test_postgresql_ddl(self):
+        from sqlalchemy import create_mock_engine
+        from bot.db.base import Base
+        statements = []
+        pg_engine = create_mock_engine("postgresql://", lambda sql, *multiparams, **params: statements.append(
+            str(sql.compile(dialect=pg_engine.dialect))))
+        Base.metadata.create_all(pg_engine, checkfirst=False)
+        ddl = "\n".join(statements)
+
+        # the triggers are created with their postgresql version only
+        for trigger in ["trigger_updated_at", "increment_id", "reset_schedule"]:
+            self.assertEqual(ddl.count(
+                "CREATE TRIGGER {} ".format(trigger)), 1)
+        self.assertEqual(ddl.count("LANGUAGE plpgsql"), 3)
+        self.assertNotIn("datetime('now')", ddl)
+        # user is a reserved word in postgresql
+        self.assertIn('CREATE TABLE "user"', ddl)
+
     def test_expired_next_run_time_flag(self):
         from bot.db.table.dca_order import DcaOrder
         orders = self.db.get_dca_orders()
@@ -451,6 +755,16 @@ def get_test_names():
         "test_delete_on_cascade_purchase_history",
         "test_delete_on_cascade_purchase_history2",
         "test_insert_or_update",
+        "test_bulk_upsert",
+        "test_reset_schedule",
+        "test_update_schedule",
+        "test_query_plans",
+        "test_upgrade_database_objects",
+        "test_upgrade_trigger",
+        "test_upgrade_column_types",
+        "test_token_price_updated_at",
+        "test_build_engine",
+        "test_postgresql_ddl",
         "test_expired_next_run_time_flag",
         "test_log_purchase_history",
         "test_log_error",
@@ -1,8 +1,9 @@
 
 import unittest
 import os
+from typing import List, Optional
 from unittest.mock import Mock
-from bot.type import NativeAsset, TokenAsset
+from bot.type import NativeAsset, TokenAsset, AstroSwap
 from terra_sdk.client.localterra import LocalTerra
 
 
@@ -81,6 +82,9 @@ def mock_dca():
                                                               'dca_amount': '250000'}}
 
                                                    ]
+    mock.query_users_data.side_effect = lambda user_addresses, *args: {
+        u: (mock.query_get_user_config.return_value, mock.query_get_user_dca_orders.return_value)
+        for u in user_addresses}
 
     return mock
 
@@ -133,6 +137,13 @@ class TestDbSync(unittest.TestCase):
         users = self.sync.db.get_users()
         self.assertEqual(len(users), 1)
 
+    def _save_user_data(self, tips: List[dict], orders: List[dict], max_spread: Optional[str] = None,
+                        max_hops: Optional[int] = None):
+        cfg_user = {"max_spread": max_spread,
+                    "max_hops": max_hops, "tip_balance": tips}
+        self.sync.db.save_users_data(
+            [self.sync._build_user_data(TEST_USER, cfg_user, orders)])
+
     def test_sync_user_tip_balance(self):
         from bot.db.table.user_tip_balance import UserTipBalance
 
@@ -154,7 +165,7 @@ class TestDbSync(unittest.TestCase):
 
         # tips to sync
         tips = [tip_0, tip_1]
-        self.sync._sync_user_tip_balance(TEST_USER, tips)
+        self._save_user_data(tips, [])
 
         # check entries in db are fine
         db_tips = self.sync.db.get_user_tip_balance(TEST_USER)
@@ -172,7 +183,7 @@ class TestDbSync(unittest.TestCase):
             'contract_addr': denom_0}}, 'amount': str(new_amount_0)}
         new_tips = [tip_0_new_amount]
         # tips to sync
-        self.sync._sync_user_tip_balance(TEST_USER, new_tips)
+        self._save_user_data(new_tips, [])
 
         db_tips = self.sync.db.get_user_tip_balance(TEST_USER)
         self.assertEqual(len(db_tips), 1)
@@ -236,7 +247,7 @@ class TestDbSync(unittest.TestCase):
 
         # orders to sync
         orders = [order_1, order_2]
-        self.sync._sync_dca_oders(TEST_USER, max_spread, max_hops, orders)
+        self._save_user_data([], orders, max_spread, max_hops)
 
         # check entries in db are fine
         user_orders = self.sync.db.get_dca_orders(user_address=TEST_USER)
@@ -287,7 +298,7 @@ class TestDbSync(unittest.TestCase):
                        }
         # orders to sync
         orders = [new_order_1]
-        self.sync._sync_dca_oders(TEST_USER, max_spread, max_hops, orders)
+        self._save_user_data([], orders, max_spread, max_hops)
 
         # check entries in db are fine
         user_orders = self.sync.db.get_dca_orders(user_address=TEST_USER)
@@ -445,6 +456,171 @@ class TestDbSync(unittest.TestCase):
         orders = self.sync.db.get_dca_orders(id=None, user_address=TEST_USER)
         self.assertEqual(len(orders), 2)
 
+    def test_sync_users_data(self):
+        from unittest import mock
+        self.sync.insert_user_into_db(TEST_USER)
+        self.sync.insert_user_into_db("user_2")
+        self.sync.insert_user_into_db("user_3")
+        self.sync.dca.query_users_data.side_effect = lambda user_addresses, *args: {
+            u: None if u == "user_2" else (self.sync.dca.query_get_user_config.return_value,
+                                            self.sync.dca.query_get_user_dca_orders.return_value)
+            for u in user_addresses}
+
+        with mock.patch("bot.db_sync.SYNC_USER_BATCH_SIZE", 2):
+            self.sync.sync_users_data()
+        # 2 batches of users
+        self.assertEqual(self.sync.dca.query_users_data.call_count, 2)
+        self.sync.dca.query_get_user_config.assert_not_called()
+
+        for user_address in [TEST_USER, "user_3"]:
+            self.assertEqual(
+                len(self.sync.db.get_dca_orders(user_address=user_address)), 2)
+            self.assertEqual(
+                len(self.sync.db.get_user_tip_balance(user_address)), 2)
+        # the failed user is synced again in the next cycle
+        self.assertEqual([u.id for u in self.sync.db.get_users(sync_data=False)], ["user_2"])
+        self.assertEqual(len(self.sync.db.get_log_error(user_address="user_2")), 1)
+
+        # the orphan orders are removed
+        self.sync.dca.query_users_data.side_effect = lambda user_addresses, *args: {
+            u: (self.sync.dca.query_get_user_config.return_value,
+                self.sync.dca.query_get_user_dca_orders.return_value[:1]) for u in user_addresses}
+        self.sync.insert_user_into_db(TEST_USER)
+        self.sync.sync_users_data()
+        self.assertEqual(len(self.sync.db.get_dca_orders(user_address=TEST_USER)), 1)
+        self.assertEqual(len(self.sync.db.get_users(sync_data=False)), 0)
+
+    def test_save_users_data_unchanged(self):
+        import copy
+        from bot.db.table.user import User
+        self.sync.insert_user_into_db(TEST_USER)
+        cfg_user = self.sync.dca.query_get_user_config.return_value
+        orders = copy.deepcopy(self.sync.dca.query_get_user_dca_orders.return_value)
+
+        # 2 tips and 2 orders
+        user_data = self.sync._build_user_data(TEST_USER, cfg_user, orders)
+        self.assertEqual(self.sync.db.save_users_data([user_data]), 4)
+        self.assertEqual(self.sync.db.get_users()[0].sync_hash, user_data[1])
+
+        # same data: nothing is written
+        user_data = self.sync._build_user_data(TEST_USER, cfg_user, orders)
+        self.assertEqual(self.sync.db.save_users_data([user_data]), 0)
+
+        # only the modified order is written
+        orders[1]["order"]["dca_amount"] = "100000"
+        user_data = self.sync._build_user_data(TEST_USER, cfg_user, orders)
+        self.assertEqual(self.sync.db.save_users_data([user_data]), 1)
+        self.assertEqual(
+            sorted([o.dca_amount for o in self.sync.db.get_dca_orders()]), [100000, 250000])
+
+        # without the hash the rows are compared one by one
+        user = self.sync.db.get_users()[0]
+        user.sync_hash = None
+        self.sync.db.insert_or_update(user)
+        self.assertEqual(self.sync.db.save_users_data([user_data]), 0)
+        self.assertEqual(self.sync.db.get_users()[0].sync_hash, user_data[1])
+        self.assertTrue(self.sync.db.get_users()[0].sync_data)
+
+    def test_sync_users_events(self):
+        from unittest import mock
+        from bot.db_sync import USER_EVENTS_CHECKPOINT
+        from bot.settings import SYNC_USER_EVENTS_MAX_PAGES
+        self.sync.insert_user_into_db(TEST_USER)
+        self.sync.insert_user_into_db("user_2")
+
+        def _synced_users():
+            users = [u for c in self.sync.dca.query_users_data.call_args_list
+                     for u in c[0][0]]
+            self.sync.dca.query_users_data.reset_mock()
+            return sorted(users)
+
+        # the first run syncs every user
+        self.sync.dca.query_latest_height.return_value = 100
+        self.sync.sync_users_events()
+        self.assertEqual(_synced_users(), ["user_2", TEST_USER])
+        self.assertEqual(self.sync.db.get_checkpoint(USER_EVENTS_CHECKPOINT), 100)
+        self.sync.dca.query_contract_txs.assert_not_called()
+
+        # then only the users touched since the checkpoint, a new user is inserted
+        self.sync.dca.query_latest_height.return_value = 120
+        self.sync.dca.query_contract_txs.return_value = ([], True)
+        self.sync.dca.get_touched_users.return_value = {"user_2", "new_user"}
+        self.sync.sync_users_events()
+        self.sync.dca.query_contract_txs.assert_called_once_with(
+            101, max_pages=SYNC_USER_EVENTS_MAX_PAGES)
+        self.assertEqual(_synced_users(), ["new_user", "user_2"])
+        self.assertIn("new_user", [str(u.id) for u in self.sync.db.get_users(True)])
+        self.assertEqual(self.sync.db.get_checkpoint(USER_EVENTS_CHECKPOINT), 120)
+
+        # a backlog larger than SYNC_USER_EVENTS_MAX_PAGES pages: the checkpoint advances step by step
+        self.sync.dca.query_latest_height.return_value = 200
+        self.sync.dca.query_contract_txs.return_value = (
+            [mock.Mock(height=150), mock.Mock(height=121)], False)
+        self.sync.sync_users_events()
+        self.assertEqual(self.sync.db.get_checkpoint(USER_EVENTS_CHECKPOINT), 149)
+        self.sync.dca.query_contract_txs.assert_called_with(
+            121, max_pages=SYNC_USER_EVENTS_MAX_PAGES)
+        _synced_users()
+
+        # the checkpoint is not moved if the search fails
+        self.sync.dca.query_latest_height.return_value = 230
+        self.sync.dca.query_contract_txs.side_effect = Exception("timeout")
+        self.sync.sync_users_events()
+        self.assertEqual(self.sync.db.get_checkpoint(USER_EVENTS_CHECKPOINT), 149)
+
+    def test_get_touched_users(self):
+        from unittest import mock
+        from terra_sdk.core.wasm import MsgExecuteContract
+        from terra_sdk.core.bank import MsgSend
+        from bot.dca import DCA
+
+        def _tx(height, msgs):
+            return mock.Mock(height=height, tx=mock.Mock(body=mock.Mock(messages=msgs)))
+        txs = [_tx(12, [MsgExecuteContract("bot", "dca_addr", {"perform_dca_purchase": {"user_address": "user_1", "id": 1}}),
+                        MsgExecuteContract("bot", "dca_addr", {"perform_dca_purchase": {"user_address": "user_2", "id": 1}})]),
+               _tx(11, [MsgExecuteContract("user_3", "token_addr", {"increase_allowance": {}}),
+                        MsgExecuteContract("user_3", "dca_addr", {"create_dca_order": {}}),
+                        MsgSend("user_4", "user_5", "1uluna")]),
+               _tx(10, [MsgExecuteContract("user_6", "dca_addr", {"add_bot_tip": {}})])]
+        terra = mock.Mock()
+        # pages of 2 txs, latest first
+        terra.tx.search.side_effect = [{"txs": txs[:2]}, {"txs": txs[2:]}]
+        dca = DCA(terra, mock.Mock(), "dca_addr")
+
+        found, complete = dca.query_contract_txs(11, limit=2)
+        self.assertEqual(found, txs[:2])
+        self.assertTrue(complete)
+        self.assertEqual(terra.tx.search.call_count, 2)
+        self.assertEqual(terra.tx.search.call_args[0][1]["pagination.offset"], "2")
+        self.assertEqual(dca.get_touched_users(found), {"user_1", "user_2", "user_3"})
+
+    def test_query_contract_txs_backlog(self):
+        from unittest import mock
+        from bot.dca import DCA
+        # 20 txs at the heights 1..20
+        txs = [mock.Mock(height=h) for h in range(1, 21)]
+
+        def _search(events, params):
+            offset = int(params["pagination.offset"])
+            limit = int(params["pagination.limit"])
+            ordered = txs if params["order_by"] == "ORDER_BY_ASC" else txs[::-1]
+            return {"txs": ordered[offset:offset + limit], "pagination": {"total": str(len(txs))}}
+        terra = mock.Mock()
+        terra.tx.search.side_effect = _search
+        dca = DCA(terra, mock.Mock(), "dca_addr")
+
+        # the txs since the height 5 don't fit in 2 pages: the oldest ones are returned
+        found, complete = dca.query_contract_txs(5, limit=3, max_pages=2)
+        self.assertFalse(complete)
+        self.assertEqual([tx.height for tx in found], [10, 9, 8, 7, 6, 5])
+        # the last step
+        found, complete = dca.query_contract_txs(15, limit=3, max_pages=2)
+        self.assertTrue(complete)
+        self.assertEqual([tx.height for tx in found], [20, 19, 18, 17, 16, 15])
+        found, complete = dca.query_contract_txs(18, limit=3, max_pages=2)
+        self.assertTrue(complete)
+        self.assertEqual([tx.height for tx in found], [20, 19, 18])
+
     def test_sync_dca_cfg(self):
         # setup test
 
@@ -502,6 +678,186 @@ class TestDbSync(unittest.TestCase):
 
         self.assertEqual(actual_hops, expected_hops)
 
+    def test_refresh_route_engine(self):
+        self.assertIsNone(self.sync.route_engine)
+
+        # sync configuration
+        self.sync.sync_dca_cfg()
+        engine = self.sync.get_route_engine()
+        self.assertIsNotNone(engine)
+
+        self.assertEqual(engine.get_routes("denom1", "uluna", 3),
+                         ["<1><2><inverse-3>"])
+        self.assertEqual(engine.get_routes("denom1", "uluna", 2), [])
+        self.assertEqual(engine.get_routes("denom3", "denom1", 3),
+                         ["<inverse-2><inverse-1>"])
+
+        # the route engine is rebuilt every time the configuration is synced
+        self.sync.sync_dca_cfg()
+        self.assertIsNot(engine, self.sync.get_route_engine())
+
+    def test_refresh_config(self):
+        self.assertIsNone(self.sync.config)
+
+        # sync configuration
+        self.sync.sync_dca_cfg()
+        config = self.sync.get_config()
+        self.assertEqual(config.version, 1)
+        self.assertEqual(len(config.whitelisted_tokens), 4)
+        self.assertEqual(len(config.whitelisted_hops), 3)
+        self.assertEqual(config.hop_fee_map, {"denom1": 1000, "uluna": 5000})
+        self.assertEqual(config.asset_info_map["uluna"].to_dict(),
+                         LUNA.get_info().to_dict())
+
+        swap_operations = config.parse_hops("<1><2><inverse-3>")
+        self.assertEqual([s.to_dict() for s in swap_operations],
+                         [AstroSwap(TOKEN1.get_info(), TOKEN2.get_info()).to_dict(),
+                          AstroSwap(TOKEN2.get_info(),
+                                    TOKEN3.get_info()).to_dict(),
+                          AstroSwap(TOKEN3.get_info(), LUNA.get_info()).to_dict()])
+        with self.assertRaises(AssertionError):
+            config.parse_hops("<10>")
+        # the routes are compiled once per config version
+        self.assertIs(config.compile_route("<1><2>"),
+                      config.compile_route("<1><2>"))
+
+        # a new version of the snapshot is built every time the configuration is synced
+        self.sync.sync_dca_cfg()
+        self.assertIsNot(config, self.sync.get_config())
+        self.assertEqual(self.sync.get_config().version, 2)
+
+    def test_refresh_routes(self):
+        token5 = TokenAsset("denom5", "5000")
+        token6 = TokenAsset("denom6", "6000")
+        cfg = self.sync.dca.query_get_config.return_value
+        cfg['whitelisted_tokens'] = cfg['whitelisted_tokens'] + \
+            [token5.get_info().to_dict(), token6.get_info().to_dict()]
+        pairs = self.sync.dca.get_astro_pools.return_value['pairs']
+        pairs.append({'asset_infos': [token5.get_info().to_dict(), token6.get_info().to_dict()],
+                      'contract_addr': 'contract_addr5',
+                      'liquidity_token': 'liquidity_token5',
+                      'pair_type': {'xyk': {}}})
+
+        self.assertEqual(len(self.sync.db.get_routes()), 0)
+
+        # sync configuration
+        self.sync.sync_dca_cfg()
+
+        routes = self.sync.db.get_routes()
+        # 4 connected denoms (12 routes) + 2 connected denoms (2 routes)
+        self.assertEqual(len(routes), 14)
+        self.assertEqual(self.sync.get_routes("denom1", "uluna", 3),
+                         ["<1><2><inverse-3>"])
+        self.assertEqual(self.sync.get_routes("denom5", "denom6", 3),
+                         ["<4>"])
+        self.assertEqual([r.hops for r in self.sync.db.get_routes("denom1", "denom3")],
+                         ["<1><2>"])
+        self.assertEqual(self.sync.db.get_routes("denom1", "denom3", 1), [])
+        routes_denom5 = {r.id: r.hops for r in self.sync.db.get_routes("denom5")}
+
+        # sync again without any change: the routes are not rebuilt
+        self.sync.sync_dca_cfg()
+        self.assertEqual({r.id: r.hops for r in self.sync.db.get_routes()},
+                         {r.id: r.hops for r in routes})
+
+        # remove the hop denom2-denom3
+        del pairs[1]
+        self.sync.sync_dca_cfg()
+
+        self.assertEqual(self.sync.get_routes("denom1", "uluna", 3), [])
+        self.assertEqual(self.sync.get_routes("denom1", "denom2", 3), ["<1>"])
+        # the routes which are not connected to the removed hop are untouched
+        self.assertEqual({r.id: r.hops for r in self.sync.db.get_routes("denom5")},
+                         routes_denom5)
+
+        # the max_hops of the dca contract changes: all the routes are rebuilt
+        self.assertEqual(self.sync.get_routes_max_hops(), 3)
+        cfg['max_hops'] = 1
+        self.sync.sync_dca_cfg()
+        self.assertEqual(self.sync.get_routes_max_hops(), 1)
+        # denom1-denom2, denom5-denom6 and uluna-denom3 in both directions
+        self.assertEqual(sorted((r.start_denom, r.hops) for r in self.sync.db.get_routes()
+                                if r.start_denom in ["denom1", "denom5", "denom6"]),
+                         [("denom1", "<1>"), ("denom5", "<4>"), ("denom6", "<inverse-4>")])
+        self.assertTrue(all(r.hops_len == 1 for r in self.sync.db.get_routes()))
+        # a deeper route is computed on the fly
+        self.assertEqual(self.sync.get_routes("denom1", "denom3", 3), [])
+        pairs.insert(1, {'asset_infos': [TOKEN2.get_info().to_dict(), TOKEN3.get_info().to_dict()],
+                         'contract_addr': 'contract_addr2',
+                         'liquidity_token': 'liquidity_token2',
+                         'pair_type': {'xyk': {}}})
+        self.sync.sync_dca_cfg()
+        self.assertEqual([r.hops for r in self.sync.db.get_routes("denom1", "denom3")], [])
+        self.assertEqual(self.sync.get_routes("denom1", "denom3", 2), ["<1><5>"])
+
+    def test_refresh_pool_reserves(self):
+        self.sync.dca.query_pool.side_effect = lambda pair_addr: {
+            'assets': [TOKEN2.get_asset(), TOKEN3.get_asset()],
+            'total_share': '1000'} if pair_addr == 'contract_addr2' else {}
+
+        self.sync.sync_dca_cfg()
+
+        db_hops = self.sync.db.get_whitelisted_hops()
+        self.assertEqual(db_hops[1].pair_id, "denom2-denom3")
+        self.assertEqual(db_hops[1].pair_addr, "contract_addr2")
+        self.assertEqual(db_hops[1].pair_type, "xyk")
+
+        # the reserves are not queried during the sync of the configuration
+        self.assertEqual(len(self.sync.db.get_pool_reserve()), 0)
+
+        self.sync.refresh_pool_reserves(db_hops)
+        # the query of the other pairs failed
+        pool_reserves = self.sync.db.get_pool_reserve()
+        self.assertEqual(len(pool_reserves), 1)
+        self.assertEqual(pool_reserves[0].pair_id, "denom2-denom3")
+        self.assertEqual(pool_reserves[0].pair_type, "xyk")
+        self.assertEqual(pool_reserves[0].get_reserves(),
+                         {"denom2": 2000, "denom3": 3000})
+
+        simulator = self.sync.get_pool_simulator()
+        self.assertEqual(list(simulator.pools.keys()), ["denom2-denom3"])
+
+        # the reserves of denom2-denom3 are fresh
+        self.sync.dca.query_pool.reset_mock()
+        self.sync.refresh_pool_reserves(db_hops, 60)
+        self.assertEqual(self.sync.dca.query_pool.call_count, 2)
+        self.sync.refresh_pool_reserves(db_hops, 0)
+        self.assertEqual(self.sync.dca.query_pool.call_count, 5)
+
+        # the reserves are deleted with the whitelisted hop
+        del self.sync.dca.get_astro_pools.return_value['pairs'][1]
+        self.sync.sync_dca_cfg()
+        self.assertEqual(len(self.sync.db.get_pool_reserve()), 0)
+
+    def test_sync_pool_reserve(self):
+        from datetime import datetime, timedelta
+        self.sync.dca.query_pool.side_effect = lambda pair_addr: {
+            'assets': [TOKEN1.get_asset(), TOKEN2.get_asset()],
+            'total_share': '1000'}
+
+        self.sync.sync_dca_cfg()
+        self.sync.insert_user_into_db(TEST_USER)
+        self.sync.sync_user_data(TEST_USER)
+
+        # no order is scheduled
+        self.sync.sync_pool_reserve()
+        self.sync.dca.query_pool.assert_not_called()
+
+        # the order denom1 -> uluna is scheduled to run soon
+        order = self.sync.db.get_dca_orders(user_address=TEST_USER)[0]
+        order.schedule = True
+        order.next_run_time = datetime.utcnow() + timedelta(minutes=1)
+        self.sync.db.insert_or_update(order)
+
+        self.sync.sync_pool_reserve()
+        # only the pairs of the route '<1><2><inverse-3>' are queried
+        self.assertEqual(self.sync.dca.query_pool.call_count, 3)
+        self.assertEqual(len(self.sync.db.get_pool_reserve()), 3)
+
+        # the reserves are fresh
+        self.sync.sync_pool_reserve()
+        self.assertEqual(self.sync.dca.query_pool.call_count, 3)
+
     def test_fill_token_price_table(self):
         list_tp = self.sync.db.get_token_price()
         self.assertEqual(len(list_tp), 0)
@@ -537,7 +893,17 @@ def get_test_names():
         "test_sync_whitelisted_token",
         "test_sync_whitelisted_hop",
         "test_sync_user_data",
+        "test_sync_users_data",
+        "test_save_users_data_unchanged",
+        "test_sync_users_events",
+        "test_get_touched_users",
+        "test_query_contract_txs_backlog",
         "test_sync_dca_cfg",
+        "test_refresh_route_engine",
+        "test_refresh_config",
+        "test_refresh_routes",
+        "test_refresh_pool_reserves",
+        "test_sync_pool_reserve",
         "test_fill_token_price_table",
         "test_sync_token_price"
 
@@ -1,9 +1,14 @@
 
 import unittest
 import os
+from typing import List, Tuple
+from unittest import mock
 from unittest.mock import Mock
+from datetime import datetime, timedelta
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from terra_sdk.client.localterra import LocalTerra
-from bot.type import NativeAsset, TokenAsset
+from bot.type import NativeAsset, TokenAsset, Order, AssetInfo, AssetClass
 
 
 TOKEN1 = TokenAsset("denom1", "1000")
@@ -73,7 +78,11 @@ def mock_dca():
 
     }
 
+    mock.is_sync_broadcast.return_value = False
+    mock.sequence_manager.gas_model = None
     mock.simulate_swap_operations.side_effect = TOKEN_RECEIVE
+    mock.simulate_swap_operations_batch.side_effect = lambda list_swo, max_concurrency, timeout: \
+        TOKEN_RECEIVE[:len(list_swo)]
 
     return mock
 
@@ -102,12 +111,40 @@ class TestExecOrder(unittest.TestCase):
         self.eo.sync_dca_cfg()
 
         self.eo.insert_user_into_db(TEST_USER)
+        self.schedulers: List[Tuple[BackgroundScheduler, SQLAlchemyJobStore]] = []
 
     def tearDown(self):
         os.environ['DCA_BOT'] = 'test'
         from bot.db.database import drop_database_objects
+        for scheduler, jobstore in self.schedulers:
+            # the jobstore disposes the engine on shutdown which would drop the in-memory db
+            with mock.patch.object(jobstore, "shutdown"):
+                scheduler.shutdown(wait=False)
+            jobstore.jobs_t.drop(jobstore.engine)
         drop_database_objects()
 
+    def insert_orders(self, count: int, user_address: str = TEST_USER) -> List[str]:
+        """ Insert count orders of user_address purchasing denom3 with TOKEN1.
+
+            Returns:
+                List[str]: the ids of the orders.
+        """
+        from bot.db.table.dca_order import DcaOrder
+        for i in range(count):
+            self.eo.db.insert_or_update(DcaOrder(user_address, "0.1", 2, Order(
+                i, 0, TOKEN1, AssetInfo(AssetClass.TOKEN, "denom3"), 60, 0, 100)))
+        return [DcaOrder.build_id(user_address, i) for i in range(count)]
+
+    def start_scheduler(self, worker_id: str = "") -> Tuple[BackgroundScheduler, SQLAlchemyJobStore]:
+        """ Start a paused scheduler, which stores the jobs without running them. It is shut down by tearDown.
+        """
+        from bot.jobs import build_jobstores, PERSISTENT_JOBSTORE
+        jobstores = build_jobstores(worker_id)
+        scheduler = BackgroundScheduler(timezone='utc', jobstores=jobstores)
+        scheduler.start(paused=True)
+        self.schedulers.append((scheduler, jobstores[PERSISTENT_JOBSTORE]))
+        return scheduler, jobstores[PERSISTENT_JOBSTORE]
+
     def test_build_fee_redeem(self):
         # setup test
         from bot.db.table.user_tip_balance import UserTipBalance
@@ -135,6 +172,31 @@ class TestExecOrder(unittest.TestCase):
         with self.assertRaises(AssertionError):
             self.eo.build_fee_redeem(TEST_USER, 3)
 
+    def test_build_fee_schedule(self):
+        from bot.db.table.user_tip_balance import UserTipBalance
+        self.eo.db.insert_or_update(UserTipBalance(TEST_USER, TOKEN1))
+        self.eo.db.insert_or_update(UserTipBalance(TEST_USER, LUNA))
+
+        fee_schedule = self.eo.build_fee_schedule(TEST_USER, 3)
+        self.assertEqual([f.get_asset() for f in fee_schedule.get_fee_redeem(1)],
+                         [f.get_asset() for f in self.eo.build_fee_redeem(TEST_USER, 1)])
+        self.assertEqual([f.get_asset() for f in fee_schedule.get_fee_redeem(2)], [
+            TOKEN1.get_asset(), LUNA.get_asset()])
+        prices = {"denom1": 0.1, "uluna": 0.2}
+        self.assertEqual(fee_schedule.get_fee_redeem_usd(2, prices),
+                         1000 * 0.1 + 5000 * 0.2)
+
+        # the tip balance can't pay for 3 hops
+        with self.assertRaises(AssertionError):
+            fee_schedule.get_fee_redeem(3)
+        with self.assertRaises(AssertionError):
+            fee_schedule.get_fee_redeem(4)
+
+        # the tip balance is read once
+        self.eo.db.insert_or_update(UserTipBalance(
+            TEST_USER, NativeAsset("uluna", "15000")))
+        self.assertEqual(len(fee_schedule.get_fee_redeem(2)), 2)
+
     def test_choose_best_execution_hop1(self):
         from bot.db.table.token_price import TokenPrice
         from bot.db.table.user_tip_balance import UserTipBalance
@@ -268,15 +330,371 @@ class TestExecOrder(unittest.TestCase):
 
         self.assertEqual(best_hop, "<3>")
 
+    def test_choose_best_execution_hop_failed_simulation(self):
+        prices = {"denom3": 0.0003}
+        fee_reedem_usd = {'<3>': 0.1, '<1><2>': 0.2, '<3><inverse-2>': 0.2}
+
+        # the simulation of the best hop '<3><inverse-2>' failed (e.g. timeout)
+        self.eo.dca.simulate_swap_operations_batch.side_effect = None
+        self.eo.dca.simulate_swap_operations_batch.return_value = [
+            2000, 1000, None]
+
+        best_hop = self.eo.choose_best_execution_hop(
+            "denom3", 1000, fee_reedem_usd, prices)
+        self.assertEqual(best_hop, "<3>")
+
+        # all the candidate hops are simulated in a single batch
+        self.assertEqual(
+            self.eo.dca.simulate_swap_operations_batch.call_count, 1)
+        list_swo = self.eo.dca.simulate_swap_operations_batch.call_args[0][0]
+        self.assertEqual(len(list_swo), 3)
+        self.assertEqual(len(list_swo[1].operations), 2)
+        self.eo.dca.simulate_swap_operations.assert_not_called()
+
+    def test_choose_best_execution_hop_off_chain(self):
+        pools = {'contract_addr_1': [TOKEN1.get_info().to_dict(), TOKEN2.get_info().to_dict()],
+                 'contract_addr2': [TOKEN2.get_info().to_dict(), TOKEN3.get_info().to_dict()],
+                 'contract_addr4': [TOKEN1.get_info().to_dict(), TOKEN3.get_info().to_dict()]}
+        # the direct pool denom1-denom3 is very shallow
+        amounts = {'contract_addr_1': "1000000000",
+                   'contract_addr2': "1000000000",
+                   'contract_addr4': "1000"}
+
+        self.eo.dca.query_pool.side_effect = lambda pair_addr: {
+            'assets': [{'info': info, 'amount': amounts[pair_addr]} for info in pools[pair_addr]],
+            'total_share': '1'}
+        self.assertEqual(len(self.eo.db.get_pool_reserve()), 0)
+
+        self.eo.dca.simulate_swap_operations.side_effect = None
+        self.eo.dca.simulate_swap_operations.return_value = 994
+        prices = {"denom3": 1}
+        fee_reedem_usd = {'<3>': 0.1, '<1><2>': 0.2}
+
+        best_hop = self.eo.choose_best_execution_hop(
+            "denom3", 1000, fee_reedem_usd, prices)
+        self.assertEqual(best_hop, "<1><2>")
+
+        # the reserves of the candidate hops have been stored in the db
+        self.assertEqual(len(self.eo.db.get_pool_reserve()), 3)
+        self.assertEqual(self.eo.dca.query_pool.call_count, 3)
+
+        # only the winner is simulated on chain
+        self.eo.dca.simulate_swap_operations_batch.assert_not_called()
+        self.assertEqual(self.eo.dca.simulate_swap_operations.call_count, 1)
+        swo = self.eo.dca.simulate_swap_operations.call_args[0][0]
+        self.assertEqual(len(swo.operations), 2)
+
+        # the on-chain confirmation failed: fall back to the on-chain simulation of all the hops
+        self.eo.dca.simulate_swap_operations.side_effect = Exception("timeout")
+        self.eo.dca.simulate_swap_operations_batch.side_effect = None
+        self.eo.dca.simulate_swap_operations_batch.return_value = [500, 400]
+        best_hop = self.eo.choose_best_execution_hop(
+            "denom3", 1000, fee_reedem_usd, prices)
+        self.assertEqual(best_hop, "<3>")
+        # the reserves are still fresh: no new pool queries
+        self.assertEqual(self.eo.dca.query_pool.call_count, 3)
+
+        # the on-chain amount diverges from the off-chain one (stale reserves): fall back as well
+        self.eo.dca.simulate_swap_operations.side_effect = None
+        self.eo.dca.simulate_swap_operations.return_value = 900
+        best_hop = self.eo.choose_best_execution_hop(
+            "denom3", 1000, fee_reedem_usd, prices)
+        self.assertEqual(best_hop, "<3>")
+        self.assertEqual(
+            self.eo.dca.simulate_swap_operations_batch.call_count, 2)
+
     def test_build_hops(self):
         pass
 
+    def test_purchase_batch(self):
+        self.insert_orders(5)
+        orders = sorted(self.eo.db.get_dca_orders(), key=lambda o: o.id)
+
+        # the purchase of the order 0 can't be prepared, the order 3 makes every tx fail
+        def _prepare_purchase(order):
+            assert order.dca_order_id != 0, "no hops"
+            return [], []
+
+        def _execute_batch(msgs):
+            assert 3 not in msgs, "tx failed"
+        self.eo.prepare_purchase = mock.Mock(side_effect=_prepare_purchase)
+        self.eo.dca.build_perform_dca_purchase_msg.side_effect = \
+            lambda user_address, id, hops, fee_redeem: id
+        self.eo.dca.execute_perform_dca_purchase_batch.side_effect = _execute_batch
+
+        self.eo.purchase_batch(orders)
+
+        # [1, 2, 3, 4] -> [1, 2], [3, 4] -> [3], [4]
+        calls = [c[0][0]
+                 for c in self.eo.dca.execute_perform_dca_purchase_batch.call_args_list]
+        self.assertEqual(calls, [[1, 2, 3, 4], [1, 2], [3, 4], [3], [4]])
+        for order in orders:
+            history = self.eo.db.get_purchase_history(str(order.id))
+            self.assertEqual(len(history), 1)
+            self.assertEqual(history[0].success,
+                             order.dca_order_id not in (0, 3))
+
+    def test_confirm_pending_txs(self):
+        from bot.db.table.pending_tx import PendingTx
+        ids = self.insert_orders(3)
+
+        def _execute(user_address, id, hops, fee_redeem):
+            result = mock.Mock()
+            result.txhash = "tx-{}".format(id)
+            result.code = 0
+            return result
+        self.eo.dca.is_sync_broadcast.return_value = True
+        self.eo.dca.execute_perform_dca_purchase.side_effect = _execute
+        self.eo.prepare_purchase = mock.Mock(return_value=([], []))
+        self.eo.sync_and_schedule = mock.Mock()
+
+        # the purchases return before their tx is confirmed
+        for order_id in ids:
+            self.eo.purchase_and_sync(order_id)
+        self.eo.sync_and_schedule.assert_not_called()
+        self.assertEqual(len(self.eo.db.get_pending_txs()), 3)
+        self.assertEqual(sorted(self.eo.db.get_tx_order_ids()), ids)
+        for order in self.eo.db.get_dca_orders():
+            # the order is held till its tx is confirmed
+            self.assertTrue(order.schedule)
+            self.assertGreater(order.next_run_time, datetime.utcnow())
+            history = self.eo.db.get_purchase_history(str(order.id))
+            self.assertEqual(history[0].txhash, "tx-{}".format(order.dca_order_id))
+            self.assertFalse(history[0].success)
+
+        # tx-0 succeeded, tx-1 failed and tx-2 is not in a block yet
+        info_ok = mock.Mock(code=None)
+        info_failed = mock.Mock(code=5, rawlog="max spread assertion")
+        self.eo.dca.query_tx_infos.return_value = {
+            "tx-0": info_ok, "tx-1": info_failed, "tx-2": None}
+        self.eo.confirm_pending_txs()
+        self.assertEqual([p.txhash for p in self.eo.db.get_pending_txs()], ["tx-2"])
+        self.assertTrue(self.eo.db.get_purchase_history(ids[0])[0].success)
+        history = self.eo.db.get_purchase_history(ids[1])[0]
+        self.assertFalse(history.success)
+        self.assertEqual(history.err_msg, "max spread assertion")
+        self.assertEqual(sorted([c[0][0].id for c in self.eo.sync_and_schedule.call_args_list]),
+                         ids[:2])
+        # the confirmed orders are released
+        for order in self.eo.db.get_dca_orders():
+            self.assertEqual(order.schedule, order.id == ids[2])
+
+        # the query of tx-2 keeps failing: the tx is confirmed once it expires
+        self.eo.dca.query_tx_infos.return_value = {}
+        self.eo.confirm_pending_txs()
+        self.assertEqual(len(self.eo.db.get_pending_txs()), 1)
+        pending_tx = PendingTx("tx-2")
+        pending_tx.create_at = datetime.utcnow() - timedelta(hours=1)
+        self.eo.db.insert_or_update(pending_tx)
+        self.eo.confirm_pending_txs()
+        self.assertEqual(len(self.eo.db.get_pending_txs()), 0)
+        history = self.eo.db.get_purchase_history(ids[2])[0]
+        self.assertFalse(history.success)
+        self.assertIn("not found", history.err_msg)
+        self.assertEqual(self.eo.sync_and_schedule.call_count, 3)
+
+    def test_confirm_pending_batch_txs(self):
+        ids = self.insert_orders(4)
+
+        def _execute_batch(msgs):
+            # the mempool accepts every tx
+            result = mock.Mock()
+            result.txhash = "tx-{}".format("-".join([str(m) for m in msgs]))
+            result.code = 0
+            return result
+
+        def _query_tx_infos(txhashes, max_concurrency, timeout):
+            # the order 3 makes every tx fail in the block
+            return {h: mock.Mock(code=5, rawlog="max spread assertion") if "3" in h.split("-")
+                    else mock.Mock(code=None) for h in txhashes}
+        self.eo.dca.is_sync_broadcast.return_value = True
+        self.eo.dca.build_perform_dca_purchase_msg.side_effect = \
+            lambda user_address, id, hops, fee_redeem: id
+        self.eo.dca.execute_perform_dca_purchase_batch.side_effect = _execute_batch
+        self.eo.dca.query_tx_infos.side_effect = _query_tx_infos
+        self.eo.prepare_purchase = mock.Mock(return_value=([], []))
+        self.eo.sync_and_schedule = mock.Mock()
+
+        self.eo.purchase_batch_and_sync(ids)
+        # tx-0-1-2-3 fails: its orders are purchased again in two halves
+        self.eo.confirm_pending_txs()
+        self.assertEqual(sorted([p.txhash for p in self.eo.db.get_pending_txs()]),
+                         ["tx-0-1", "tx-2-3"])
+        self.eo.sync_and_schedule.assert_not_called()
+        for order in self.eo.db.get_dca_orders():
+            self.assertTrue(order.schedule)
+        # tx-0-1 succeeds, tx-2-3 fails and is split again
+        self.eo.confirm_pending_txs()
+        self.assertEqual(sorted([p.txhash for p in self.eo.db.get_pending_txs()]),
+                         ["tx-2", "tx-3"])
+        # tx-2 succeeds, tx-3 fails on its own
+        self.eo.confirm_pending_txs()
+        self.assertEqual(len(self.eo.db.get_pending_txs()), 0)
+
+        calls = [c[0][0]
+                 for c in self.eo.dca.execute_perform_dca_purchase_batch.call_args_list]
+        self.assertEqual(calls, [[0, 1, 2, 3], [0, 1], [2, 3], [2], [3]])
+        for i, order_id in enumerate(ids):
+            history = self.eo.db.get_purchase_history(order_id)
+            self.assertEqual(history[-1].success, i != 3)
+            self.assertTrue(all(not h.success for h in history[:-1]))
+        self.assertEqual(sorted([c[0][0].id for c in self.eo.sync_and_schedule.call_args_list]),
+                         ids)
+        # the confirmed orders are released
+        for order in self.eo.db.get_dca_orders():
+            self.assertFalse(order.schedule)
+
+    def test_reconcile_jobs(self):
+        from bot.jobs import get_job_next_run_times
+        ids = self.insert_orders(3)
+        scheduler, jobstore = self.start_scheduler()
+        # the first start: every order is scheduled
+        drifted_orders = self.eo.reconcile_jobs(scheduler, jobstore)
+        self.assertEqual(len(drifted_orders), 3)
+        self.assertEqual(set(get_job_next_run_times(jobstore).keys()), set(ids))
+        scheduler.add_job("bot.jobs:purchase_and_sync", 'date', id="orphan-1",
+                          run_date=datetime.utcnow() + timedelta(minutes=1), args=["orphan-1"])
+
+        # restart: nothing has drifted but the orphan job
+        drifted_orders = self.eo.reconcile_jobs(scheduler, jobstore)
+        self.assertEqual(len(drifted_orders), 0)
+        self.assertEqual(set(get_job_next_run_times(jobstore).keys()), set(ids))
+
+        # the job of the first order is lost and the second order is moved
+        jobstore.remove_job(ids[0])
+        order = self.eo.db.get_dca_orders(ids[1])[0]
+        order.next_run_time = datetime.utcnow() + timedelta(hours=1)
+        self.eo.db.insert_or_update(order)
+
+        drifted_orders = self.eo.reconcile_jobs(scheduler, jobstore)
+        self.assertEqual(sorted([o.id for o in drifted_orders]), ids[:2])
+        job_next_run_times = get_job_next_run_times(jobstore)
+        for order in self.eo.db.get_dca_orders():
+            self.assertTrue(order.schedule)
+            self.assertAlmostEqual(job_next_run_times[order.id].timestamp(),
+                                   order.next_run_time.timestamp(), delta=1)
+
+    def test_rebalance(self):
+        from bot.db.table.user import User
+        from bot.jobs import get_job_next_run_times
+
+        other_user = "user_456"
+        self.eo.insert_user_into_db(other_user)
+        test_user_order_id = self.insert_orders(1)[0]
+        other_user_order_id = self.insert_orders(1, other_user)[0]
+
+        # the worker owns TEST_USER
+        owned_users = {TEST_USER}
+        self.eo.shard = Mock()
+        self.eo.shard.owns.side_effect = lambda u: u in owned_users
+        self.eo.shard.claim.return_value = True
+        self.eo.shard.get_acquired_users.side_effect = lambda users: [
+            u for u in users if u == other_user and u in owned_users]
+
+        scheduler, jobstore = self.start_scheduler("worker-1")
+        self.assertEqual(jobstore.jobs_t.name, "apscheduler_jobs_worker-1")
+        self.eo.schedule_orders(scheduler)
+        self.assertEqual(set(get_job_next_run_times(jobstore).keys()), {
+                         test_user_order_id})
+        self.assertFalse(self.eo.db.get_dca_orders(
+            other_user_order_id)[0].schedule)
+
+        # other_user moves to the worker and TEST_USER moves to another worker
+        for user_address in [TEST_USER, other_user]:
+            self.eo.db.insert_or_update(User(user_address, True))
+        owned_users = {other_user}
+        self.eo.shard.heartbeat.return_value = True
+        self.eo.heartbeat(scheduler, jobstore)
+        self.assertEqual(set(get_job_next_run_times(jobstore).keys()), {
+                         other_user_order_id})
+        # the acquired user is synced again
+        self.assertEqual([str(u.id) for u in self.eo.db.get_users(sync_data=False)],
+                         [other_user])
+
+    def test_order_lease(self):
+        from bot.jobs import get_job_next_run_times
+        from bot.shard import ShardCoordinator
+        order_id = self.insert_orders(1)[0]
+
+        # worker-2 holds the lease of the order, e.g. it owned the user before a rebalance
+        other_shard = ShardCoordinator(self.eo.db, "worker-2", 30, 100)
+        other_shard.heartbeat()
+        self.assertTrue(other_shard.claim(order_id, datetime.utcnow() + timedelta(hours=1)))
+        self.eo.shard = ShardCoordinator(self.eo.db, "worker-1", 30, 100)
+        self.eo.shard.owns = Mock(return_value=True)
+        self.eo.purchase = Mock(return_value=None)
+
+        scheduler, jobstore = self.start_scheduler("worker-1")
+        self.eo.heartbeat(scheduler, jobstore)
+        self.assertFalse(self.eo.shard.is_leader)
+        self.eo.schedule_orders(scheduler)
+        self.assertEqual(get_job_next_run_times(jobstore), {})
+        self.assertEqual(self.eo.unclaimed_order_ids, {order_id})
+        # a stale job of the order is not executed
+        self.eo.purchase_and_sync(order_id, scheduler)
+        self.eo.purchase.assert_not_called()
+
+        # the order is scheduled once worker-2 releases the lease
+        other_shard.release([order_id])
+        self.eo.heartbeat(scheduler, jobstore)
+        self.assertEqual(set(get_job_next_run_times(jobstore).keys()), {order_id})
+        self.assertEqual(self.eo.unclaimed_order_ids, set())
+        lease = self.eo.db.get_leases("worker-1")
+        self.assertEqual([str(l.name) for l in lease], [order_id])
+        self.assertGreater(lease[0].expire_at, self.eo.db.get_dca_orders(order_id)[0].next_run_time)
+        # worker-2 can't claim the order before its next run
+        self.assertFalse(other_shard.claim(order_id, datetime.utcnow()))
+
+    def test_reset_expired_orders(self):
+        from bot.db.table.pending_tx import PendingTx
+        from bot.jobs import set_executor, PURCHASE_JOB_FUNC
+        from bot.shard import ShardCoordinator
+        other_user = "user_456"
+        self.eo.insert_user_into_db(other_user)
+        ids = self.insert_orders(5)
+        other_user_order_id = self.insert_orders(1, other_user)[0]
+        for order_id in ids + [other_user_order_id]:
+            self.eo.db.update_schedule(
+                order_id, True, datetime.utcnow() - timedelta(minutes=1))
+
+        # the worker owns TEST_USER, worker-2 holds the lease of the order 3
+        other_shard = ShardCoordinator(self.eo.db, "worker-2", 30, 100)
+        other_shard.heartbeat()
+        self.assertTrue(other_shard.claim(ids[3], datetime.utcnow() + timedelta(hours=1)))
+        self.eo.shard = ShardCoordinator(self.eo.db, "worker-1", 30, 100)
+        self.eo.shard.owns = Mock(side_effect=lambda u: u == TEST_USER)
+        # the job of the order 0 is late, the order 1 is queued and the tx of the order 2 is pending
+        scheduler, _ = self.start_scheduler("worker-1")
+        scheduler.add_job(PURCHASE_JOB_FUNC, 'date', id=ids[0],
+                          run_date=datetime.utcnow() + timedelta(minutes=1), args=[ids[0]])
+        executor = Mock()
+        executor.is_pending.side_effect = lambda order_id: order_id == ids[1]
+        set_executor(executor)
+        self.addCleanup(set_executor, None)
+        self.eo.db.log_purchase_history(ids[2], 1000, "denom1", "denom3", 100, "<1>", "", False, "",
+                                        "tx-2")
+        self.eo.db.insert_or_update(PendingTx("tx-2"))
+
+        self.assertEqual(self.eo.reset_expired_orders(scheduler), 1)
+        for order in self.eo.db.get_dca_orders():
+            self.assertEqual(order.schedule, order.id != ids[4])
+
 
 def get_test_names():
     testNames = [
         "test_build_fee_redeem",
+        "test_build_fee_schedule",
         "test_choose_best_execution_hop1",
-        "test_choose_best_execution_hop2"
+        "test_choose_best_execution_hop2",
+        "test_choose_best_execution_hop_failed_simulation",
+        "test_choose_best_execution_hop_off_chain",
+        "test_purchase_batch",
+        "test_confirm_pending_txs",
+        "test_confirm_pending_batch_txs",
+        "test_reconcile_jobs",
+        "test_rebalance",
+        "test_order_lease",
+        "test_reset_expired_orders"
     ]
     testFullNames = [
         "test_exec_order.TestExecOrder.{}".format(t) for t in testNames]
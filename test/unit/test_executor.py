@@ -0,0 +1,183 @@
+import unittest
+import os
+import time
+import threading
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TestPurchaseExecutor(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        self.bot = mock.Mock()
+        self.bot.purchase_and_sync.side_effect = lambda order_id, scheduler: time.sleep(
+            0.2)
+
+    def test_submit(self):
+        from bot.executor import PurchaseExecutor
+        executor = PurchaseExecutor(self.bot, 4)
+        start = time.time()
+        futures = [executor.submit("order-{}".format(i)) for i in range(4)]
+        for f in futures:
+            f.result()
+        # the purchases run in parallel
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEqual(self.bot.purchase_and_sync.call_count, 4)
+        self.assertEqual(executor.pending(), 0)
+        executor.shutdown()
+
+    def test_submit_queued_once(self):
+        from bot.executor import PurchaseExecutor
+        executor = PurchaseExecutor(self.bot, 2)
+        future = executor.submit("order-1", "scheduler")
+        self.assertIs(executor.submit("order-1", "scheduler"), future)
+        self.assertEqual(executor.pending(), 1)
+        self.assertTrue(executor.is_pending("order-1"))
+        self.assertFalse(executor.is_pending("order-2"))
+        future.result()
+        self.assertFalse(executor.is_pending("order-1"))
+        self.bot.purchase_and_sync.assert_called_once_with(
+            "order-1", "scheduler")
+
+        # once executed the order can be queued again
+        executor.submit("order-1").result()
+        self.assertEqual(self.bot.purchase_and_sync.call_count, 2)
+        executor.shutdown()
+
+    def test_dca_thread_clients(self):
+        from terra_sdk.client.lcd import LCDClient
+        from terra_sdk.key.mnemonic import MnemonicKey
+        from bot.dca import DCA
+        terra = LCDClient("http://localhost:1317", "localterra")
+        dca = DCA(terra, terra.wallet(MnemonicKey()), "dca_addr")
+        self.assertIs(dca.terra, terra)
+
+        def _clients():
+            return (dca.terra, dca.terra, dca.wallet)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            terra1, terra2, wallet = pool.submit(_clients).result()
+        # every thread has its own client
+        self.assertIsNot(terra1, terra)
+        self.assertIs(terra1, terra2)
+        self.assertEqual(terra1.url, terra.url)
+        self.assertIs(wallet.lcd, terra1)
+        self.assertEqual(wallet.key.acc_address, dca.wallet.key.acc_address)
+
+    def test_dca_serialized_transactions(self):
+        from terra_sdk.client.lcd import LCDClient
+        from terra_sdk.key.mnemonic import MnemonicKey
+        from bot.dca import DCA
+        terra = LCDClient("http://localhost:1317", "localterra")
+        dca = DCA(terra, terra.wallet(MnemonicKey()), "dca_addr")
+        running = []
+        max_running = []
+
+        def _perform_transactions(terra, wallet, msgs):
+            running.append(msgs)
+            max_running.append(len(running))
+            time.sleep(0.05)
+            running.remove(msgs)
+
+        with mock.patch.object(dca.sequence_manager, "_perform_transactions",
+                               side_effect=_perform_transactions):
+            threads = [threading.Thread(target=dca._perform_transaction, args=[i])
+                       for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(max_running), 4)
+        self.assertEqual(max(max_running), 1)
+
+    def test_dca_tx_error(self):
+        from terra_sdk.client.lcd import LCDClient
+        from terra_sdk.key.mnemonic import MnemonicKey
+        from bot.dca import DCA
+        terra = LCDClient("http://localhost:1317", "localterra")
+        dca = DCA(terra, terra.wallet(MnemonicKey()), "dca_addr")
+        failed = mock.Mock(code=5, txhash="txhash", raw_log="insufficient funds")
+
+        # the single order and the batch paths both raise on a failed tx
+        with mock.patch.object(dca, "build_perform_dca_purchase_msg"), \
+                mock.patch.object(dca, "_perform_transaction", return_value=failed):
+            with self.assertRaises(AssertionError):
+                dca.execute_perform_dca_purchase("user", 1, [], [])
+        with mock.patch.object(dca, "_perform_transactions", return_value=failed):
+            with self.assertRaises(AssertionError):
+                dca.execute_perform_dca_purchase_batch([])
+
+        succeeded = mock.Mock(code=0)
+        with mock.patch.object(dca, "build_perform_dca_purchase_msg"), \
+                mock.patch.object(dca, "_perform_transaction", return_value=succeeded):
+            self.assertIs(dca.execute_perform_dca_purchase(
+                "user", 1, [], []), succeeded)
+
+
+class TestPurchaseBatcher(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        self.bot = mock.Mock()
+
+    def test_submit_window(self):
+        from bot.executor import PurchaseBatcher
+        batcher = PurchaseBatcher(self.bot, 0.2, 10)
+        batcher.submit("order-1", "scheduler")
+        batcher.submit("order-2", "scheduler")
+        batcher.submit("order-1", "scheduler")
+        self.assertEqual(batcher.pending(), 2)
+        self.assertTrue(batcher.is_pending("order-2"))
+        self.assertFalse(batcher.is_pending("order-3"))
+        self.bot.purchase_batch_and_sync.assert_not_called()
+
+        time.sleep(0.5)
+        self.bot.purchase_batch_and_sync.assert_called_once_with(
+            ["order-1", "order-2"], "scheduler")
+        self.assertEqual(batcher.pending(), 0)
+
+    def test_submit_full_batch(self):
+        from bot.executor import PurchaseBatcher
+        batcher = PurchaseBatcher(self.bot, 60, 2)
+        # the orders of the running batch are pending
+        running = []
+        self.bot.purchase_batch_and_sync.side_effect = lambda order_ids, scheduler: running.append(
+            [batcher.is_pending(o) for o in order_ids])
+        batcher.submit("order-1")
+        batcher.submit("order-2")
+        # a full batch is executed immediately
+        self.bot.purchase_batch_and_sync.assert_called_once_with(
+            ["order-1", "order-2"], None)
+        self.assertEqual(running, [[True, True]])
+        self.assertFalse(batcher.is_pending("order-1"))
+
+        batcher.submit("order-3")
+        batcher.shutdown()
+        self.assertEqual(self.bot.purchase_batch_and_sync.call_count, 2)
+
+
+def get_test_names():
+    testNames = [
+        "test_submit",
+        "test_submit_queued_once",
+        "test_dca_thread_clients",
+        "test_dca_serialized_transactions",
+        "test_dca_tx_error"
+    ]
+    testFullNames = [
+        "test_executor.TestPurchaseExecutor.{}".format(t) for t in testNames]
+    testNames = [
+        "test_submit_window",
+        "test_submit_full_batch"
+    ]
+    testFullNames += [
+        "test_executor.TestPurchaseBatcher.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,138 @@
+import unittest
+import os
+from unittest import mock
+
+
+def build_msg(hops: int, fee_redeem: int):
+    from terra_sdk.core.wasm import MsgExecuteContract
+    return MsgExecuteContract("terra1sender", "terra1contract", {"perform_dca_purchase": {
+        "user_address": "terra1user", "id": 1, "hops": [{}] * hops, "fee_redeem": [{}] * fee_redeem}})
+
+
+def build_result(height: int, gas_wanted: int, gas_used: int, code=None, codespace=None):
+    result = mock.Mock()
+    result.height = height
+    result.gas_wanted = gas_wanted
+    result.gas_used = gas_used
+    result.code = code
+    result.codespace = codespace
+    result.raw_log = ""
+    return result
+
+
+class TestGasModel(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        from bot.gas import GasModel
+        self.model = GasModel(1.5, 2)
+
+    def test_build_key(self):
+        from terra_sdk.core.bank import MsgSend
+        self.assertEqual(self.model.build_key([build_msg(2, 1)]),
+                         (("perform_dca_purchase", 2, 1),))
+        self.assertEqual(self.model.build_key([build_msg(2, 1), build_msg(1, 1)]),
+                         self.model.build_key([build_msg(1, 1), build_msg(2, 1)]))
+        self.assertIsNone(self.model.build_key([]))
+        self.assertIsNone(self.model.build_key(
+            [build_msg(1, 1), MsgSend("terra1a", "terra1b", "1uluna")]))
+
+    def test_get_fee(self):
+        from terra_sdk.core import Coins
+        msgs = [build_msg(2, 1)]
+        self.assertIsNone(self.model.get_fee(msgs, Coins("0.15uluna")))
+
+        self.model.update(msgs, 100000)
+        self.model.update(msgs, 120000)
+        fee = self.model.get_fee(msgs, Coins("0.15uluna"))
+        self.assertEqual(fee.gas_limit, 180000)
+        # same rounding as the fee estimated by the LCD
+        self.assertEqual(fee.amount, Coins(
+            "0.15uluna").mul(180000).to_int_ceil_coins())
+        # another shape is unknown
+        self.assertIsNone(self.model.get_gas([build_msg(3, 1)]))
+
+        # only the last txs of the window are considered
+        self.model.update(msgs, 100000)
+        self.model.update(msgs, 100000)
+        self.assertEqual(self.model.get_gas(msgs), 150000)
+
+        self.model.invalidate(msgs)
+        self.assertIsNone(self.model.get_gas(msgs))
+
+    def test_get_fee_denom(self):
+        from terra_sdk.core import Coins
+        from bot.gas import GasModel
+        msgs = [build_msg(2, 1)]
+        self.model.update(msgs, 100000)
+        gas_prices = Coins({"uluna": "0.15", "uusd": "0.2"})
+
+        # the fee is paid in a single denom
+        fee = self.model.get_fee(msgs, gas_prices)
+        self.assertEqual(fee.gas_limit, 150000)
+        self.assertEqual(fee.amount, Coins(
+            "0.15uluna").mul(150000).to_int_ceil_coins())
+
+        model = GasModel(1.5, 2, "uusd")
+        model.update(msgs, 100000)
+        self.assertEqual(model.get_fee(msgs, gas_prices).amount, Coins("30000uusd"))
+
+        # without a gas price for the fee denom the gas is simulated
+        self.assertIsNone(model.get_fee(msgs, Coins("0.15uluna")))
+
+    def test_sequence_manager(self):
+        from terra_sdk.core import Coins
+        from bot.sequence import SequenceManager
+        manager = SequenceManager(self.model)
+        terra = mock.Mock()
+        terra.gas_prices = Coins("0.15uluna")
+        wallet = mock.Mock()
+        wallet.account_number_and_sequence.return_value = {
+            "account_number": 7, "sequence": 5}
+        msgs = [build_msg(2, 1)]
+
+        def _fees():
+            return [c[0][0].fee for c in wallet.create_and_sign_tx.call_args_list]
+
+        # the first tx is simulated and its gas is learnt
+        terra.tx.broadcast.return_value = build_result(10, 150000, 100000)
+        manager.perform_transactions(terra, wallet, msgs)
+        self.assertIsNone(_fees()[0])
+        self.assertEqual(self.model.get_gas(msgs), 150000)
+
+        # the next tx uses the modelled fee
+        terra.tx.broadcast.return_value = build_result(11, 150000, 110000)
+        manager.perform_transactions(terra, wallet, msgs)
+        self.assertEqual(_fees()[1].gas_limit, 150000)
+        self.assertEqual(self.model.get_gas(msgs), 165000)
+
+        # out of gas with the modelled fee: the tx is simulated again
+        terra.tx.broadcast.side_effect = [
+            build_result(12, 165000, 165001, 11, "sdk"),
+            build_result(13, 250000, 200000)]
+        result = manager.perform_transactions(terra, wallet, msgs)
+        self.assertEqual(result.height, 13)
+        self.assertEqual(_fees()[2].gas_limit, 165000)
+        self.assertIsNone(_fees()[3])
+        self.assertEqual(self.model.get_gas(msgs), 300000)
+        self.assertEqual(manager.sequence, 9)
+
+
+def get_test_names():
+    testNames = [
+        "test_build_key",
+        "test_get_fee",
+        "test_get_fee_denom",
+        "test_sequence_manager"
+    ]
+    testFullNames = [
+        "test_gas.TestGasModel.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,69 @@
+import unittest
+import os
+import asyncio
+import time
+from unittest import mock
+
+
+def lcd_error(status: int):
+    from terra_sdk.exceptions import LCDResponseError
+    return LCDResponseError("error", mock.Mock(status=status))
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+
+    def test_token_bucket(self):
+        from bot.ratelimit import TokenBucket
+        bucket = TokenBucket(20, 5)
+        # a burst of capacity tokens
+        for _ in range(5):
+            self.assertEqual(bucket.try_acquire(), 0)
+        self.assertGreater(bucket.try_acquire(), 0)
+
+        async def _acquire(n):
+            for _ in range(n):
+                await bucket.acquire()
+        start = time.monotonic()
+        asyncio.run(_acquire(10))
+        # 10 tokens at 20 tokens per second
+        self.assertGreater(time.monotonic() - start, 0.4)
+
+    def test_retry_async(self):
+        from bot.ratelimit import retry_async
+        func = mock.AsyncMock(
+            side_effect=[lcd_error(429), lcd_error(503), "ok"])
+        self.assertEqual(asyncio.run(retry_async(func, 3, 0.01)), "ok")
+        self.assertEqual(func.call_count, 3)
+
+        # too many retries
+        func = mock.AsyncMock(side_effect=lcd_error(500))
+        with self.assertRaises(Exception):
+            asyncio.run(retry_async(func, 2, 0.01))
+        self.assertEqual(func.call_count, 3)
+
+        # a client error is not retried
+        func = mock.AsyncMock(side_effect=lcd_error(400))
+        with self.assertRaises(Exception):
+            asyncio.run(retry_async(func, 2, 0.01))
+        self.assertEqual(func.call_count, 1)
+
+
+def get_test_names():
+    testNames = [
+        "test_token_bucket",
+        "test_retry_async"
+    ]
+    testFullNames = [
+        "test_ratelimit.TestRateLimit.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,143 @@
+import unittest
+import os
+from bot.type import AssetInfo, AssetClass, AstroSwap
+
+
+def build_hop(id: int, offer_denom: str, ask_denom: str):
+    from bot.db.table.whitelisted_hop import WhitelistedHop
+    wh = WhitelistedHop(AstroSwap(AssetInfo(AssetClass.TOKEN, offer_denom),
+                                  AssetInfo(AssetClass.TOKEN, ask_denom)))
+    wh.id = id
+    return wh
+
+
+def build_token(denom: str):
+    from bot.db.table.whitelisted_token import WhitelistedToken
+    return WhitelistedToken(AssetInfo(AssetClass.TOKEN, denom))
+
+
+class TestRouteEngine(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        from bot.route import RouteEngine
+
+        # denom1 - denom2 - denom3 - denom4
+        #    \_______________/
+        self.hops = [build_hop(1, "denom1", "denom2"),
+                     build_hop(2, "denom2", "denom3"),
+                     build_hop(3, "denom1", "denom3"),
+                     build_hop(4, "denom4", "denom3")]
+        self.engine = RouteEngine(self.hops)
+
+    def test_get_routes(self):
+        self.assertEqual(self.engine.get_routes("denom1", "denom3", 1),
+                         ["<3>"])
+        self.assertEqual(self.engine.get_routes("denom1", "denom3", 3),
+                         ["<3>", "<1><2>"])
+        self.assertEqual(self.engine.get_routes("denom3", "denom1", 3),
+                         ["<inverse-3>", "<inverse-2><inverse-1>"])
+        self.assertEqual(self.engine.get_routes("denom2", "denom4", 2),
+                         ["<2><inverse-4>"])
+        self.assertEqual(self.engine.get_routes("denom2", "denom4", 3),
+                         ["<2><inverse-4>", "<inverse-1><3><inverse-4>"])
+
+    def test_get_routes_no_path(self):
+        self.assertEqual(self.engine.get_routes("denom1", "denom4", 1), [])
+        self.assertEqual(self.engine.get_routes("denom1", "denom1", 3), [])
+        self.assertEqual(self.engine.get_routes("denom1", "denom5", 3), [])
+
+    def test_get_routes_simple_path(self):
+        # no route visits the same denom twice
+        for route in self.engine.get_routes("denom1", "denom3", 4):
+            hop_ids = route.replace("inverse-", "").strip("<>").split("><")
+            self.assertEqual(len(hop_ids), len(set(hop_ids)))
+
+    def test_get_all_routes(self):
+        self.assertEqual(self.engine.get_all_routes("denom1", 1),
+                         {"denom2": ["<1>"], "denom3": ["<3>"]})
+        self.assertEqual(self.engine.get_all_routes("denom1", 2),
+                         {"denom2": ["<1>", "<3><inverse-2>"],
+                          "denom3": ["<3>", "<1><2>"],
+                          "denom4": ["<3><inverse-4>"]})
+
+    def test_get_neighborhood(self):
+        from bot.route import RouteEngine
+        # denom1 - denom2 - denom3 - denom4
+        engine = RouteEngine([self.hops[0], self.hops[1], self.hops[3]])
+        self.assertEqual(engine.get_neighborhood(["denom1"], 1),
+                         {"denom1", "denom2"})
+        self.assertEqual(engine.get_neighborhood(["denom1"], 2),
+                         {"denom1", "denom2", "denom3"})
+        self.assertEqual(engine.get_neighborhood(["denom1", "denom4"], 1),
+                         {"denom1", "denom2", "denom3", "denom4"})
+        self.assertEqual(engine.get_neighborhood(["denom5"], 3), {"denom5"})
+
+    def test_get_routes_memoized(self):
+        routes = self.engine.get_routes("denom1", "denom3", 3)
+        self.assertIs(routes, self.engine.get_routes("denom1", "denom3", 3))
+
+
+class TestCompiledRoute(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        self.asset_info_map = {d: AssetInfo(AssetClass.TOKEN, d)
+                               for d in ["denom1", "denom2", "denom3"]}
+        self.hop_map = {1: build_hop(1, "denom1", "denom2"),
+                        2: build_hop(2, "denom2", "denom3")}
+
+    def test_parse_steps(self):
+        from bot.route import CompiledRoute
+        self.assertEqual(CompiledRoute.parse_steps("<1>"), ((1, False),))
+        self.assertEqual(CompiledRoute.parse_steps("<1><inverse-2>"),
+                         ((1, False), (2, True)))
+
+    def test_compile(self):
+        from bot.route import CompiledRoute
+        from bot.util import parse_hops_from_string
+        route = CompiledRoute.compile(
+            "<2><inverse-1>", self.asset_info_map, self.hop_map)
+        self.assertEqual(len(route), 2)
+        self.assertEqual(route.get_hop_ids(), [2, 1])
+        expected = [AstroSwap(self.asset_info_map["denom2"], self.asset_info_map["denom3"]),
+                    AstroSwap(self.asset_info_map["denom2"], self.asset_info_map["denom1"])]
+        self.assertEqual(route.to_dict(), [op.to_dict() for op in expected])
+        # the string parser is a wrapper of the compiled route
+        operations = parse_hops_from_string("<2><inverse-1>",
+                                            [build_token(d) for d in self.asset_info_map],
+                                            list(self.hop_map.values()))
+        self.assertEqual([op.to_dict() for op in operations], route.to_dict())
+        # the payload is memoized
+        self.assertIs(route.to_dict(), route.to_dict())
+
+        with self.assertRaises(AssertionError):
+            CompiledRoute.compile("<3>", self.asset_info_map, self.hop_map)
+
+
+def get_test_names():
+    testNames = [
+        "test_get_routes",
+        "test_get_routes_no_path",
+        "test_get_routes_simple_path",
+        "test_get_all_routes",
+        "test_get_neighborhood",
+        "test_get_routes_memoized"
+    ]
+    testFullNames = [
+        "test_route.TestRouteEngine.{}".format(t) for t in testNames]
+    testNames = [
+        "test_parse_steps",
+        "test_compile"
+    ]
+    testFullNames += [
+        "test_route.TestCompiledRoute.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,118 @@
+import unittest
+import os
+from unittest import mock
+
+
+def build_result(height: int, code=None, raw_log: str = ""):
+    result = mock.Mock()
+    result.height = height
+    result.code = code
+    result.raw_log = raw_log
+    return result
+
+
+class TestSequenceManager(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        from bot.sequence import SequenceManager
+        self.manager = SequenceManager()
+        self.terra = mock.Mock()
+        self.wallet = mock.Mock()
+        self.wallet.account_number_and_sequence.return_value = {
+            "account_number": 7, "sequence": 5}
+
+    def _sequences(self):
+        return [c[0][0].sequence for c in self.wallet.create_and_sign_tx.call_args_list]
+
+    def test_perform_transactions(self):
+        self.terra.tx.broadcast.return_value = build_result(10)
+        self.manager.perform_transactions(self.terra, self.wallet, ["msg1"])
+        self.manager.perform_transactions(self.terra, self.wallet, ["msg2"])
+
+        # the account info is queried once and the sequence is increased locally
+        self.assertEqual(self.wallet.account_number_and_sequence.call_count, 1)
+        self.assertEqual(self._sequences(), [5, 6])
+        self.assertEqual(
+            self.wallet.create_and_sign_tx.call_args[0][0].account_number, 7)
+        self.assertEqual(self.manager.sequence, 7)
+
+        # a failed tx included in a block increases the sequence too
+        self.terra.tx.broadcast.return_value = build_result(11, 5, "failed")
+        self.manager.perform_transactions(self.terra, self.wallet, ["msg3"])
+        self.assertEqual(self.manager.sequence, 8)
+
+    def test_sequence_mismatch_result(self):
+        self.terra.tx.broadcast.side_effect = [
+            build_result(0, 32, "account sequence mismatch, expected 9, got 5: incorrect account sequence"),
+            build_result(10)]
+        self.manager.perform_transactions(self.terra, self.wallet, ["msg1"])
+        self.assertEqual(self._sequences(), [5, 9])
+        self.assertEqual(self.manager.sequence, 10)
+
+    def test_sequence_mismatch_error(self):
+        self.wallet.create_and_sign_tx.side_effect = [
+            Exception("account sequence mismatch, expected 6, got 5"), mock.Mock()]
+        self.terra.tx.broadcast.return_value = build_result(10)
+        self.manager.perform_transactions(self.terra, self.wallet, ["msg1"])
+        self.assertEqual(self._sequences(), [5, 6])
+        self.assertEqual(self.manager.sequence, 7)
+
+        # any other error is thrown
+        self.wallet.create_and_sign_tx.side_effect = Exception("out of gas")
+        with self.assertRaises(Exception):
+            self.manager.perform_transactions(
+                self.terra, self.wallet, ["msg2"])
+        self.assertEqual(self.manager.sequence, 7)
+
+    def test_broadcast_error(self):
+        self.terra.tx.broadcast.side_effect = Exception("timeout")
+        with self.assertRaises(Exception):
+            self.manager.perform_transactions(
+                self.terra, self.wallet, ["msg1"])
+        # the account info is synced again on the next tx
+        self.assertIsNone(self.manager.sequence)
+        self.terra.tx.broadcast.side_effect = None
+        self.terra.tx.broadcast.return_value = build_result(10)
+        self.manager.perform_transactions(self.terra, self.wallet, ["msg1"])
+        self.assertEqual(self.wallet.account_number_and_sequence.call_count, 2)
+
+    def test_sync_broadcast(self):
+        from bot.sequence import SequenceManager, BROADCAST_MODE_SYNC
+        manager = SequenceManager(broadcast_mode=BROADCAST_MODE_SYNC)
+        self.terra.tx.broadcast_sync.return_value = build_result(0, 0)
+        manager.perform_transactions(self.terra, self.wallet, ["msg1"])
+        manager.perform_transactions(self.terra, self.wallet, ["msg2"])
+        # the sequence increases for every tx accepted in the mempool
+        self.terra.tx.broadcast.assert_not_called()
+        self.assertEqual(self._sequences(), [5, 6])
+        self.assertEqual(manager.sequence, 7)
+
+        # a tx rejected by the mempool does not use the sequence
+        self.terra.tx.broadcast_sync.return_value = build_result(0, 5, "insufficient fees")
+        manager.perform_transactions(self.terra, self.wallet, ["msg3"])
+        self.assertIsNone(manager.sequence)
+
+        with self.assertRaises(AssertionError):
+            SequenceManager(broadcast_mode="async")
+
+
+def get_test_names():
+    testNames = [
+        "test_perform_transactions",
+        "test_sequence_mismatch_result",
+        "test_sequence_mismatch_error",
+        "test_broadcast_error",
+        "test_sync_broadcast"
+    ]
+    testFullNames = [
+        "test_sequence.TestSequenceManager.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
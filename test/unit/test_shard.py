@@ -0,0 +1,193 @@
+import unittest
+import os
+from unittest import mock
+from datetime import datetime, timedelta
+
+
+USERS = ["terra1user{}".format(i) for i in range(5000)]
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+        from bot.settings import DB_URL
+        from bot.settings.test import DB_URL as DB_URL_TEST
+        from bot.db.database import Database, create_database_objects
+        assert DB_URL == DB_URL_TEST, "invalid DB_URL={}".format(
+            DB_URL)
+
+        create_database_objects()
+        self.db = Database()
+
+    def tearDown(self):
+        os.environ['DCA_BOT'] = 'test'
+        from bot.db.database import drop_database_objects
+        drop_database_objects()
+
+    def test_hash_ring_balance(self):
+        from bot.shard import HashRing
+        workers = ["worker-{}".format(i) for i in range(4)]
+        ring = HashRing(workers, 100)
+        sizes = {w: 0 for w in workers}
+        for u in USERS:
+            sizes[ring.get_worker(u)] += 1
+        mean = len(USERS) / len(workers)
+        for w in workers:
+            self.assertGreater(sizes[w], 0.75 * mean, sizes)
+            self.assertLess(sizes[w], 1.25 * mean, sizes)
+
+        self.assertIsNone(HashRing([], 100).get_worker(USERS[0]))
+
+    def test_hash_ring_join(self):
+        from bot.shard import HashRing
+        workers = ["worker-{}".format(i) for i in range(4)]
+        ring = HashRing(workers, 100)
+        new_ring = HashRing(workers + ["worker-4"], 100)
+
+        moved = [u for u in USERS if ring.get_worker(
+            u) != new_ring.get_worker(u)]
+        # only the users of the new worker move
+        self.assertTrue(all(new_ring.get_worker(u) == "worker-4" for u in moved))
+        self.assertLess(len(moved), 0.3 * len(USERS))
+
+    def test_coordinator(self):
+        from bot.shard import ShardCoordinator
+        from bot.db.table.shard_worker import ShardWorker
+        shard1 = ShardCoordinator(self.db, "worker-1", 30, 100)
+        shard2 = ShardCoordinator(self.db, "worker-2", 30, 100)
+
+        self.assertTrue(shard1.owns(USERS[0]))
+        # worker-1 is alone in the ring
+        self.assertFalse(shard1.heartbeat())
+        started_at = self.db.query(ShardWorker)[0].started_at
+
+        # worker-2 joins the ring
+        self.assertTrue(shard2.heartbeat())
+        self.assertTrue(shard1.heartbeat())
+        self.assertEqual(self.db.get_live_workers(30), ["worker-1", "worker-2"])
+        owners = [shard1.owns(u) for u in USERS]
+        self.assertEqual(owners, [not shard2.owns(u) for u in USERS])
+        self.assertGreater(sum(owners), 0)
+        self.assertLess(sum(owners), len(USERS))
+        self.assertEqual(shard1.get_acquired_users(USERS), [])
+        self.assertEqual(shard1.get_partition_sizes(USERS), {
+            "worker-1": sum(owners), "worker-2": len(USERS) - sum(owners)})
+        # the heartbeat keeps the start time of the worker
+        self.assertEqual(self.db.query(ShardWorker, [ShardWorker.id == "worker-1"])[0].started_at,
+                         started_at)
+
+        # worker-2 leaves the ring and worker-1 takes over its users
+        shard2.leave()
+        self.assertTrue(shard1.heartbeat())
+        self.assertTrue(all(shard1.owns(u) for u in USERS))
+        self.assertEqual(sorted(shard1.get_acquired_users(USERS)),
+                         sorted([u for u, owned in zip(USERS, owners) if not owned]))
+
+        # a worker without heartbeat for worker_ttl seconds is not alive
+        self.assertEqual(self.db.get_live_workers(-1), [])
+
+    def test_claim_lease(self):
+        self.db.heartbeat_worker("worker-1")
+        self.db.heartbeat_worker("worker-2")
+        expire_at = datetime.utcnow() + timedelta(minutes=5)
+
+        self.assertTrue(self.db.claim_lease(
+            "order-1", "worker-1", expire_at, 30))
+        # the lease is held by a live worker
+        self.assertFalse(self.db.claim_lease(
+            "order-1", "worker-2", expire_at, 30))
+        # the holder renews its lease
+        self.assertTrue(self.db.claim_lease(
+            "order-1", "worker-1", datetime.utcnow() - timedelta(seconds=1), 30))
+        # the lease has expired
+        self.assertTrue(self.db.claim_lease(
+            "order-1", "worker-2", expire_at, 30))
+        # the holder is not alive anymore
+        self.db.remove_worker("worker-2")
+        self.assertTrue(self.db.claim_lease(
+            "order-1", "worker-1", expire_at, 30))
+
+        # a worker only releases its own leases
+        self.db.release_leases(["order-1"], "worker-2")
+        self.assertEqual([str(l.worker_id)
+                         for l in self.db.get_leases()], ["worker-1"])
+        self.db.release_leases(["order-1"], "worker-1")
+        self.assertEqual(self.db.get_leases(), [])
+
+    def test_leader_election(self):
+        from bot.shard import ShardCoordinator
+        shard1 = ShardCoordinator(self.db, "worker-1", 30, 100)
+        shard2 = ShardCoordinator(self.db, "worker-2", 30, 100)
+
+        shard1.heartbeat()
+        shard2.heartbeat()
+        self.assertTrue(shard1.is_leader)
+        self.assertFalse(shard2.is_leader)
+        shard1.heartbeat()
+        shard2.heartbeat()
+        self.assertTrue(shard1.is_leader)
+        self.assertFalse(shard2.is_leader)
+
+        # the leader leaves the ring
+        self.assertTrue(shard1.claim("order-1", datetime.utcnow()))
+        shard1.leave()
+        self.assertFalse(shard1.is_leader)
+        self.assertEqual(self.db.get_leases("worker-1"), [])
+        shard2.heartbeat()
+        self.assertTrue(shard2.is_leader)
+
+    def test_initialize_db(self):
+        from bot.shard import ShardCoordinator
+        from bot.db.database import is_database_created
+        from bot.db.table.shard_worker import ShardWorker
+        from bot.db_sync import initialize_db
+        shard1 = ShardCoordinator(self.db, "worker-1", 30, 100)
+        shard2 = ShardCoordinator(self.db, "worker-2", 30, 100)
+        self.assertTrue(is_database_created())
+        self.assertTrue(is_database_created([ShardWorker.__table__]))
+
+        with mock.patch("bot.db_sync.create_database_objects") as create_objects, \
+                mock.patch("bot.db_sync.Sync.sync_dca_cfg") as sync_dca_cfg, \
+                mock.patch("bot.db_sync.Sync.sync_users_data") as sync_users_data, \
+                mock.patch("bot.db_sync.Sync.initialize_token_price_table") as initialize_token_price_table:
+            # worker-1 joins the ring first and bootstraps the db
+            initialize_db(shard=shard1)
+            self.assertTrue(shard1.is_leader)
+            self.assertEqual(create_objects.call_count, 1)
+            self.assertEqual(initialize_token_price_table.call_count, 1)
+
+            # worker-2 only syncs the config and the users of its partition
+            initialize_db(shard=shard2)
+            self.assertFalse(shard2.is_leader)
+            self.assertEqual(self.db.get_live_workers(30), ["worker-1", "worker-2"])
+            self.assertEqual(create_objects.call_count, 1)
+            self.assertEqual(initialize_token_price_table.call_count, 1)
+            self.assertEqual(sync_dca_cfg.call_count, 2)
+            self.assertEqual(sync_users_data.call_count, 2)
+
+            # a worker can't reset the shared db
+            with self.assertRaises(AssertionError):
+                initialize_db(reset_db=True, shard=shard2)
+
+
+def get_test_names():
+    testNames = [
+        "test_hash_ring_balance",
+        "test_hash_ring_join",
+        "test_coordinator",
+        "test_claim_lease",
+        "test_leader_election",
+        "test_initialize_db"
+    ]
+    testFullNames = [
+        "test_shard.TestShard.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,72 @@
+import unittest
+import os
+from bot.type import AssetInfo, AssetClass, AstroSwap
+
+
+DENOM1 = AssetInfo(AssetClass.TOKEN, "denom1")
+DENOM2 = AssetInfo(AssetClass.TOKEN, "denom2")
+DENOM3 = AssetInfo(AssetClass.TOKEN, "denom3")
+COMMISSION_RATES = {"xyk": 0.003, "stable": 0.0005}
+
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        os.environ['DCA_BOT'] = 'test'
+
+    def test_xyk_swap(self):
+        from bot.simulator import xyk_swap
+        # return_amount = 1000000 - 1000000 * 1000000 // 1001000 = 999
+        # commission = int(999 * 0.003) = 2
+        self.assertEqual(xyk_swap(1000000, 1000000, 1000, 0.003), 997)
+        # the spread increases with the offer amount
+        self.assertEqual(xyk_swap(1000000, 1000000, 1000000, 0), 500000)
+        self.assertEqual(xyk_swap(0, 1000000, 1000, 0.003), 0)
+
+    def test_stable_swap(self):
+        from bot.simulator import stable_swap, xyk_swap
+        # balanced pool: the price is close to 1 and the spread is much lower than xyk
+        amount = stable_swap(10**12, 10**12, 10**11, 0, 100)
+        self.assertLess(amount, 10**11)
+        self.assertGreater(amount, xyk_swap(10**12, 10**12, 10**11, 0))
+        self.assertAlmostEqual(amount / 10**11, 1, delta=0.002)
+
+        self.assertEqual(stable_swap(1000000, 1000000, 1000, 0.0005, 10), 999)
+        self.assertEqual(stable_swap(1000000, 1000000, 0, 0.0005, 10), 0)
+
+    def test_simulate_swap_operations(self):
+        from bot.simulator import Pool, PoolSimulator
+        pools = {"denom1-denom2": Pool("xyk", {"denom1": 1000000, "denom2": 1000000}),
+                 "denom2-denom3": Pool("stable", {"denom2": 1000000, "denom3": 1000000})}
+        simulator = PoolSimulator(pools, COMMISSION_RATES, 10)
+
+        self.assertEqual(simulator.simulate_swap_operations(
+            1000, [AstroSwap(DENOM1, DENOM2)]), 997)
+        self.assertEqual(simulator.simulate_swap_operations(
+            1000, [AstroSwap(DENOM2, DENOM1)]), 997)
+        # denom1 -> denom2 (997) -> denom3
+        self.assertEqual(simulator.simulate_swap_operations(
+            1000, [AstroSwap(DENOM1, DENOM2), AstroSwap(DENOM2, DENOM3)]), 996)
+
+        # missing pool
+        self.assertIsNone(simulator.simulate_swap_operations(
+            1000, [AstroSwap(DENOM1, DENOM3)]))
+
+
+def get_test_names():
+    testNames = [
+        "test_xyk_swap",
+        "test_stable_swap",
+        "test_simulate_swap_operations"
+    ]
+    testFullNames = [
+        "test_simulator.TestSimulator.{}".format(t) for t in testNames]
+    return testFullNames
+
+
+if __name__ == '__main__':
+    testFullNames = get_test_names()
+    loader = unittest.TestLoader()
+    suite = loader.loadTestsFromNames(testFullNames)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)